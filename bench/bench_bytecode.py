@@ -0,0 +1,63 @@
+"""
+預編譯 bytecode (bytecode.py) 對遊戲啟動時間的影響：以合成的遊戲檔比較
+「python main.py」(每次從原始碼編譯) 與經 game_launcher.py --bytecode 從 bundle 中的 pyc 啟動。
+
+執行：python bench/bench_bytecode.py [--runs 5]
+"""
+import argparse
+import hashlib
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import bytecode  # noqa: E402
+import game_launcher  # noqa: E402
+from game_store import BlobStore, single_file_manifest  # noqa: E402
+
+def make_game(n_funcs):
+    body = "".join(f"def handler_{i}(state, event):\n"
+                   f"    if event == {i % 97}:\n"
+                   f"        return [state * {i} for _ in range(3)]\n"
+                   f"    return state\n\n" for i in range(n_funcs))
+    return "import sys\n" + body + "if __name__ == '__main__':\n    sys.exit(0)\n"
+
+def best_of(cmd, runs):
+    best = float("inf")
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        subprocess.run(cmd, check=True)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=5)
+    args = ap.parse_args()
+    print(f"{'source KB':>10}{'compile ms':>12}{'source ms':>11}{'bytecode ms':>13}{'speedup':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        store = BlobStore(os.path.join(tmp, "store"))
+        for n_funcs in (100, 2000, 20000):
+            game_dir = os.path.join(tmp, f"game{n_funcs}")
+            os.makedirs(game_dir)
+            main_py = os.path.join(game_dir, "main.py")
+            source = make_game(n_funcs).encode()
+            with open(main_py, "wb") as f:
+                f.write(source)
+            tmp_blob = store.temp_path()
+            with open(tmp_blob, "wb") as f:
+                f.write(source)
+            sha, size, _ = store.ingest(tmp_blob, hashlib.sha256(source).hexdigest())
+            t0 = time.perf_counter()
+            bundles, _ = bytecode.compile_bundles(store, single_file_manifest(sha, size)["files"])
+            compile_ms = (time.perf_counter() - t0) * 1e3
+            bytecode.extract_bundle(store.path(bundles[sys.implementation.cache_tag]["sha256"]), game_dir)
+
+            src_s = best_of([sys.executable, main_py], args.runs)
+            pyc_s = best_of(game_launcher.cold_command(main_py, [], bytecode=True), args.runs)
+            print(f"{size / 1024:>10.0f}{compile_ms:>12.0f}{src_s * 1e3:>11.0f}{pyc_s * 1e3:>13.0f}{src_s / pyc_s:>8.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Frame 編碼比較：JSON vs mpack (codec.py)。
+
+使用實際的 lobby 回應格式 (list_store_games、list_ratings、room_status、who_online)，
+量測 frame 大小與 encode / decode 時間。decode 以 memoryview 輸入，與 recv_json 相同。
+
+執行：python bench/bench_codec.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import codec  # noqa: E402
+from utils import encode_body, decode_body, ok  # noqa: E402
+
+def store_games(n):
+    return ok(games=[
+        {"gamename": f"Game{i:04d}", "owner": f"dev{i % 17}", "status": "PUBLISHED",
+         "latest": f"v1.{i % 7}.{i % 3}", "file_path": f"server_games/Game{i:04d}/main.py"}
+        for i in range(n)
+    ], req_id="r-1700000000000-abcde")
+
+def ratings(n):
+    return ok(ratings=[
+        {"username": f"player{i}", "score": 1 + i % 5, "comment": "好玩！" if i % 2 else "too hard"}
+        for i in range(n)
+    ], req_id="r-1700000000000-abcde")
+
+PAYLOADS = [
+    ("room_status", {"event": "room_status", "room": {
+        "id": "r1234", "owner": "alice", "gamename": "Ultimate",
+        "public": True, "open": True, "members": ["alice", "bob"]}}),
+    ("who_online 50", ok(users=[{"username": f"user{i}", "status": "ONLINE"} for i in range(50)])),
+    ("list_ratings 100", ratings(100)),
+    ("list_store_games 20", store_games(20)),
+    ("list_store_games 400", store_games(400)),
+]
+
+def bench(obj, name):
+    prefix, body = encode_body(obj, name)
+    frame = memoryview(bytes(prefix) + bytes(body))
+    assert decode_body(frame) == obj
+    n = max(50, 200000 // len(frame))
+    enc = timeit.timeit(lambda: encode_body(obj, name), number=n) / n * 1e6
+    dec = timeit.timeit(lambda: decode_body(frame), number=n) / n * 1e6
+    return len(frame), enc, dec
+
+def main():
+    print(f"mpack implementation: {codec.IMPLEMENTATION}")
+    print(f"{'payload':<22}{'codec':<7}{'bytes':>8}{'size%':>7}{'enc us':>9}{'dec us':>9}")
+    for label, obj in PAYLOADS:
+        base = None
+        for name in ("json", "mpack"):
+            size, enc, dec = bench(obj, name)
+            base = base or size
+            print(f"{label:<22}{name:<7}{size:>8}{size * 100 / base:>6.0f}%{enc:>9.1f}{dec:>9.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Frame 壓縮：壓縮率與 CPU 成本。
+
+對 list_store_games / list_ratings / who_online / list_rooms 等會隨資料量線性成長的回應，
+量測 JSON body 大小、zlib 壓縮後大小、壓縮/解壓時間 (不同 level)，
+以及是否能放進 MAX_LEN (64 KiB) 的 frame。
+
+執行：python bench/bench_compress.py
+"""
+import json
+import os
+import sys
+import timeit
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import ok, MAX_LEN  # noqa: E402
+
+def store_games(n):
+    return ok(games=[
+        {"gamename": f"Game{i:05d}", "owner": f"dev{i % 97}", "status": "PUBLISHED",
+         "latest": f"v1.{i % 7}.{i % 3}", "file_path": f"server_games/Game{i:05d}/main.py"}
+        for i in range(n)
+    ])
+
+def ratings(n):
+    comments = ["好玩！", "too hard", "五星推薦，畫面很棒", "lag 很嚴重", ""]
+    return ok(ratings=[
+        {"username": f"player{i}", "score": 1 + i % 5, "comment": comments[i % len(comments)]}
+        for i in range(n)
+    ])
+
+def who(n):
+    return ok(users=[{"username": f"user{i:05d}", "status": "ONLINE"} for i in range(n)])
+
+def rooms(n):
+    return ok(rooms=[
+        {"id": f"r{i:04d}", "owner": f"user{i}", "public": True, "open": i % 3 != 0,
+         "players": [f"user{i}", f"user{i + 1}"][: 1 + i % 2]}
+        for i in range(n)
+    ])
+
+PAYLOADS = [
+    ("list_store_games 100", store_games(100)),
+    ("list_store_games 3000", store_games(3000)),
+    ("list_ratings 2000", ratings(2000)),
+    ("who_online 5000", who(5000)),
+    ("list_rooms 1000", rooms(1000)),
+]
+
+def main():
+    print(f"{'payload':<24}{'raw B':>9}{'lvl':>4}{'zlib B':>9}{'ratio':>7}{'fits':>6}{'comp us':>10}{'decomp us':>11}")
+    for label, obj in PAYLOADS:
+        raw = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        for level in (1, 6, 9):
+            z = zlib.compress(raw, level)
+            n = max(5, 2000000 // len(raw))
+            c = timeit.timeit(lambda: zlib.compress(raw, level), number=n) / n * 1e6
+            d = timeit.timeit(lambda: zlib.decompress(z), number=n) / n * 1e6
+            fits = "yes" if len(z) + 1 <= MAX_LEN else "no"
+            print(f"{label:<24}{len(raw):>9}{level:>4}{len(z):>9}{len(raw) / len(z):>6.1f}x{fits:>6}{c:>10.1f}{d:>11.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+database.DB 的讀寫混合吞吐量：單一連線 + 全域鎖、WAL + 每執行緒唯讀連線 (read_pool)、
+再加上 group commit (寫入由單一執行緒批次 commit)。
+
+每個 client 一條執行緒直接呼叫 DB 方法 (不經過網路)，約 90% 讀取
+(list_store_games / list_ratings / show_status / who / my_downloads)、
+10% 寫入 (download_game / rate_game / create_room + delete_room)。
+
+執行：python bench/bench_db.py [--clients 1,8,32] [--seconds 3] [--write-ratio 0.1]
+     (--write-ratio 1 量測登入 / 開房尖峰時的純寫入吞吐量)
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import DB  # noqa: E402
+
+N_USERS = 200
+N_GAMES = 50
+N_RATINGS = 20
+
+def seed(db):
+    db.dev_register("dev", "pw")
+    for g in range(N_GAMES):
+        db.dev_create_game(f"game{g:03d}", "dev", f"store/{g}")
+        db.dev_set_game_status("dev", f"game{g:03d}", "PUBLISHED")
+    for u in range(N_USERS):
+        db.register(f"user{u}", "pw")
+        db.login(f"user{u}", "pw")
+        db.download_game(f"user{u}", f"game{u % N_GAMES:03d}")
+    for i in range(N_RATINGS * N_GAMES):
+        u = i % N_USERS
+        db.rate_game(f"user{u}", f"game{u % N_GAMES:03d}", i % 5 + 1, "ok " * 10)
+
+def worker(db, wid, deadline, write_ratio, counts):
+    rnd = random.Random(wid)
+    reads = writes = 0
+    while time.perf_counter() < deadline:
+        u = rnd.randrange(N_USERS)
+        user, game = f"user{u}", f"game{u % N_GAMES:03d}"
+        if rnd.random() < write_ratio:
+            op = rnd.randrange(3)
+            if op == 0:
+                db.download_game(user, game)
+            elif op == 1:
+                db.rate_game(user, game, rnd.randint(1, 5), "bench")
+            else:
+                rid = f"b{wid}-{writes}"
+                db.create_room(rid, user, True)
+                db.delete_room(rid)
+            writes += 1
+        else:
+            op = rnd.randrange(5)
+            if op == 0:
+                db.list_store_games()
+            elif op == 1:
+                db.list_ratings(game)
+            elif op == 2:
+                db.show_status(user)
+            elif op == 3:
+                db.who(False)
+            else:
+                db.my_downloads(user)
+            reads += 1
+    counts.append((reads, writes))
+
+def run(db, clients, seconds, write_ratio):
+    counts = []
+    deadline = time.perf_counter() + seconds
+    threads = [threading.Thread(target=worker, args=(db, i, deadline, write_ratio, counts)) for i in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sum(r for r, _ in counts) / seconds, sum(w for _, w in counts) / seconds
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--clients", default="1,8,32")
+    ap.add_argument("--seconds", type=float, default=3)
+    ap.add_argument("--write-ratio", type=float, default=0.1)
+    args = ap.parse_args()
+    print(f"{'clients':>8}{'mode':>12}{'reads/s':>10}{'writes/s':>10}{'total/s':>10}{'ops/batch':>11}")
+    with tempfile.TemporaryDirectory() as tmp:
+        dbs = {}
+        for mode, read_pool, group in (("global lock", False, False), ("wal+pool", True, False),
+                                       ("wal+group", True, True)):
+            dbs[mode] = DB(os.path.join(tmp, f"{mode.replace(' ', '_')}.db"), read_pool=read_pool, group_commit=group)
+            seed(dbs[mode])
+        for clients in (int(c) for c in args.clients.split(",")):
+            for mode, db in dbs.items():
+                r, w = run(db, clients, args.seconds, args.write_ratio)
+                batch = ""
+                if db.writer is not None and db.writer.stats["batches"]:
+                    batch = f"{db.writer.stats['ops'] / db.writer.stats['batches']:>11.1f}"
+                    db.writer.stats.update(batches=0, ops=0)
+                print(f"{clients:>8}{mode:>12}{r:>10.0f}{w:>10.0f}{r + w:>10.0f}{batch}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+DB server 前端在連線風暴下的表現：舊的 thread-per-connection (database.handle_client) 對上
+asyncio 版 (database.serve，SQLite 操作在固定大小的 executor 上跑)。
+
+server 在子行程中執行 (暫存目錄裡的新資料庫)；client 以 asyncio 同時開 --conns 條連線，
+每條連線送 --requests 個 who_online / list_store_games 後關閉，重複 --waves 次
+(--per-call 時每個請求都開一條新連線，模擬舊的「每次呼叫一條連線」)。
+回報吞吐量、延遲分位數，以及 server 行程的尖峰執行緒數與最大 RSS。
+
+執行：python bench/bench_db_server.py [--conns 50,500] [--requests 20] [--waves 3] [--per-call]
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from utils import encode_frame, gen_req_id, read_frame  # noqa: E402
+
+def serve_forever(mode):
+    """(子行程) 在目前目錄跑 DB server，第一行輸出 port"""
+    import database
+    if mode == "asyncio":
+        asyncio.run(database.serve("127.0.0.1", 0, started=lambda port: print(port, flush=True)))
+        return
+    srv = socket.socket()
+    srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    srv.bind(("127.0.0.1", 0))
+    srv.listen(database.LISTEN_BACKLOG)
+    print(srv.getsockname()[1], flush=True)
+    while True:
+        conn, addr = srv.accept()
+        threading.Thread(target=database.handle_client, args=(conn, addr), daemon=True).start()
+
+def proc_status(pid):
+    """(執行緒數, 最大 RSS MB)"""
+    fields = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            fields[key] = value.split()
+    return int(fields["Threads"][0]), int(fields["VmHWM"][0]) / 1024
+
+async def request(reader, writer, i):
+    action = "who_online" if i % 2 else "list_store_games"
+    writer.writelines(encode_frame({"action": action, "role": "user", "req_id": gen_req_id()}))
+    await writer.drain()
+    resp = await read_frame(reader)
+    return isinstance(resp, dict) and resp.get("status") == "OK"
+
+async def conn_worker(port, requests, per_call, latencies, errors):
+    conn = None
+    try:
+        for i in range(requests):
+            t0 = time.perf_counter()
+            if conn is None:
+                conn = await asyncio.open_connection("127.0.0.1", port)
+            if not await request(*conn, i):
+                errors.append(i)
+            latencies.append(time.perf_counter() - t0)
+            if per_call:
+                conn[1].close()
+                conn = None
+    except (ConnectionError, asyncio.IncompleteReadError):
+        errors.append(-1)
+    finally:
+        if conn is not None:
+            conn[1].close()
+
+async def storm(port, pid, conns, requests, waves, per_call):
+    latencies, errors = [], []
+    peak_threads = 0
+    stop = asyncio.Event()
+
+    async def sample():
+        nonlocal peak_threads
+        while not stop.is_set():
+            peak_threads = max(peak_threads, proc_status(pid)[0])
+            await asyncio.sleep(0.005)
+    sampler = asyncio.ensure_future(sample())
+    t0 = time.perf_counter()
+    for _ in range(waves):
+        await asyncio.gather(*(conn_worker(port, requests, per_call, latencies, errors) for _ in range(conns)))
+    seconds = time.perf_counter() - t0
+    stop.set()
+    await sampler
+    return seconds, sorted(latencies), errors, peak_threads
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--conns", default="50,500")
+    ap.add_argument("--requests", type=int, default=20)
+    ap.add_argument("--waves", type=int, default=3)
+    ap.add_argument("--per-call", action="store_true")
+    ap.add_argument("--serve", choices=("threads", "asyncio"), help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.serve:
+        serve_forever(args.serve)
+        return
+
+    print(f"{'conns':>6}{'server':>9}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'errors':>8}"
+          f"{'threads':>9}{'maxrss MB':>11}")
+    for conns in (int(c) for c in args.conns.split(",")):
+        for mode in ("threads", "asyncio"):
+            with tempfile.TemporaryDirectory() as tmp:
+                server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", mode], cwd=tmp,
+                                          stdout=subprocess.PIPE, text=True, env={**os.environ, "PYTHONPATH": ROOT})
+                try:
+                    port = int(server.stdout.readline())
+                    seconds, lat, errors, threads = asyncio.run(
+                        storm(port, server.pid, conns, args.requests, args.waves, args.per_call))
+                    rss = proc_status(server.pid)[1]
+                finally:
+                    server.kill()
+                    server.wait()
+            print(f"{conns:>6}{mode:>9}{len(lat) / seconds:>9.0f}{lat[len(lat) // 2] * 1e3:>9.1f}"
+                  f"{lat[int(len(lat) * 0.99)] * 1e3:>9.1f}{len(errors):>8}{threads:>9}{rss:>11.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+差異更新 (delta.py) 效果：以合成的 Python 遊戲檔模擬幾種常見的改版，
+比較完整檔案與 delta 的大小，以及 server 計算 / client 套用 delta 的時間。
+
+執行：python bench/bench_delta.py
+"""
+import hashlib
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import delta  # noqa: E402
+
+def make_game(n_funcs, rng):
+    return [f"def handler_{i}(state, event):\n"
+            f"    if event.kind == {rng.randint(0, 99)}:\n"
+            f"        state.score += {rng.randint(1, 999)}\n"
+            f"    return state  # {rng.random():.6f}\n\n" for i in range(n_funcs)]
+
+def patch_few_lines(lines, rng):
+    out = list(lines)
+    for _ in range(5):
+        i = rng.randrange(len(out))
+        out[i] = out[i].replace("+=", "-=")
+    return out
+
+def insert_feature(lines, rng):
+    out = list(lines)
+    out[len(out) // 3:len(out) // 3] = [f"# feature line {i}\n" for i in range(200)]
+    return out
+
+def refactor_tail(lines, rng):
+    cut = len(lines) * 9 // 10
+    return lines[:cut] + make_game(len(lines) - cut, rng)
+
+def rewrite(lines, rng):
+    return make_game(len(lines), rng)
+
+CASES = [("5-line patch", patch_few_lines), ("insert 200 lines", insert_feature),
+         ("rewrite last 10%", refactor_tail), ("full rewrite", rewrite)]
+
+def sha(b):
+    return hashlib.sha256(b).hexdigest()
+
+def main():
+    rng = random.Random(7)
+    print(f"{'game size':>10} {'change':<18}{'full B':>10}{'delta B':>10}{'ratio':>8}{'compute ms':>12}{'apply ms':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_funcs in (2000, 20000):
+            lines = make_game(n_funcs, rng)
+            base = "".join(lines).encode()
+            base_path = os.path.join(tmp, "base")
+            with open(base_path, "wb") as f:
+                f.write(base)
+            for label, change in CASES:
+                target = "".join(change(lines, rng)).encode()
+                d_path, out_path = os.path.join(tmp, "d"), os.path.join(tmp, "out")
+                t0 = time.perf_counter()
+                useful = delta.compute_delta(base, target, sha(base), sha(target), d_path,
+                                             int(len(target) * delta.MAX_DELTA_RATIO))
+                t1 = time.perf_counter()
+                if not useful:
+                    print(f"{len(base):>10} {label:<18}{len(target):>10}{'-':>10}{'full':>8}{(t1 - t0) * 1e3:>12.1f}{'-':>10}")
+                    continue
+                delta.apply_delta(base_path, d_path, out_path)
+                t2 = time.perf_counter()
+                with open(out_path, "rb") as f:
+                    assert f.read() == target
+                size = os.path.getsize(d_path)
+                print(f"{len(base):>10} {label:<18}{len(target):>10}{size:>10}{len(target) / size:>7.0f}x"
+                      f"{(t1 - t0) * 1e3:>12.1f}{(t2 - t1) * 1e3:>10.1f}")
+
+if __name__ == "__main__":
+    main()
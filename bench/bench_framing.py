@@ -0,0 +1,125 @@
+"""
+Framing micro-benchmark：比較舊版 (bytearray + bytes 複製、header+body 串接、data[total:] 切片)
+與 utils 目前的 recv_into / memoryview / sendmsg 實作。
+
+每種 payload 大小量測：
+- peak bytes：單一 frame 收/送過程中額外配置的最高記憶體 (tracemalloc)
+- copies：peak bytes / body 大小，約等於 body 被複製了幾份
+- us/frame：來回一個 frame 的平均時間
+
+執行：python bench/bench_framing.py
+"""
+import json
+import os
+import socket
+import struct
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utils  # noqa: E402
+
+# ---------- 舊版實作 (baseline) ----------
+def legacy_send_all(sock, data: bytes) -> bool:
+    total = 0
+    while total < len(data):
+        sent = sock.send(data[total:])
+        if sent == 0:
+            return False
+        total += sent
+    return True
+
+def legacy_send_frame(sock, body: bytes) -> bool:
+    header = struct.pack("!I", len(body))
+    return legacy_send_all(sock, header + body)
+
+def legacy_recv_exact(sock, n: int):
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            return None
+        buf.extend(chunk)
+    return bytes(buf)
+
+def legacy_recv_frame(sock):
+    hdr = legacy_recv_exact(sock, 4)
+    (length,) = struct.unpack("!I", hdr)
+    return legacy_recv_exact(sock, length)
+
+# ---------- 新版 (只量 framing，不含 json) ----------
+def new_send_frame(sock, body: bytes) -> bool:
+    st = utils.conn_state(sock)
+    with st.wlock:
+        utils._HDR.pack_into(st.whdr, 0, len(body))
+        return utils.send_vectored(sock, (st.whdr, body))
+
+def new_recv_frame(sock):
+    st = utils.conn_state(sock)
+    utils.recv_into_exact(sock, st.rhdr_view)
+    (length,) = utils._HDR.unpack(st.rhdr)
+    body = st.rview[:length]
+    utils.recv_into_exact(sock, body)
+    return body
+
+# ---------- payload ----------
+def make_payload(n_games: int) -> dict:
+    return {
+        "status": "OK",
+        "games": [
+            {"gamename": f"Game{i:04d}", "owner": f"dev{i % 17}", "status": "PUBLISHED",
+             "latest": "v1.2.3", "file_path": f"server_games/Game{i:04d}/main.py"}
+            for i in range(n_games)
+        ],
+    }
+
+def measure(send_fn, recv_fn, body, rounds):
+    a, b = socket.socketpair()
+    try:
+        # 暖機：讓 conn_state 的緩衝區先配置好，不計入每個 frame
+        send_fn(a, body)
+        recv_fn(b)
+
+        tracemalloc.start()
+        send_peak = recv_peak = 0
+        for _ in range(min(rounds, 50)):
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            send_fn(a, body)
+            send_peak = max(send_peak, tracemalloc.get_traced_memory()[1] - base)
+
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            recv_fn(b)
+            recv_peak = max(recv_peak, tracemalloc.get_traced_memory()[1] - base)
+        tracemalloc.stop()
+
+        t0 = time.perf_counter()
+        for _ in range(rounds):
+            send_fn(a, body)
+            recv_fn(b)
+        elapsed = time.perf_counter() - t0
+        return send_peak, recv_peak, elapsed / rounds * 1e6
+    finally:
+        a.close()
+        b.close()
+
+def main():
+    print(f"{'payload':<22}{'impl':<8}{'send peak B':>12}{'copies':>8}{'recv peak B':>12}{'copies':>8}{'us/frame':>10}")
+    for label, n_games, rounds in (("room_status (~0.2KB)", 0, 20000),
+                                   ("store 40 games (~5KB)", 40, 10000),
+                                   ("store 450 games (~60KB)", 450, 2000)):
+        payload = make_payload(n_games) if n_games else {
+            "event": "room_status",
+            "room": {"id": "r1234", "owner": "alice", "gamename": "Ultimate",
+                     "public": True, "open": True, "members": ["alice", "bob"]},
+        }
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        for impl, s_fn, r_fn in (("legacy", legacy_send_frame, legacy_recv_frame),
+                                 ("new", new_send_frame, new_recv_frame)):
+            sp, rp, us = measure(s_fn, r_fn, body, rounds)
+            print(f"{label:<22}{impl:<8}{sp:>12}{sp / len(body):>8.2f}{rp:>12}{rp / len(body):>8.2f}{us:>10.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+預熱直譯器 (game_launcher.py, GAME_LAUNCHER=warm) 對開局延遲的影響：
+量測「送出啟動 (相當於收到 game_started)」到遊戲 client 連上遊戲伺服器的時間，
+比較冷啟動 (每次開新的 python) 與把進入點交給已預熱的子直譯器。
+
+合成的遊戲 client 會 import 幾個常見模組後連到本機的假遊戲伺服器再結束。
+
+執行：python bench/bench_launcher.py [--runs 10]
+"""
+import argparse
+import os
+import queue
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from game_launcher import LaunchControl, WarmInterpreter, cold_command  # noqa: E402
+
+GAME = """import sys, socket, json, random, threading, struct
+s = socket.create_connection((sys.argv[1], int(sys.argv[2])))
+s.close()
+"""
+
+def game_server():
+    srv = socket.socket()
+    srv.bind(("127.0.0.1", 0))
+    srv.listen(16)
+
+    def loop():
+        while True:
+            conn, _ = srv.accept()
+            conn.close()
+    threading.Thread(target=loop, daemon=True).start()
+    return str(srv.getsockname()[1])
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=10)
+    args = ap.parse_args()
+    reports = queue.Queue()
+    control = LaunchControl(reports.put)
+    port = game_server()
+    results = {"cold": [], "warm": []}
+    with tempfile.TemporaryDirectory() as tmp:
+        entry = os.path.join(tmp, "main.py")
+        with open(entry, "w") as f:
+            f.write(GAME)
+        for _ in range(args.runs):
+            t0 = time.time()
+            proc = subprocess.Popen(cold_command(entry, ["127.0.0.1", port], control=control))
+            results["cold"].append((reports.get(timeout=30)["t"] - t0) * 1e3)
+            proc.wait()
+
+            warm = WarmInterpreter(control)
+            warm.start()
+            time.sleep(0.5)  # 玩家在房間等待的時間：預熱在這段時間完成
+            t0 = time.time()
+            proc = warm.launch(entry, ["127.0.0.1", port])
+            results["warm"].append((reports.get(timeout=30)["t"] - t0) * 1e3)
+            proc.wait()
+    control.close()
+    print(f"{'mode':>6}{'median ms':>11}{'min ms':>9}")
+    for mode, times in results.items():
+        print(f"{mode:>6}{statistics.median(times):>11.1f}{min(times):>9.1f}")
+
+if __name__ == "__main__":
+    main()
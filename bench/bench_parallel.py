@@ -0,0 +1,124 @@
+"""
+平行分塊下載 (transfer.py) vs 單一串流 (send_file / recv_file) 在高延遲連線上的吞吐量。
+
+loopback 上放一個延遲 proxy 模擬廣域網路：每個方向每次最多轉送 WINDOW bytes，
+轉送前等待 RTT/2。等同每條 TCP 串流每個 RTT 最多送出一個 window
+(實際網路上受 congestion / receive window 限制的情形)，單一串流吞吐量約為 WINDOW / RTT，
+多條串流可以疊加。
+
+執行：python bench/bench_parallel.py [--rtt-ms 40] [--size-mb 32]
+"""
+import argparse
+import hashlib
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import transfer  # noqa: E402
+from utils import send_file, recv_file  # noqa: E402
+
+WINDOW = 256 * 1024
+
+def _pipe(src, dst, delay):
+    try:
+        while True:
+            data = src.recv(WINDOW)
+            if not data:
+                break
+            time.sleep(delay)
+            dst.sendall(data)
+    except OSError:
+        pass
+    finally:
+        for s in (src, dst):
+            try:
+                s.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+def latency_proxy(upstream_port, rtt):
+    """回傳 proxy 的 port：每條進來的連線都轉接到 upstream_port，雙向各加 RTT/2 延遲"""
+    srv = socket.socket()
+    srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    srv.bind(("127.0.0.1", 0))
+    srv.listen(64)
+
+    def accept_loop():
+        while True:
+            client, _ = srv.accept()
+            up = socket.create_connection(("127.0.0.1", upstream_port))
+            threading.Thread(target=_pipe, args=(client, up, rtt / 2), daemon=True).start()
+            threading.Thread(target=_pipe, args=(up, client, rtt / 2), daemon=True).start()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    return srv.getsockname()[1]
+
+def single_stream_server():
+    srv = socket.socket()
+    srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    srv.bind(("127.0.0.1", 0))
+    srv.listen(8)
+    state = {}
+
+    def loop():
+        while True:
+            conn, _ = srv.accept()
+            send_file(conn, state["path"])
+            conn.close()
+
+    threading.Thread(target=loop, daemon=True).start()
+    return srv.getsockname()[1], state
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rtt-ms", type=float, default=40)
+    ap.add_argument("--size-mb", type=int, default=32)
+    args = ap.parse_args()
+    rtt = args.rtt_ms / 1000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, "game.bin")
+        data = os.urandom(args.size_mb << 20)
+        with open(src, "wb") as f:
+            f.write(data)
+        sha = hashlib.sha256(data).hexdigest()
+
+        print(f"file {args.size_mb} MiB, RTT {args.rtt_ms:.0f} ms, window {WINDOW // 1024} KiB per stream")
+        print(f"{'mode':<22}{'seconds':>9}{'MB/s':>9}{'ok':>5}")
+
+        port, state = single_stream_server()
+        state["path"] = src
+        proxy = latency_proxy(port, rtt)
+        dest = os.path.join(tmp, "single.bin")
+        t0 = time.perf_counter()
+        sock = socket.create_connection(("127.0.0.1", proxy))
+        good = recv_file(sock, dest)
+        sock.close()
+        sec = time.perf_counter() - t0
+        with open(dest, "rb") as f:
+            good = good and hashlib.sha256(f.read()).hexdigest() == sha
+        print(f"{'single stream':<22}{sec:>9.2f}{len(data) / sec / 1e6:>9.1f}{str(good):>5}")
+
+        ts = transfer.TransferServer("127.0.0.1", 0)
+        ts.start()
+        proxy = latency_proxy(ts.port, rtt)
+        chunk = transfer.chunk_size_for(len(data))
+        info = {"size": len(data), "chunk_size": chunk, "port": proxy,
+                "chunks": transfer.chunk_hashes(src, sha, chunk)}
+        for streams in (1, 2, 4, 8):
+            info["ticket"] = ts.tickets.issue("bench", src, len(data), sha, chunk)
+            dest = os.path.join(tmp, f"parallel{streams}.bin")
+            t0 = time.perf_counter()
+            good = transfer.fetch_parallel("127.0.0.1", info, dest, streams)
+            sec = time.perf_counter() - t0
+            with open(dest, "rb") as f:
+                good = good and hashlib.sha256(f.read()).hexdigest() == sha
+            print(f"{f'parallel x{streams}':<22}{sec:>9.2f}{len(data) / sec / 1e6:>9.1f}{str(good):>5}")
+        ts.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+以 lobby_core (asyncio) 在單一行程、單一執行緒裡模擬大量玩家，對 lobby 施加負載。
+
+每個玩家一條連線：註冊、登入後重複 --rounds 輪「瀏覽商城、列房間、線上名單、開房再離房」。
+回報整體吞吐量、請求延遲分位數，以及 client 行程的執行緒數與最大 RSS
+(舊的 LobbyClient 每個玩家要一條 listener 執行緒)。
+
+未指定 --host/--port 時，另開一個子行程在暫存目錄跑 DB server 與 lobby (thread-per-connection)。
+
+執行：python bench/bench_players.py [--players 50,200,500] [--rounds 5]
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from lobby_core import LobbyCore  # noqa: E402
+
+def _serve(handler):
+    srv = socket.socket()
+    srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    srv.bind(("127.0.0.1", 0))
+    srv.listen(1024)
+
+    def accept_loop():
+        while True:
+            conn, addr = srv.accept()
+            threading.Thread(target=handler, args=(conn, addr), daemon=True).start()
+    threading.Thread(target=accept_loop, daemon=True).start()
+    return srv.getsockname()[1]
+
+def serve_forever():
+    """(子行程) 在目前目錄跑 DB server + lobby，第一行輸出 lobby 的 port"""
+    import database
+    import lobby
+    from db_pool import DBPool
+    db_port = _serve(database.handle_client)
+    lobby.DB_POOL = DBPool("127.0.0.1", db_port, role="user")
+    print(_serve(lobby.handle_client), flush=True)
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        threading.Event().wait()
+
+async def player(host, port, name, rounds, latencies, errors):
+    core = LobbyCore()
+    await core.connect(host, port)
+
+    async def call(action, **kw):
+        t0 = time.perf_counter()
+        resp = await core.call(action, timeout=60, **kw)
+        latencies.append(time.perf_counter() - t0)
+        if resp.get("status") != "OK":
+            errors.append(f"{action}: {resp.get('msg')}")
+        return resp
+
+    await call("register", username=name, password="pw")
+    await call("login", username=name, password="pw")
+    for _ in range(rounds):
+        await call("list_store_games")
+        await call("list_rooms")
+        await call("who_online")
+        if (await call("create_room", gamename="bench", public=True)).get("status") == "OK":
+            await call("leave_room")
+    await core.close()
+
+async def run(host, port, players, rounds, tag):
+    latencies, errors = [], []
+    t0 = time.perf_counter()
+    await asyncio.gather(*(player(host, port, f"{tag}{i}", rounds, latencies, errors) for i in range(players)))
+    return time.perf_counter() - t0, sorted(latencies), errors
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--players", default="50,200,500")
+    ap.add_argument("--rounds", type=int, default=5)
+    ap.add_argument("--host")
+    ap.add_argument("--port", type=int)
+    ap.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.serve:
+        serve_forever()
+        return
+
+    server = None
+    tmp = tempfile.TemporaryDirectory()
+    host, port = args.host, args.port
+    if not port:
+        host = "127.0.0.1"
+        server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve"], cwd=tmp.name,
+                                  stdout=subprocess.PIPE, text=True, env={**os.environ, "PYTHONPATH": ROOT})
+        port = int(server.stdout.readline())
+    try:
+        print(f"{'players':>8}{'requests':>10}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'errors':>8}"
+              f"{'threads':>9}{'maxrss MB':>11}")
+        for n in (int(x) for x in args.players.split(",")):
+            seconds, lat, errors = asyncio.run(run(host, port, n, args.rounds, f"p{n}-{int(time.time())}-"))
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            print(f"{n:>8}{len(lat):>10}{len(lat) / seconds:>9.0f}{lat[len(lat) // 2] * 1e3:>9.1f}"
+                  f"{lat[int(len(lat) * 0.99)] * 1e3:>9.1f}{len(errors):>8}{threading.active_count():>9}{rss:>11.1f}")
+    finally:
+        if server:
+            server.kill()
+            server.wait()
+        tmp.cleanup()
+
+if __name__ == "__main__":
+    main()
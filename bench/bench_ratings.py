@@ -0,0 +1,79 @@
+"""
+商城列表帶評分平均：從 ratings 逐筆掃描彙總 (每次瀏覽都 GROUP BY) 對上
+rate_game 增量維護的 rating_stats (database.DB.list_store_games 的做法)。
+量測前先確認各個帶評分彙總的查詢 (商城、開發者遊戲列表、game_summary) 與 ratings 一致，
+有評價與沒有評價的遊戲都要能列出。
+
+執行：python bench/bench_ratings.py [--games 50] [--ratings 100,1000,10000] [--runs 20]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import DB  # noqa: E402
+
+SCAN_SQL = ("SELECT g.gamename, g.owner, g.status, g.latest, g.file_path, COUNT(r.id), AVG(r.score) "
+            "FROM games g LEFT JOIN ratings r ON r.gamename = g.gamename "
+            "WHERE g.status='PUBLISHED' GROUP BY g.gamename ORDER BY g.gamename")
+
+def seed(db, games, per_game):
+    db.dev_register("dev", "pw")
+    db.register("user", "pw")
+    for g in range(games):
+        name = f"game{g:03d}"
+        db.dev_create_game(name, "dev", f"store/{g}")
+        db.dev_set_game_status("dev", name, "PUBLISHED")
+        db.download_game("user", name)
+        for i in range(per_game):
+            db.rate_game("user", name, i % 5 + 1, "ok")
+
+def check(path):
+    db = DB(path)
+    db.dev_register("dev", "pw")
+    db.register("user", "pw")
+    for name in ("rated", "unrated"):
+        db.dev_create_game(name, "dev", "store/x")
+        db.dev_set_game_status("dev", name, "PUBLISHED")
+        db.download_game("user", name)
+    for score in (5, 4, 4):
+        db.rate_game("user", "rated", score, "ok")
+    expected = {"rated": (3, 4.33), "unrated": (0, None)}
+    for listing in (db.list_store_games(), db.dev_list_games("dev")):
+        got = {g["gamename"]: (g["rating_count"], g["rating_avg"]) for g in listing}
+        assert got == expected, got
+    _, info = db.game_summary("rated")
+    assert info["histogram"] == {"1": 0, "2": 0, "3": 0, "4": 2, "5": 1}, info
+
+def best_ms(fn, runs):
+    best = float("inf")
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1e3
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--games", type=int, default=50)
+    ap.add_argument("--ratings", default="100,1000,10000", help="每個遊戲的評價數")
+    ap.add_argument("--runs", type=int, default=20)
+    args = ap.parse_args()
+    print(f"{'ratings/game':>13}{'scan ms':>10}{'stats ms':>10}{'speedup':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        check(os.path.join(tmp, "check.db"))
+        for per_game in (int(n) for n in args.ratings.split(",")):
+            db = DB(os.path.join(tmp, f"r{per_game}.db"))
+            seed(db, args.games, per_game)
+
+            def scan():
+                with db._read() as conn:
+                    return conn.execute(SCAN_SQL).fetchall()
+            scan_ms = best_ms(scan, args.runs)
+            stats_ms = best_ms(db.list_store_games, args.runs)
+            print(f"{per_game:>13}{scan_ms:>10.2f}{stats_ms:>10.2f}{scan_ms / stats_ms:>8.1f}x")
+
+if __name__ == "__main__":
+    main()
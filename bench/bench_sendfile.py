@@ -0,0 +1,65 @@
+"""
+遊戲檔案傳輸：sendfile vs userspace 分塊複製。
+
+在 loopback 上以 utils.send_file 傳送同一個檔案多次，量測吞吐量與送出端 CPU 時間
+(thread_time 只計算送出執行緒本身)。
+
+執行：python bench/bench_sendfile.py [MB]
+"""
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utils  # noqa: E402
+
+def drain(sock, total):
+    buf = bytearray(1 << 20)
+    got = 0
+    while got < total:
+        n = sock.recv_into(buf)
+        if not n:
+            break
+        got += n
+
+def run(path, size, rounds, use_sendfile):
+    utils.USE_SENDFILE = use_sendfile
+    srv = socket.socket()
+    srv.bind(("127.0.0.1", 0))
+    srv.listen(1)
+    cli = socket.create_connection(srv.getsockname())
+    conn, _ = srv.accept()
+    reader = threading.Thread(target=drain, args=(cli, (size + 8) * rounds))
+    reader.start()
+    wall0, cpu0 = time.perf_counter(), time.thread_time()
+    for _ in range(rounds):
+        assert utils.send_file(conn, path)
+    cpu = time.thread_time() - cpu0
+    reader.join()
+    wall = time.perf_counter() - wall0
+    for s in (conn, cli, srv):
+        s.close()
+    return size * rounds / wall / 1e6, cpu / rounds * 1e3
+
+def main():
+    mb = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    size = mb * 1024 * 1024
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        f.write(os.urandom(size))
+        path = f.name
+    try:
+        rounds = max(3, 256 // mb)
+        print(f"file {mb} MiB x {rounds} rounds (sendfile available: {hasattr(os, 'sendfile')})")
+        print(f"{'mode':<10}{'MB/s':>10}{'sender CPU ms/file':>20}")
+        for label, flag in (("copy", False), ("sendfile", True)):
+            mbps, cpu_ms = run(path, size, rounds, flag)
+            print(f"{label:<10}{mbps:>10.0f}{cpu_ms:>20.1f}")
+        print("stats:", utils.transfer_stats())
+    finally:
+        os.unlink(path)
+
+if __name__ == "__main__":
+    main()
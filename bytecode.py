@@ -0,0 +1,151 @@
+"""
+遊戲原始碼預先編譯成 bytecode bundle (每個 Python 版本一份)。
+
+- dev_lobby 上傳時以 worker pool 平行呼叫 server 上各個版本的直譯器編譯一次，
+  每份 bundle 是一個 zip：<目錄>/__pycache__/<模組>.<cache_tag>.pyc (hash-based pyc，PEP 552)
+- server 自己的直譯器編譯失敗 (語法錯誤) 就拒絕這次上傳，不會等到開局才發現；
+  其他版本編譯失敗只代表該版本沒有 bundle (例如用了新語法)，玩家改從原始碼啟動
+- 玩家端下載對應自己 cache_tag 的 bundle 解到遊戲目錄，經 game_launcher.py --bytecode 從 pyc 啟動
+
+pyc 採 CHECKED_HASH：以原始碼雜湊驗證，和檔案 mtime 無關；原始碼被改過時 Python 會自行重新編譯。
+
+這個檔案同時是各版本直譯器執行的編譯 worker (python bytecode.py --worker)，
+worker 端只能用各版本都有的標準函式庫與語法。
+"""
+import os
+import sys
+import json
+import shutil
+import zipfile
+import tempfile
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# 逗號分隔的直譯器路徑；未設定時用 server 自己的直譯器加上 PATH 上找得到的 python3.X
+BYTECODE_PYTHONS = [p for p in os.getenv("BYTECODE_PYTHONS", "").split(",") if p]
+BYTECODE_WORKERS = int(os.getenv("BYTECODE_WORKERS", str(os.cpu_count() or 2)))
+COMPILE_TIMEOUT = 120
+
+class CompileError(ValueError):
+    pass
+
+_POOL = None
+_INTERPRETERS = None
+_LOCK = threading.Lock()
+
+def _pool() -> ThreadPoolExecutor:
+    global _POOL
+    with _LOCK:
+        if _POOL is None:
+            _POOL = ThreadPoolExecutor(max_workers=BYTECODE_WORKERS, thread_name_prefix="bytecode")
+        return _POOL
+
+def _cache_tag(python: str):
+    try:
+        out = subprocess.run([python, "-c", "import sys; print(sys.implementation.cache_tag)"],
+                             capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() if out.returncode == 0 and out.stdout.strip() else None
+
+def interpreters() -> dict:
+    """{cache_tag: 直譯器路徑}；第一次呼叫時偵測，同一個 cache_tag 只留一個"""
+    global _INTERPRETERS
+    with _LOCK:
+        if _INTERPRETERS is not None:
+            return _INTERPRETERS
+    found = {sys.implementation.cache_tag: sys.executable}
+    candidates = BYTECODE_PYTHONS or [shutil.which(f"python3.{minor}") for minor in range(8, 16)]
+    for python in filter(None, candidates):
+        tag = _cache_tag(python)
+        if tag and tag not in found:
+            found[tag] = python
+    with _LOCK:
+        _INTERPRETERS = found
+    return found
+
+def _compile_with(python: str, sources: dict, out_path: str) -> list:
+    """在子行程以 python 編譯 sources ({包內路徑: 原始碼檔案}) 成 bundle，回傳錯誤訊息清單"""
+    job = json.dumps({"sources": sources, "out": out_path})
+    try:
+        proc = subprocess.run([python, os.path.abspath(__file__), "--worker"], input=job,
+                              capture_output=True, text=True, timeout=COMPILE_TIMEOUT)
+    except (OSError, subprocess.SubprocessError) as e:
+        return [f"compiler failed: {e}"]
+    try:
+        return json.loads(proc.stdout)["errors"]
+    except (ValueError, KeyError):
+        return [f"compiler failed: {proc.stderr.strip()[-300:]}"]
+
+def compile_bundles(store, files: list):
+    """
+    把 manifest 的 files 中的 .py 以各版本直譯器平行編譯，bundle 收進 store。
+    回傳 ({cache_tag: {"sha256", "size"}}, {cache_tag: 錯誤訊息})；
+    server 自己的版本編譯失敗時丟出 CompileError (上傳應被拒絕)
+    """
+    sources = {f["path"]: os.path.abspath(store.path(f["sha256"])) for f in files if f["path"].endswith(".py")}
+    if not sources:
+        return {}, {}
+    jobs = {}
+    for tag, python in interpreters().items():
+        out = store.temp_path()
+        jobs[tag] = (out, _pool().submit(_compile_with, python, sources, out))
+    bundles, failed = {}, {}
+    try:
+        for tag, (out, fut) in jobs.items():
+            errors = fut.result()
+            if errors:
+                failed[tag] = "; ".join(errors)
+                continue
+            sha256, size, _ = store.ingest(out)
+            bundles[tag] = {"sha256": sha256, "size": size}
+    finally:
+        for out, _ in jobs.values():
+            if os.path.exists(out):
+                os.remove(out)
+    own = sys.implementation.cache_tag
+    if own in failed:
+        raise CompileError(failed[own])
+    return bundles, failed
+
+def extract_bundle(bundle_path: str, dest_dir: str):
+    """(玩家端) 把 bundle 中的 pyc 解到遊戲目錄；只接受 __pycache__/*.pyc"""
+    with zipfile.ZipFile(bundle_path) as zf:
+        for info in zf.infolist():
+            parts = info.filename.split("/")
+            if info.is_dir() or len(parts) < 2 or parts[-2] != "__pycache__" or not parts[-1].endswith(".pyc") \
+                    or any(p in ("", ".", "..") for p in parts):
+                raise ValueError(f"unexpected bundle member: {info.filename}")
+            out = os.path.join(dest_dir, *parts)
+            os.makedirs(os.path.dirname(out), exist_ok=True)
+            with zf.open(info) as src, open(out, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+
+def _worker():
+    """編譯 worker：stdin 讀 {"sources", "out"}，stdout 回 {"errors": [...]}"""
+    import py_compile
+    job = json.loads(sys.stdin.read())
+    errors = []
+    tag = sys.implementation.cache_tag
+    with tempfile.TemporaryDirectory() as tmp:
+        # 依路徑排序、固定時間戳，同樣的原始碼在同一版本永遠得到同樣的 bundle
+        with zipfile.ZipFile(job["out"], "w", zipfile.ZIP_DEFLATED) as zf:
+            for rel in sorted(job["sources"]):
+                head, name = os.path.split(rel)
+                arc = "/".join(filter(None, [head, "__pycache__", f"{name[:-3]}.{tag}.pyc"]))
+                cfile = os.path.join(tmp, "out.pyc")
+                try:
+                    py_compile.compile(job["sources"][rel], cfile=cfile, dfile=rel, doraise=True,
+                                       invalidation_mode=py_compile.PycInvalidationMode.CHECKED_HASH)
+                except py_compile.PyCompileError as e:
+                    errors.append(f"{rel}: {e.exc_type_name}: {e.exc_value}")
+                    continue
+                info = zipfile.ZipInfo(arc, date_time=(1980, 1, 1, 0, 0, 0))
+                info.compress_type = zipfile.ZIP_DEFLATED
+                with open(cfile, "rb") as f:
+                    zf.writestr(info, f.read())
+    sys.stdout.write(json.dumps({"errors": errors}))
+
+if __name__ == "__main__" and sys.argv[1:] == ["--worker"]:
+    _worker()
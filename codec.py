@@ -0,0 +1,289 @@
+"""
+精簡二進位編碼 (msgpack 相容子集)，作為 JSON 以外可協商的 frame 編碼。
+
+支援型別與 JSON 相同：None / bool / int / float / str / list / tuple / dict，
+另外 bytes 會編成 msgpack bin。若環境有安裝 msgpack (C 擴充)，直接使用它；
+否則使用下方的純 Python 實作，兩者輸出格式相同，可互通。
+"""
+import struct
+from typing import Any
+
+_pack_u16 = struct.Struct(">H").pack
+_pack_u32 = struct.Struct(">I").pack
+_pack_u64 = struct.Struct(">Q").pack
+_pack_i8 = struct.Struct(">b").pack
+_pack_i16 = struct.Struct(">h").pack
+_pack_i32 = struct.Struct(">i").pack
+_pack_i64 = struct.Struct(">q").pack
+_pack_f64 = struct.Struct(">d").pack
+_unpack_u16 = struct.Struct(">H").unpack_from
+_unpack_u32 = struct.Struct(">I").unpack_from
+_unpack_u64 = struct.Struct(">Q").unpack_from
+_unpack_i8 = struct.Struct(">b").unpack_from
+_unpack_i16 = struct.Struct(">h").unpack_from
+_unpack_i32 = struct.Struct(">i").unpack_from
+_unpack_i64 = struct.Struct(">q").unpack_from
+_unpack_f32 = struct.Struct(">f").unpack_from
+_unpack_f64 = struct.Struct(">d").unpack_from
+
+# 短字串 (欄位名稱、狀態字串等) 重複率很高，快取編碼結果
+_STR_CACHE = {}
+_STR_CACHE_MAX = 4096
+
+def _json_key(k) -> str:
+    # 與 json.dumps 相同的 key 轉換規則，確保兩種編碼解出來的 dict 一致
+    if isinstance(k, str):
+        return k
+    if k is True:
+        return "true"
+    if k is False:
+        return "false"
+    if k is None:
+        return "null"
+    if isinstance(k, (int, float)):
+        return repr(k)
+    raise TypeError(f"keys must be str, int, float, bool or None, not {type(k).__name__}")
+
+def _encode_str(s: str) -> bytes:
+    b = s.encode("utf-8")
+    n = len(b)
+    if n < 32:
+        return bytes((0xa0 | n,)) + b
+    if n < 0x100:
+        return b"\xd9" + bytes((n,)) + b
+    if n < 0x10000:
+        return b"\xda" + _pack_u16(n) + b
+    return b"\xdb" + _pack_u32(n) + b
+
+def _encode(obj, out: bytearray):
+    t = type(obj)
+    if t is str:
+        enc = _STR_CACHE.get(obj)
+        if enc is None:
+            enc = _encode_str(obj)
+            if len(obj) <= 32 and len(_STR_CACHE) < _STR_CACHE_MAX:
+                _STR_CACHE[obj] = enc
+        out += enc
+    elif t is int:
+        if 0 <= obj < 0x80:
+            out.append(obj)
+        elif -32 <= obj < 0:
+            out.append(obj & 0xff)
+        elif obj >= 0:
+            if obj < 0x100:
+                out += b"\xcc" + bytes((obj,))
+            elif obj < 0x10000:
+                out += b"\xcd" + _pack_u16(obj)
+            elif obj < 0x100000000:
+                out += b"\xce" + _pack_u32(obj)
+            elif obj < 0x10000000000000000:
+                out += b"\xcf" + _pack_u64(obj)
+            else:
+                raise OverflowError("int too large for mpack")
+        else:
+            if obj >= -0x80:
+                out += b"\xd0" + _pack_i8(obj)
+            elif obj >= -0x8000:
+                out += b"\xd1" + _pack_i16(obj)
+            elif obj >= -0x80000000:
+                out += b"\xd2" + _pack_i32(obj)
+            elif obj >= -0x8000000000000000:
+                out += b"\xd3" + _pack_i64(obj)
+            else:
+                raise OverflowError("int too large for mpack")
+    elif t is dict:
+        n = len(obj)
+        if n < 16:
+            out.append(0x80 | n)
+        elif n < 0x10000:
+            out += b"\xde" + _pack_u16(n)
+        else:
+            out += b"\xdf" + _pack_u32(n)
+        for k, v in obj.items():
+            _encode(k if type(k) is str else _json_key(k), out)
+            _encode(v, out)
+    elif t is list or t is tuple:
+        n = len(obj)
+        if n < 16:
+            out.append(0x90 | n)
+        elif n < 0x10000:
+            out += b"\xdc" + _pack_u16(n)
+        else:
+            out += b"\xdd" + _pack_u32(n)
+        for v in obj:
+            _encode(v, out)
+    elif obj is None:
+        out.append(0xc0)
+    elif obj is True:
+        out.append(0xc3)
+    elif obj is False:
+        out.append(0xc2)
+    elif t is float:
+        out += b"\xcb" + _pack_f64(obj)
+    elif t is bytes or t is bytearray:
+        n = len(obj)
+        if n < 0x100:
+            out += b"\xc4" + bytes((n,))
+        elif n < 0x10000:
+            out += b"\xc5" + _pack_u16(n)
+        else:
+            out += b"\xc6" + _pack_u32(n)
+        out += obj
+    # 子類別 (例如 IntEnum、OrderedDict) 走較慢的 isinstance 判斷
+    elif isinstance(obj, bool):
+        out.append(0xc3 if obj else 0xc2)
+    elif isinstance(obj, int):
+        _encode(int(obj), out)
+    elif isinstance(obj, float):
+        _encode(float(obj), out)
+    elif isinstance(obj, str):
+        _encode(str(obj), out)
+    elif isinstance(obj, dict):
+        _encode(dict(obj), out)
+    elif isinstance(obj, (list, tuple)):
+        _encode(list(obj), out)
+    else:
+        raise TypeError(f"Object of type {t.__name__} is not mpack serializable")
+
+def _py_packb(obj: Any) -> bytes:
+    out = bytearray()
+    _encode(obj, out)
+    return out
+
+def _decode(buf: bytes, i: int):
+    b = buf[i]
+    i += 1
+    if b < 0x80:
+        return b, i
+    if b < 0x90:
+        return _decode_map(buf, i, b & 0x0f)
+    if b < 0xa0:
+        return _decode_array(buf, i, b & 0x0f)
+    if b < 0xc0:
+        n = i + (b & 0x1f)
+        return buf[i:n].decode("utf-8"), n
+    if b >= 0xe0:
+        return b - 0x100, i
+    if b == 0xc0:
+        return None, i
+    if b == 0xc2:
+        return False, i
+    if b == 0xc3:
+        return True, i
+    if b == 0xcc:
+        return buf[i], i + 1
+    if b == 0xcd:
+        return _unpack_u16(buf, i)[0], i + 2
+    if b == 0xce:
+        return _unpack_u32(buf, i)[0], i + 4
+    if b == 0xcf:
+        return _unpack_u64(buf, i)[0], i + 8
+    if b == 0xd0:
+        return _unpack_i8(buf, i)[0], i + 1
+    if b == 0xd1:
+        return _unpack_i16(buf, i)[0], i + 2
+    if b == 0xd2:
+        return _unpack_i32(buf, i)[0], i + 4
+    if b == 0xd3:
+        return _unpack_i64(buf, i)[0], i + 8
+    if b == 0xca:
+        return _unpack_f32(buf, i)[0], i + 4
+    if b == 0xcb:
+        return _unpack_f64(buf, i)[0], i + 8
+    if b == 0xd9:
+        n = buf[i]
+        i += 1
+        return buf[i:i + n].decode("utf-8"), i + n
+    if b == 0xda:
+        n = _unpack_u16(buf, i)[0]
+        i += 2
+        return buf[i:i + n].decode("utf-8"), i + n
+    if b == 0xdb:
+        n = _unpack_u32(buf, i)[0]
+        i += 4
+        return buf[i:i + n].decode("utf-8"), i + n
+    if b == 0xc4:
+        n = buf[i]
+        i += 1
+        return buf[i:i + n], i + n
+    if b == 0xc5:
+        n = _unpack_u16(buf, i)[0]
+        i += 2
+        return buf[i:i + n], i + n
+    if b == 0xc6:
+        n = _unpack_u32(buf, i)[0]
+        i += 4
+        return buf[i:i + n], i + n
+    if b == 0xdc:
+        return _decode_array(buf, i + 2, _unpack_u16(buf, i)[0])
+    if b == 0xdd:
+        return _decode_array(buf, i + 4, _unpack_u32(buf, i)[0])
+    if b == 0xde:
+        return _decode_map(buf, i + 2, _unpack_u16(buf, i)[0])
+    if b == 0xdf:
+        return _decode_map(buf, i + 4, _unpack_u32(buf, i)[0])
+    raise ValueError(f"unsupported mpack type byte 0x{b:02x}")
+
+def _decode_array(buf: bytes, i: int, n: int):
+    arr = []
+    append = arr.append
+    for _ in range(n):
+        b = buf[i]
+        if b < 0x80:
+            append(b)
+            i += 1
+        elif 0xa0 <= b < 0xc0:
+            j = i + 1 + (b & 0x1f)
+            append(buf[i + 1:j].decode("utf-8"))
+            i = j
+        else:
+            v, i = _decode(buf, i)
+            append(v)
+    return arr, i
+
+def _decode_map(buf: bytes, i: int, n: int):
+    d = {}
+    for _ in range(n):
+        # key 幾乎都是短字串 (fixstr)，直接在這裡解，省一次函式呼叫
+        b = buf[i]
+        if 0xa0 <= b < 0xc0:
+            j = i + 1 + (b & 0x1f)
+            k = buf[i + 1:j].decode("utf-8")
+            i = j
+        else:
+            k, i = _decode(buf, i)
+        b = buf[i]
+        if 0xa0 <= b < 0xc0:
+            j = i + 1 + (b & 0x1f)
+            d[k] = buf[i + 1:j].decode("utf-8")
+            i = j
+        elif b < 0x80:
+            d[k] = b
+            i += 1
+        else:
+            d[k], i = _decode(buf, i)
+    return d, i
+
+def _py_unpackb(buf) -> Any:
+    # bytes 的索引/切片比 memoryview 快得多，先轉一次
+    if type(buf) is not bytes:
+        buf = bytes(buf)
+    obj, i = _decode(buf, 0)
+    if i != len(buf):
+        raise ValueError("extra data after mpack object")
+    return obj
+
+try:
+    import msgpack as _msgpack  # 選用：有安裝時使用 C 實作
+
+    def packb(obj: Any) -> bytes:
+        return _msgpack.packb(obj, use_bin_type=True)
+
+    def unpackb(buf) -> Any:
+        return _msgpack.unpackb(buf, raw=False, strict_map_key=False)
+
+    IMPLEMENTATION = "msgpack"
+except ImportError:
+    packb = _py_packb
+    unpackb = _py_unpackb
+    IMPLEMENTATION = "python"
@@ -1,14 +1,35 @@
-import socket
+import os
+import asyncio
 import threading
 import sqlite3
 import json
-from typing import Optional
+import contextlib
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+from urllib.parse import quote
 
-from utils import ok, err, send_json, recv_json
+from utils import (ok, err, send_json, recv_json, with_req_id, serve_hello, negotiate_hello, hello_settings,
+                   encode_frame, read_frame, MAX_LEN)
 
 HOST = "140.113.17.11"
 PORT = 19805
 DB_PATH = "np_hw.db"
+# WAL 模式 + 每個執行緒一條唯讀連線：讀取不必排在寫入後面；設為 0 時退回單一連線 + 全域鎖
+DB_READ_POOL = os.getenv("DB_READ_POOL", "1") != "0"
+BUSY_TIMEOUT_MS = 5000
+# Group commit (需 WAL)：單一寫入執行緒把排隊中的寫入合併成一個 transaction，一次 commit / fsync。
+# 一批最多 GROUP_COMMIT_MAX 個操作；GROUP_COMMIT_MS > 0 時收到第一個操作後最多再等這麼久湊批，
+# 0 表示只合併「上一次 commit 期間排隊的操作」(不增加低負載時的延遲)
+DB_GROUP_COMMIT = os.getenv("DB_GROUP_COMMIT", "1") != "0"
+GROUP_COMMIT_MAX = int(os.getenv("DB_GROUP_COMMIT_MAX", "64"))
+GROUP_COMMIT_MS = float(os.getenv("DB_GROUP_COMMIT_MS", "0"))
+# asyncio server：SQLite 操作在固定 DB_WORKERS 條執行緒上跑 (唯讀連線也就最多這麼多條)，
+# 連線風暴時不會每條連線各開一條執行緒
+DB_WORKERS = int(os.getenv("DB_WORKERS", "16"))
+DB_CONN_INFLIGHT = int(os.getenv("DB_CONN_INFLIGHT", "16"))
+LISTEN_BACKLOG = 1024
 
 # 修正 1 & 2: 更新 Schema，加入 file_path, properties, user_plugins, relations
 SCHEMA_SQL = """
@@ -42,6 +63,17 @@ CREATE TABLE IF NOT EXISTS games(
   FOREIGN KEY(owner) REFERENCES developers(username)
 );
 
+-- [Architecture] 每個 (遊戲, 版本) 的內容清單，檔案本體存於內容定址 store (game_store.py)
+-- manifest: {"entry": "main.py", "files": [{"path", "sha256", "size"}]}
+CREATE TABLE IF NOT EXISTS game_versions(
+  gamename TEXT NOT NULL,
+  version  TEXT NOT NULL,
+  manifest TEXT NOT NULL,
+  created_at TIMESTAMP DEFAULT (datetime('now','localtime')),
+  PRIMARY KEY (gamename, version),
+  FOREIGN KEY(gamename) REFERENCES games(gamename) ON DELETE CASCADE
+);
+
 -- [Extensibility] Plugin 系統
 CREATE TABLE IF NOT EXISTS user_plugins(
   username TEXT NOT NULL,
@@ -83,6 +115,19 @@ CREATE TABLE IF NOT EXISTS ratings(
   FOREIGN KEY(username) REFERENCES users(username) ON DELETE CASCADE
 );
 
+-- 每個遊戲的評分彙總，rate_game 在同一個 transaction 裡更新；平均 = total / count
+CREATE TABLE IF NOT EXISTS rating_stats(
+  gamename TEXT PRIMARY KEY,
+  count INTEGER NOT NULL DEFAULT 0,
+  total INTEGER NOT NULL DEFAULT 0,
+  s1 INTEGER NOT NULL DEFAULT 0,
+  s2 INTEGER NOT NULL DEFAULT 0,
+  s3 INTEGER NOT NULL DEFAULT 0,
+  s4 INTEGER NOT NULL DEFAULT 0,
+  s5 INTEGER NOT NULL DEFAULT 0,
+  FOREIGN KEY(gamename) REFERENCES games(gamename) ON DELETE CASCADE
+);
+
 CREATE TABLE IF NOT EXISTS rooms(
   id TEXT PRIMARY KEY,
   owner TEXT NOT NULL,
@@ -104,6 +149,33 @@ CREATE TABLE IF NOT EXISTS invites(
 );
 """
 
+RATING_SCORES = range(1, 6)
+# 舊資料庫升級：還沒有彙總列的遊戲從 ratings 補算一次 (之後由 rate_game 增量維護)
+RATING_STATS_BACKFILL = """
+INSERT INTO rating_stats (gamename, count, total, s1, s2, s3, s4, s5)
+SELECT gamename, COUNT(*), SUM(score), SUM(score=1), SUM(score=2), SUM(score=3), SUM(score=4), SUM(score=5)
+FROM ratings WHERE gamename NOT IN (SELECT gamename FROM rating_stats) GROUP BY gamename
+"""
+
+PAGE_BYTES = MAX_LEN // 2
+
+def _fit_page(items, rows, limit, cursor_col):
+    """
+    [Paging] 分頁結果再依大小截斷，確保即使連線沒有協商壓縮，一頁也放得進單一 frame。
+    回傳 (items, next)；next 為最後一筆的游標，None 表示已是最後一頁
+    """
+    size = 0
+    for i, it in enumerate(items):
+        size += len(json.dumps(it, ensure_ascii=False).encode("utf-8")) + 1
+        if i and size > PAGE_BYTES:
+            return items[:i], rows[i - 1][cursor_col]
+    if len(rows) == limit and rows:
+        return items, rows[-1][cursor_col]
+    return items, None
+
+def _rating_avg(count, total) -> Optional[float]:
+    return round(total / count, 2) if count else None
+
 def _safe_exec(cur, sql, args: Optional[tuple] = None):
     try:
         if args:
@@ -115,32 +187,126 @@ def _safe_exec(cur, sql, args: Optional[tuple] = None):
 
 def reset_runtime(db):
     """重置執行期間的暫態資料，並同步清除記憶體快取"""
-    conn = db.conn
-    cur = conn.cursor()
-    _safe_exec(cur, "PRAGMA foreign_keys = ON;")
-    _safe_exec(cur, "DELETE FROM rooms;")
-    _safe_exec(cur, "DELETE FROM invites;")
-    _safe_exec(cur, "DELETE FROM user_plugins;") # 視需求是否重置
-    # 將所有人下線
-    _safe_exec(cur, "UPDATE users SET status='OFFLINE', last_login=NULL;")
-    conn.commit()
+    def reset(conn):
+        cur = conn.cursor()
+        _safe_exec(cur, "DELETE FROM rooms;")
+        _safe_exec(cur, "DELETE FROM invites;")
+        _safe_exec(cur, "DELETE FROM user_plugins;") # 視需求是否重置
+        # 將所有人下線
+        _safe_exec(cur, "UPDATE users SET status='OFFLINE', last_login=NULL;")
+    db._write(reset)
 
     # [State Consistency] 清空記憶體快取
-    with db.lock:
+    with db.cache_lock:
         db.online_cache.clear()
 
 def reset_dev_runtime(db):
-    conn = db.conn
-    cur = conn.cursor()
-    _safe_exec(cur, "PRAGMA foreign_keys = ON;")
-    _safe_exec(cur, "UPDATE developers SET status='OFFLINE', last_login=NULL;")
-    conn.commit()
+    db._execute("UPDATE developers SET status='OFFLINE', last_login=NULL;")
+
+class _WriteOp:
+    __slots__ = ("fn", "done", "result", "error")
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class GroupCommitter:
+    """
+    單一寫入執行緒：取出排隊的寫入操作，同一批在一個 transaction 內執行後只 commit 一次，
+    commit 完成 (資料已落地) 才讓各呼叫端返回。
+    每個操作包在自己的 SAVEPOINT 裡，某個操作失敗 (例如 IntegrityError) 只回滾它自己，
+    例外原樣丟回該呼叫端，同批其他操作照常 commit。
+    沒有寫入在排隊或進行中時，呼叫端直接在自己的執行緒 commit (低負載時不多付執行緒切換的延遲)。
+    """
+    def __init__(self, conn: sqlite3.Connection, max_ops: int = GROUP_COMMIT_MAX, max_wait_ms: float = GROUP_COMMIT_MS):
+        self.conn = conn
+        self.conn.isolation_level = None  # 由這裡自行 BEGIN / COMMIT
+        self.max_ops = max(1, max_ops)
+        self.max_wait = max_wait_ms / 1000
+        self.q = queue.Queue()
+        self.lock = threading.Lock()  # 執行中的 batch
+        self.owner = None             # 正在執行 batch 的執行緒
+        self.stats = {"batches": 0, "ops": 0}
+        self.thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, fn):
+        if self.owner == threading.get_ident():
+            return fn(self.conn)  # 在執行中的 batch 內巢狀呼叫
+        op = _WriteOp(fn)
+        if self.q.empty() and self.lock.acquire(blocking=False):
+            # 沒有其他寫入在排隊或進行中：直接在呼叫端 commit，省去兩次執行緒切換
+            try:
+                self._commit([op])
+            finally:
+                self.lock.release()
+        else:
+            self.q.put(op)
+            op.done.wait()
+        if op.error is not None:
+            raise op.error
+        return op.result
+
+    def _collect(self) -> list:
+        batch = [self.q.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_ops:
+            try:
+                wait = deadline - time.monotonic()
+                batch.append(self.q.get(timeout=wait) if wait > 0 else self.q.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            with self.lock:
+                self._commit(batch)
+
+    def _commit(self, batch: list):
+        self.owner = threading.get_ident()
+        try:
+            self.conn.execute("BEGIN")
+            for op in batch:
+                self.conn.execute("SAVEPOINT op")
+                try:
+                    op.result = op.fn(self.conn)
+                except BaseException as e:
+                    op.error = e
+                    self.conn.execute("ROLLBACK TO op")
+                self.conn.execute("RELEASE op")
+            self.conn.execute("COMMIT")
+            self.stats["batches"] += 1
+            self.stats["ops"] += len(batch)
+        except Exception as e:
+            # BEGIN / COMMIT 本身失敗：整批都沒有寫入
+            with contextlib.suppress(Exception):
+                self.conn.execute("ROLLBACK")
+            for op in batch:
+                if op.error is None:
+                    op.error = e
+        finally:
+            self.owner = None
+            for op in batch:
+                op.done.set()
 
 class DB:
-    def __init__(self, path: str):
-        self.conn = sqlite3.connect(path, check_same_thread=False)
+    """
+    self.conn 是唯一的寫入連線，所有寫入經 _write 序列化；
+    read_pool 開啟時 DB 以 WAL 模式運作，讀取改走目前執行緒自己的唯讀連線 (_read)，
+    與寫入、與其他執行緒的讀取都不互相等待 (WAL 下讀取看到的是最後一個已 commit 的版本)。
+    WAL 模式下寫入再交給 GroupCommitter 批次 commit (group_commit)。
+    """
+    def __init__(self, path: str, read_pool: bool = DB_READ_POOL, group_commit: bool = DB_GROUP_COMMIT):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=BUSY_TIMEOUT_MS / 1000)
         self.conn.row_factory = sqlite3.Row
-        self.lock = threading.Lock()
+        self.lock = threading.Lock()        # 寫入連線
+        self.cache_lock = threading.Lock()  # online_cache / dev_online_cache
+        self._local = threading.local()
         
         # [State Consistency] Memory Source of Truth
         # 用於解決 DB 狀態與實際連線不一致的問題
@@ -150,24 +316,60 @@ class DB:
         with self.lock, self.conn:
             self.conn.execute("PRAGMA foreign_keys = ON;")
             self.conn.executescript(SCHEMA_SQL)
+            self.conn.execute(RATING_STATS_BACKFILL)
+        # 記憶體 DB 無法共用給其他連線；檔案系統不支援 WAL 時 journal_mode 會維持原樣
+        self.read_pool = bool(read_pool) and path != ":memory:" and not path.startswith("file:") \
+            and self.conn.execute("PRAGMA journal_mode=WAL").fetchone()[0].lower() == "wal"
+        self.writer = GroupCommitter(self.conn) if self.read_pool and group_commit else None
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # 執行緒結束時 threading.local 釋放連線物件，連線隨之關閉
+            conn = sqlite3.connect(f"file:{quote(os.path.abspath(self.path))}?mode=ro", uri=True,
+                                   timeout=BUSY_TIMEOUT_MS / 1000)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _write(self, fn):
+        """
+        在寫入連線上以一個 transaction 執行 fn(conn) 並回傳其結果；fn 丟出例外時它的寫入全部回滾，
+        例外傳回呼叫端。返回時資料已 commit
+        """
+        if self.writer is not None:
+            return self.writer.submit(fn)
+        with self.lock, self.conn:
+            return fn(self.conn)
+
+    def _execute(self, sql: str, args: tuple = ()):
+        self._write(lambda conn: conn.execute(sql, args))
+
+    @contextlib.contextmanager
+    def _read(self):
+        """讀取用的連線：目前執行緒的唯讀連線，或 (未開啟 read_pool 時) 在全域鎖下的寫入連線"""
+        if self.read_pool:
+            yield self._reader()
+        else:
+            with self.lock:
+                yield self.conn
 
     # ================= User Auth & State =================
     
     def is_online(self, username: str) -> bool:
         # [State Consistency] 直接查記憶體，不再查 DB
-        with self.lock:
+        with self.cache_lock:
             return username in self.online_cache
 
     def register(self, username: str, password: str):
         if not username or not password:
             return False, "invalid args"
         try:
-            with self.lock, self.conn:
-                self.conn.execute(
-                    "INSERT INTO users (username, password, status) VALUES(?, ?, 'OFFLINE')",
-                    (username, password),
-                )
-                return True, "registered"
+            self._execute(
+                "INSERT INTO users (username, password, status) VALUES(?, ?, 'OFFLINE')",
+                (username, password),
+            )
+            return True, "registered"
         except sqlite3.IntegrityError:
             return False, "user exists"
         except Exception:
@@ -176,68 +378,69 @@ class DB:
     def login(self, username: str, password: str):
         if not username or not password:
             return False, "invalid args"
-        with self.lock:
-            cur = self.conn.execute(
+        with self._read() as conn:
+            row = conn.execute(
                 "SELECT id FROM users WHERE username=? AND password=?",
                 (username, password),
-            )
-            row = cur.fetchone()
-            if not row:
-                return False, "bad credential"
-            
-            # [State Consistency] 更新記憶體與 DB
+            ).fetchone()
+        if not row:
+            return False, "bad credential"
+
+        # [State Consistency] 更新記憶體與 DB
+        with self.cache_lock:
             self.online_cache.add(username)
-            with self.conn:
-                self.conn.execute(
-                    "UPDATE users SET status='ONLINE', last_login=datetime('now','localtime') WHERE username=?",
-                    (username,),
-                )
+        self._execute(
+            "UPDATE users SET status='ONLINE', last_login=datetime('now','localtime') WHERE username=?",
+            (username,),
+        )
         return True, "login"
 
     def logout(self, username: str):
         # 新增 Logout 方法，供 Explicit Quit 使用
-        with self.lock:
-            if username in self.online_cache:
-                self.online_cache.remove(username)
-                with self.conn:
-                    self.conn.execute("UPDATE users SET status='OFFLINE' WHERE username=?", (username,))
-                return True, "logged out"
-            return False, "not online"
+        with self.cache_lock:
+            if username not in self.online_cache:
+                return False, "not online"
+            self.online_cache.remove(username)
+        self._execute("UPDATE users SET status='OFFLINE' WHERE username=?", (username,))
+        return True, "logged out"
 
     def show_status(self, username: str):
         if not username: return False, "invalid args"
-        with self.lock:
-            # 優先回傳記憶體中的狀態
+        # 優先回傳記憶體中的狀態
+        with self.cache_lock:
             is_on = username in self.online_cache
-            status_str = "ONLINE" if is_on else "OFFLINE"
-            
-            cur = self.conn.execute("SELECT username, last_login, properties FROM users WHERE username=?", (username,))
-            row = cur.fetchone()
-            if not row: return False, "no such user"
-            
-            info = {
-                "username": row["username"],
-                "status": status_str,
-                "last_login": row["last_login"],
-                "properties": json.loads(row["properties"] or '{}') # [Extensibility]
-            }
+        status_str = "ONLINE" if is_on else "OFFLINE"
+
+        with self._read() as conn:
+            row = conn.execute("SELECT username, last_login, properties FROM users WHERE username=?", (username,)).fetchone()
+        if not row: return False, "no such user"
+
+        info = {
+            "username": row["username"],
+            "status": status_str,
+            "last_login": row["last_login"],
+            "properties": json.loads(row["properties"] or '{}') # [Extensibility]
+        }
         return True, info
 
     def who(self, only_online: bool):
         # 若只查線上，直接回傳 cache 內容，效能更好
         if only_online:
-            with self.lock:
-                return [{"username": u, "status": "ONLINE"} for u in sorted(list(self.online_cache))]
+            with self.cache_lock:
+                online = sorted(self.online_cache)
+            return [{"username": u, "status": "ONLINE"} for u in online]
         
         sql = "SELECT username, status FROM users ORDER BY username ASC"
-        with self.lock:
-            rows = self.conn.execute(sql).fetchall()
+        with self._read() as conn:
+            rows = conn.execute(sql).fetchall()
+        with self.cache_lock:
+            online = set(self.online_cache)
         
         # 修正：即使 DB 寫 OFFLINE，若在 Cache 中也視為 ONLINE (雖理論上同步，但以 Cache 為準)
         res = []
         for r in rows:
             u = r["username"]
-            real_status = "ONLINE" if u in self.online_cache else "OFFLINE"
+            real_status = "ONLINE" if u in online else "OFFLINE"
             res.append({"username": u, "status": real_status})
         return res
 
@@ -246,70 +449,68 @@ class DB:
     def add_friend(self, user_a, user_b):
         if user_a == user_b: return False, "cannot add self"
         try:
-            with self.lock, self.conn:
-                # 雙向關係或單向視需求而定，這裡示範建立單向好友請求
-                self.conn.execute(
-                    "INSERT OR IGNORE INTO relations (user_a, user_b, type) VALUES (?, ?, 'FRIEND')",
-                    (user_a, user_b)
-                )
+            # 雙向關係或單向視需求而定，這裡示範建立單向好友請求
+            self._execute(
+                "INSERT OR IGNORE INTO relations (user_a, user_b, type) VALUES (?, ?, 'FRIEND')",
+                (user_a, user_b)
+            )
             return True, "friend added"
         except Exception as e:
             return False, str(e)
 
     def list_friends(self, username):
-        with self.lock:
-            rows = self.conn.execute(
+        with self._read() as conn:
+            rows = conn.execute(
                 "SELECT user_b FROM relations WHERE user_a=? AND type='FRIEND'", (username,)
             ).fetchall()
         return [r["user_b"] for r in rows]
 
     def set_plugin_status(self, username, plugin_name, enabled: bool):
-        with self.lock, self.conn:
-            self.conn.execute(
-                "INSERT INTO user_plugins (username, plugin_name, is_enabled) VALUES(?,?,?) "
-                "ON CONFLICT(username, plugin_name) DO UPDATE SET is_enabled=excluded.is_enabled",
-                (username, plugin_name, 1 if enabled else 0)
-            )
+        self._execute(
+            "INSERT INTO user_plugins (username, plugin_name, is_enabled) VALUES(?,?,?) "
+            "ON CONFLICT(username, plugin_name) DO UPDATE SET is_enabled=excluded.is_enabled",
+            (username, plugin_name, 1 if enabled else 0)
+        )
         return True, "plugin updated"
 
     # ================= Developer =================
     
     def dev_login(self, username: str, password: str):
         # 類似 User Login，使用 dev_online_cache
-        with self.lock:
-            cur = self.conn.execute("SELECT id FROM developers WHERE username=? AND password=?", (username, password))
-            if not cur.fetchone(): return False, "bad credential"
-            
+        with self._read() as conn:
+            if not conn.execute("SELECT id FROM developers WHERE username=? AND password=?", (username, password)).fetchone():
+                return False, "bad credential"
+
+        with self.cache_lock:
             self.dev_online_cache.add(username)
-            with self.conn:
-                self.conn.execute("UPDATE developers SET status='ONLINE' WHERE username=?", (username,))
+        self._execute("UPDATE developers SET status='ONLINE' WHERE username=?", (username,))
         return True, "dev login"
 
     def dev_is_online(self, username: str) -> bool:
-        with self.lock:
+        with self.cache_lock:
             return username in self.dev_online_cache
             
     def dev_logout(self, username: str):
-        with self.lock:
-            if username in self.dev_online_cache:
-                self.dev_online_cache.remove(username)
-                with self.conn:
-                    self.conn.execute("UPDATE developers SET status='OFFLINE' WHERE username=?", (username,))
-                return True, "dev logout"
-            return False, "not online"
+        with self.cache_lock:
+            if username not in self.dev_online_cache:
+                return False, "not online"
+            self.dev_online_cache.remove(username)
+        self._execute("UPDATE developers SET status='OFFLINE' WHERE username=?", (username,))
+        return True, "dev logout"
             
     def dev_register(self, username, password):
         # 省略，邏輯同 user register，僅表名不同
         try:
-            with self.lock, self.conn:
-                self.conn.execute("INSERT INTO developers (username, password) VALUES(?,?)", (username, password))
-                return True, "dev registered"
+            self._execute("INSERT INTO developers (username, password) VALUES(?,?)", (username, password))
+            return True, "dev registered"
         except: return False, "error"
 
     def dev_list_games(self, owner: str):
-        with self.lock:
-            rows = self.conn.execute(
-                "SELECT id, gamename, status, latest, file_path FROM games WHERE owner=? ORDER BY gamename ASC",
+        with self._read() as conn:
+            rows = conn.execute(
+                "SELECT g.id, g.gamename, g.status, g.latest, g.file_path, s.count, s.total "
+                "FROM games g LEFT JOIN rating_stats s ON s.gamename = g.gamename "
+                "WHERE g.owner=? ORDER BY g.gamename ASC",
                 (owner,),
             ).fetchall()
         return [
@@ -319,6 +520,8 @@ class DB:
                 "status": r["status"],
                 "latest": r["latest"],
                 "file_path": r["file_path"],
+                "rating_count": r["count"] or 0,
+                "rating_avg": _rating_avg(r["count"], r["total"]),
             }
             for r in rows
         ]
@@ -326,11 +529,10 @@ class DB:
     def dev_create_game(self, gamename: str, owner: str, file_path: str = None):
         if not gamename or not owner: return False, "invalid args"
         try:
-            with self.lock, self.conn:
-                self.conn.execute(
-                    "INSERT INTO games (gamename, owner, file_path) VALUES(?, ?, ?)",
-                    (gamename, owner, file_path),
-                )
+            self._execute(
+                "INSERT INTO games (gamename, owner, file_path) VALUES(?, ?, ?)",
+                (gamename, owner, file_path),
+            )
             return True, "game created"
         except sqlite3.IntegrityError: return False, "game exists"
         except Exception: return False, "db error"
@@ -338,25 +540,70 @@ class DB:
     def dev_update_game_path(self, owner, gamename, file_path):
         # [Architecture] 更新檔案路徑的專用方法
         if not self.dev_is_owner(owner, gamename): return False, "not your game"
-        with self.lock, self.conn:
-            self.conn.execute("UPDATE games SET file_path=? WHERE gamename=?", (file_path, gamename))
+        self._execute("UPDATE games SET file_path=? WHERE gamename=?", (file_path, gamename))
         return True, "path updated"
         
     def dev_is_owner(self, owner: str, gamename: str) -> bool:
-        with self.lock:
-            cur = self.conn.execute("SELECT 1 FROM games WHERE gamename=? AND owner=?", (gamename, owner))
-            return cur.fetchone() is not None
+        with self._read() as conn:
+            return conn.execute("SELECT 1 FROM games WHERE gamename=? AND owner=?", (gamename, owner)).fetchone() is not None
 
     def dev_update_game(self, owner, gamename, version):
         if not self.dev_is_owner(owner, gamename): return False, "not your game"
-        with self.lock, self.conn:
-            self.conn.execute("UPDATE games SET latest=?, status='UPDATED' WHERE gamename=?", (version, gamename))
+        self._execute("UPDATE games SET latest=?, status='UPDATED' WHERE gamename=?", (version, gamename))
         return True, "updated"
 
+    def dev_add_version(self, owner, gamename, manifest: dict, file_path: Optional[str] = None,
+                        version: Optional[str] = None):
+        """
+        記錄 latest 版本的 manifest (同版本重複上傳則覆蓋)，舊版本保留供回滾。
+        帶 version 時同一個 transaction 內一併把 latest 改成該版本 (同 dev_update_game)，
+        玩家不會看到「版本號已更新、檔案還沒上傳」的中間狀態
+        """
+        if not self.dev_is_owner(owner, gamename): return False, "not your game"
+        if not isinstance(manifest, dict) or not manifest.get("files"): return False, "invalid manifest"
+        def add(conn):
+            if version:
+                conn.execute("UPDATE games SET latest=?, status='UPDATED' WHERE gamename=?", (version, gamename))
+            ver = conn.execute("SELECT latest FROM games WHERE gamename=?", (gamename,)).fetchone()["latest"]
+            conn.execute(
+                "INSERT INTO game_versions (gamename, version, manifest) VALUES(?,?,?) "
+                "ON CONFLICT(gamename, version) DO UPDATE SET manifest=excluded.manifest, created_at=datetime('now','localtime')",
+                (gamename, ver, json.dumps(manifest)),
+            )
+            if file_path:
+                conn.execute("UPDATE games SET file_path=? WHERE gamename=?", (file_path, gamename))
+            return ver
+        return True, self._write(add)
+
+    def dev_list_versions(self, owner, gamename):
+        if not self.dev_is_owner(owner, gamename): return False, "not your game"
+        with self._read() as conn:
+            rows = conn.execute(
+                "SELECT version, manifest, created_at FROM game_versions WHERE gamename=? ORDER BY created_at ASC, rowid ASC",
+                (gamename,),
+            ).fetchall()
+        return True, [
+            {"version": r["version"], "created_at": r["created_at"], "manifest": json.loads(r["manifest"])}
+            for r in rows
+        ]
+
+    def dev_rollback(self, owner, gamename, version):
+        """把 latest 指回一個已上傳過的版本"""
+        if not self.dev_is_owner(owner, gamename): return False, "not your game"
+        def rollback(conn):
+            if not conn.execute(
+                "SELECT 1 FROM game_versions WHERE gamename=? AND version=?", (gamename, version)
+            ).fetchone():
+                return False
+            conn.execute("UPDATE games SET latest=? WHERE gamename=?", (version, gamename))
+            return True
+        if not self._write(rollback):
+            return False, "no such version"
+        return True, "rolled back"
+
     def dev_set_game_status(self, owner, gamename, status):
         if not self.dev_is_owner(owner, gamename): return False, "not your game"
-        with self.lock, self.conn:
-            self.conn.execute("UPDATE games SET status=? WHERE gamename=?", (status, gamename))
+        self._execute("UPDATE games SET status=? WHERE gamename=?", (status, gamename))
         return True, "status changed"
 
     # ================= Lobby / Room =================
@@ -365,196 +612,510 @@ class DB:
     
     def create_room(self, room_id, owner, public):
         try:
-            with self.lock, self.conn:
-                self.conn.execute("INSERT INTO rooms (id, owner, public) VALUES(?,?,?)", (room_id, owner, 1 if public else 0))
+            self._execute("INSERT INTO rooms (id, owner, public) VALUES(?,?,?)", (room_id, owner, 1 if public else 0))
             return True, "created"
         except: return False, "error"
         
     def list_rooms(self, only_public=False):
         sql = "SELECT id, owner, public, open FROM rooms"
         if only_public: sql += " WHERE public=1"
-        with self.lock:
-            rows = self.conn.execute(sql).fetchall()
+        with self._read() as conn:
+            rows = conn.execute(sql).fetchall()
         return [{"id":r["id"], "owner":r["owner"], "public":bool(r["public"]), "open":bool(r["open"])} for r in rows]
 
     def close_room(self, room_id):
-        with self.lock, self.conn:
-            self.conn.execute("UPDATE rooms SET open=0 WHERE id=?", (room_id,))
+        self._execute("UPDATE rooms SET open=0 WHERE id=?", (room_id,))
         return True
 
     def delete_room(self, room_id):
-        with self.lock, self.conn:
-            self.conn.execute("DELETE FROM rooms WHERE id=?", (room_id,))
+        self._execute("DELETE FROM rooms WHERE id=?", (room_id,))
         return True
 
     # ================= Store / Downloads =================
-    def list_store_games(self):
-        with self.lock:
-            rows = self.conn.execute(
-                "SELECT gamename, owner, status, latest, file_path FROM games WHERE status='PUBLISHED' ORDER BY gamename ASC"
-            ).fetchall()
-        return [
+    def list_store_games(self, after: Optional[str] = None, limit: Optional[int] = None):
+        """
+        limit 為 None 時回傳全部 (舊行為)。
+        否則以 gamename 做 keyset 分頁：回傳 (rows, next)，next 為下一頁的 after 游標 (None 表示最後一頁)
+        """
+        # 評分彙總直接從 rating_stats 帶出，不必掃 ratings
+        sql = ("SELECT g.gamename, g.owner, g.status, g.latest, g.file_path, s.count, s.total "
+               "FROM games g LEFT JOIN rating_stats s ON s.gamename = g.gamename WHERE g.status='PUBLISHED'")
+        args = ()
+        if after is not None:
+            sql += " AND g.gamename > ?"
+            args = (after,)
+        sql += " ORDER BY g.gamename ASC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            args += (limit,)
+        with self._read() as conn:
+            rows = conn.execute(sql, args).fetchall()
+        games = [
             {
                 "gamename": r["gamename"],
                 "owner": r["owner"],
                 "status": r["status"],
                 "latest": r["latest"],
                 "file_path": r["file_path"],
+                "rating_count": r["count"] or 0,
+                "rating_avg": _rating_avg(r["count"], r["total"]),
             }
             for r in rows
         ]
+        if limit is None:
+            return games
+        return _fit_page(games, rows, limit, "gamename")
         
+    def game_manifest(self, gamename, version: Optional[str] = None):
+        """回傳 (ok, info)；info 含 game_status、version 與 manifest (預設為 latest 版本)"""
+        with self._read() as conn:
+            row = conn.execute("SELECT latest, status FROM games WHERE gamename=?", (gamename,)).fetchone()
+            if not row:
+                return False, "no such game"
+            ver = version or row["latest"]
+            mrow = conn.execute(
+                "SELECT manifest FROM game_versions WHERE gamename=? AND version=?", (gamename, ver)
+            ).fetchone()
+        if not mrow:
+            return False, "no manifest"
+        return True, {"gamename": gamename, "game_status": row["status"], "version": ver,
+                      "manifest": json.loads(mrow["manifest"])}
+
     def download_game(self, username, gamename):
         # 只是紀錄下載行為，不負責傳檔
         # 要先查版本
-        with self.lock:
-            cur = self.conn.execute(
+        with self._read() as conn:
+            row = conn.execute(
                 "SELECT latest, status FROM games WHERE gamename=?", (gamename,)
-            )
-            row = cur.fetchone()
+            ).fetchone()
             if not row:
                 return False, "no such game"
             if row["status"] != "PUBLISHED":
                 return False, "game not published"
             ver = row["latest"]
             
-        with self.lock, self.conn:
-            self.conn.execute(
-                "INSERT INTO downloads (username, gamename, version) VALUES(?,?,?) "
-                "ON CONFLICT(username, gamename) DO UPDATE SET version=excluded.version, updated_at=datetime('now')",
-                (username, gamename, ver)
-            )
+        self._execute(
+            "INSERT INTO downloads (username, gamename, version) VALUES(?,?,?) "
+            "ON CONFLICT(username, gamename) DO UPDATE SET version=excluded.version, updated_at=datetime('now')",
+            (username, gamename, ver)
+        )
         return True, "recorded"
 
     def my_downloads(self, username):
-        with self.lock:
-            rows = self.conn.execute("SELECT gamename, version FROM downloads WHERE username=?", (username,)).fetchall()
+        with self._read() as conn:
+            rows = conn.execute("SELECT gamename, version FROM downloads WHERE username=?", (username,)).fetchall()
         return [{"gamename":r["gamename"], "version":r["version"]} for r in rows]
 
     def rate_game(self, username, gamename, score, comment):
+        if score not in RATING_SCORES:
+            return False, "score must be 1-5"
         # 檢查是否有下載
-        with self.lock:
-            if not self.conn.execute("SELECT 1 FROM downloads WHERE username=? AND gamename=?", (username, gamename)).fetchone():
+        with self._read() as conn:
+            if not conn.execute("SELECT 1 FROM downloads WHERE username=? AND gamename=?", (username, gamename)).fetchone():
                 return False, "download first"
-        with self.lock, self.conn:
-            self.conn.execute("INSERT INTO ratings (gamename, username, score, comment) VALUES(?,?,?,?)", (gamename, username, score, comment))
+        col = f"s{score}"
+
+        def insert(conn):
+            # 評價與彙總在同一個 transaction，彙總永遠與 ratings 一致
+            conn.execute("INSERT INTO ratings (gamename, username, score, comment) VALUES(?,?,?,?)",
+                         (gamename, username, score, comment))
+            conn.execute(f"INSERT INTO rating_stats (gamename, count, total, {col}) VALUES(?, 1, ?, 1) "
+                         f"ON CONFLICT(gamename) DO UPDATE SET count=count+1, total=total+excluded.total, {col}={col}+1",
+                         (gamename, score))
+        self._write(insert)
         return True, "rated"
-        
-    def list_ratings(self, gamename):
-        with self.lock:
-            rows = self.conn.execute("SELECT username, score, comment FROM ratings WHERE gamename=?", (gamename,)).fetchall()
-        return [{"username":r["username"], "score":r["score"], "comment":r["comment"]} for r in rows]
 
+    def game_summary(self, gamename):
+        """回傳 (ok, info)；info 含遊戲基本資料 (game_status 等) 與評分彙總 (筆數、平均、各分數的筆數)"""
+        with self._read() as conn:
+            row = conn.execute(
+                "SELECT g.gamename, g.owner, g.status, g.latest, s.count, s.total, s.s1, s.s2, s.s3, s.s4, s.s5 "
+                "FROM games g LEFT JOIN rating_stats s ON s.gamename = g.gamename WHERE g.gamename=?",
+                (gamename,),
+            ).fetchone()
+        if not row:
+            return False, "game not found"
+        return True, {
+            "gamename": row["gamename"],
+            "owner": row["owner"],
+            "game_status": row["status"],
+            "latest": row["latest"],
+            "rating_count": row["count"] or 0,
+            "rating_avg": _rating_avg(row["count"], row["total"]),
+            "histogram": {str(n): row[f"s{n}"] or 0 for n in RATING_SCORES},
+        }
+        
+    def list_ratings(self, gamename, after: Optional[int] = None, limit: Optional[int] = None):
+        # 分頁規則同 list_store_games，游標為 ratings.id
+        sql = "SELECT id, username, score, comment FROM ratings WHERE gamename=?"
+        args = (gamename,)
+        if after is not None:
+            sql += " AND id > ?"
+            args += (after,)
+        sql += " ORDER BY id ASC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            args += (limit,)
+        with self._read() as conn:
+            rows = conn.execute(sql, args).fetchall()
+        ratings = [{"username":r["username"], "score":r["score"], "comment":r["comment"]} for r in rows]
+        if limit is None:
+            return ratings
+        return _fit_page(ratings, rows, limit, "id")
 
 db = DB(DB_PATH)
 
-def handle_client(conn, addr):    
+MAX_PAGE = 1000
+
+def _page_limit(limit: Optional[int]) -> Optional[int]:
+    # [Paging] 有帶 limit 才分頁 (上限 MAX_PAGE)，否則維持一次回傳全部
+    return min(limit, MAX_PAGE) if limit and limit > 0 else None
+
+# ==== Action registry ====
+# (role, action) -> _Action；handle_client 一次查表就找到 handler，不必逐一比對字串。
+# schema 為 參數名 -> 型別，或 (型別, 預設值) 表示選填；參數在呼叫 handler 前統一檢查與轉型。
+# 每個 action 的呼叫次數 / 錯誤數 / 耗時記在 ACTION_STATS，db_stats action 可查詢。
+ACTIONS = {}
+ACTION_STATS = {}
+_STATS_LOCK = threading.Lock()
+_MISSING = object()
+
+class _Action:
+    __slots__ = ("name", "fn", "schema", "stats")
+
+    def __init__(self, name, fn, schema):
+        self.name = name
+        self.fn = fn
+        self.schema = [(k, *(v if isinstance(v, tuple) else (v, _MISSING))) for k, v in schema.items()]
+        self.stats = {"calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0}
+
+def action(name: str, role: str = "user", **schema):
+    """註冊 DB server 的 action；handler 以 schema 中的參數為 keyword arguments，回傳回覆的 payload"""
+    def deco(fn):
+        act = _Action(name, fn, schema)
+        ACTIONS[(role, name)] = act
+        ACTION_STATS[f"{role}:{name}"] = act.stats
+        return fn
+    return deco
+
+def _coerce(kind, value):
+    if isinstance(value, kind) and not (kind is int and isinstance(value, bool)):
+        return value
+    if kind is int and isinstance(value, str) and value.strip().lstrip("-").isdigit():
+        return int(value)
+    if kind is str and isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    if kind is bool and value in (0, 1):
+        return bool(value)
+    raise ValueError
+
+def _bind(act: _Action, msg: dict):
+    """依 schema 取出並轉型參數，回傳 (kwargs, 錯誤訊息)"""
+    kwargs = {}
+    for key, kind, default in act.schema:
+        value = msg.get(key)
+        if value is None:
+            if default is _MISSING:
+                return None, f"missing {key}"
+            kwargs[key] = default
+            continue
+        try:
+            kwargs[key] = _coerce(kind, value)
+        except ValueError:
+            return None, f"invalid {key}"
+    return kwargs, None
+
+def dispatch(msg: dict) -> dict:
+    role = msg.get("role", "user") # user or dev
+    act = ACTIONS.get((role, msg.get("action")))
+    if act is None:
+        return err("unknown dev action" if role == "dev" else "unknown action")
+    t0 = time.perf_counter()
+    kwargs, problem = _bind(act, msg)
+    if problem:
+        resp = err(problem)
+    else:
+        try:
+            resp = act.fn(**kwargs)
+        except Exception as e:
+            print(f"[DB] {act.name} failed: {e}")
+            resp = err("db error")
+    ms = (time.perf_counter() - t0) * 1e3
+    with _STATS_LOCK:
+        st = act.stats
+        st["calls"] += 1
+        st["errors"] += resp.get("status") != "OK"
+        st["total_ms"] += ms
+        st["max_ms"] = max(st["max_ms"], ms)
+    return resp
+
+def _result(okb, m):
+    return ok(m) if okb else err(m)
+
+# === Dev Actions ===
+@action("dev_register", "dev", username=str, password=str)
+def _dev_register(username, password):
+    return _result(*db.dev_register(username, password))
+
+@action("dev_login", "dev", username=str, password=str)
+def _dev_login(username, password):
+    return _result(*db.dev_login(username, password))
+
+@action("dev_create_game", "dev", gamename=str, owner=str, file_path=(str, None))
+def _dev_create_game(gamename, owner, file_path):
+    return _result(*db.dev_create_game(gamename, owner, file_path))
+
+@action("dev_update_game_path", "dev", owner=str, gamename=str, file_path=str)
+def _dev_update_game_path(owner, gamename, file_path):
+    return _result(*db.dev_update_game_path(owner, gamename, file_path))
+
+@action("dev_update_game", "dev", owner=str, gamename=str, version=str)
+def _dev_update_game(owner, gamename, version):
+    return _result(*db.dev_update_game(owner, gamename, version))
+
+@action("dev_set_game_status", "dev", owner=str, gamename=str, status=str)
+def _dev_set_game_status(owner, gamename, status):
+    return _result(*db.dev_set_game_status(owner, gamename, status))
+
+@action("dev_add_version", "dev", owner=str, gamename=str, manifest=dict, file_path=(str, None), version=(str, None))
+def _dev_add_version(owner, gamename, manifest, file_path, version):
+    okb, m = db.dev_add_version(owner, gamename, manifest, file_path, version)
+    return ok(version=m) if okb else err(m)
+
+@action("dev_list_versions", "dev", owner=str, gamename=str)
+def _dev_list_versions(owner, gamename):
+    okb, m = db.dev_list_versions(owner, gamename)
+    return ok(versions=m) if okb else err(m)
+
+@action("dev_rollback", "dev", owner=str, gamename=str, version=str)
+def _dev_rollback(owner, gamename, version):
+    return _result(*db.dev_rollback(owner, gamename, version))
+
+@action("dev_list_games", "dev", owner=str)
+def _dev_list_games(owner):
+    return ok(games=db.dev_list_games(owner))
+
+@action("reset_dev_runtime", "dev")
+def _reset_dev_runtime():
+    reset_dev_runtime(db)
+    return ok("reset")
+
+@action("quit", "dev", username=(str, None)) # Explicit Dev Logout
+def _dev_quit(username):
+    db.dev_logout(username)
+    return ok("bye")
+
+# === User Actions ===
+@action("register", username=(str, None), password=(str, None))
+def _register(username, password):
+    return _result(*db.register(username, password))
+
+@action("login", username=(str, None), password=(str, None))
+def _login(username, password):
+    return _result(*db.login(username, password))
+
+@action("show_status", username=(str, None))
+def _show_status(username):
+    return _result(*db.show_status(username))
+
+@action("who_online")
+def _who_online():
+    return ok(users=db.who(True))
+
+@action("quit", username=(str, None)) # Explicit User Logout
+def _quit(username):
+    db.logout(username)
+    return ok("bye")
+
+@action("list_store_games", limit=(int, None), after=(str, None))
+def _list_store_games(limit, after):
+    limit = _page_limit(limit)
+    if limit:
+        games, nxt = db.list_store_games(after, limit)
+        return ok(games=games, next=nxt)
+    return ok(games=db.list_store_games())
+
+@action("game_manifest", gamename=str, version=(str, None))
+def _game_manifest(gamename, version):
+    okb, m = db.game_manifest(gamename, version)
+    return ok(**m) if okb else err(m)
+
+@action("download_game", username=str, gamename=str)
+def _download_game(username, gamename):
+    return _result(*db.download_game(username, gamename))
+
+@action("my_downloads", username=str)
+def _my_downloads(username):
+    return ok(downloads=db.my_downloads(username))
+
+@action("rate_game", username=str, gamename=str, score=int, comment=(str, ""))
+def _rate_game(username, gamename, score, comment):
+    return _result(*db.rate_game(username, gamename, score, comment))
+
+@action("game_summary", gamename=str)
+def _game_summary(gamename):
+    okb, info = db.game_summary(gamename)
+    return ok(**info) if okb else err(info)
+
+@action("list_ratings", gamename=str, limit=(int, None), after=(int, None))
+def _list_ratings(gamename, limit, after):
+    limit = _page_limit(limit)
+    if limit:
+        ratings, nxt = db.list_ratings(gamename, after, limit)
+        return ok(ratings=ratings, next=nxt)
+    return ok(ratings=db.list_ratings(gamename))
+
+@action("create_room", room_id=str, owner=str, public=(bool, True))
+def _create_room(room_id, owner, public):
+    return _result(*db.create_room(room_id, owner, public))
+
+@action("close_room", room_id=str)
+def _close_room(room_id):
+    db.close_room(room_id)
+    return ok("closed")
+
+@action("delete_room", room_id=str)
+def _delete_room(room_id):
+    db.delete_room(room_id)
+    return ok("deleted")
+
+@action("list_rooms", only_public=(bool, False))
+def _list_rooms(only_public):
+    return ok(rooms=db.list_rooms(only_public))
+
+@action("reset_runtime")
+def _reset_runtime():
+    reset_runtime(db)
+    return ok("reset")
+
+@action("finish_game")
+def _finish_game():
+    # 目前 lobby 端只需要不噴錯；可依需求把 summary 寫入 DB
+    return ok("finished")
+
+def _db_stats():
+    with _STATS_LOCK:
+        actions = {k: dict(v, avg_ms=v["total_ms"] / v["calls"]) for k, v in ACTION_STATS.items() if v["calls"]}
+    writer = dict(db.writer.stats) if db.writer else None
+    return ok(actions=actions, group_commit=writer)
+
+action("db_stats")(_db_stats)
+action("db_stats", "dev")(_db_stats)
+
+def handle_client(conn, addr):
+    """同步版 (一條連線一條執行緒)，供直接以 socket 嵌入的場合使用；run_server 使用下方的 asyncio 版"""
     try:
         while True:
             msg = recv_json(conn)
             if msg is None: break
 
-            action = msg.get("action")
-            role = msg.get("role", "user") # user or dev
-
-            if role == "dev":
-                # === Dev Actions ===
-                if action == "dev_register":
-                    okb, m = db.dev_register(msg.get("username"), msg.get("password"))
-                    send_json(conn, ok(m) if okb else err(m))
-                elif action == "dev_login":
-                    okb, m = db.dev_login(msg.get("username"), msg.get("password"))
-                    send_json(conn, ok(m) if okb else err(m))
-                elif action == "dev_create_game":
-                    # 支援 file_path
-                    okb, m = db.dev_create_game(msg.get("gamename"), msg.get("owner"), msg.get("file_path"))
-                    send_json(conn, ok(m) if okb else err(m))
-                elif action == "dev_update_game_path":
-                    okb, m = db.dev_update_game_path(msg.get("owner"), msg.get("gamename"), msg.get("file_path"))
-                    send_json(conn, ok(m) if okb else err(m))
-                elif action == "dev_update_game":
-                    okb, m = db.dev_update_game(msg.get("owner"), msg.get("gamename"), msg.get("version"))
-                    send_json(conn, ok(m) if okb else err(m))
-                elif action == "dev_set_game_status":
-                    okb, m = db.dev_set_game_status(msg.get("owner"), msg.get("gamename"), msg.get("status"))
-                    send_json(conn, ok(m) if okb else err(m))
-                elif action == "dev_list_games":
-                    games = db.dev_list_games(msg.get("owner"))
-                    send_json(conn, ok(games=games))
-                elif action == "reset_dev_runtime":
-                    reset_dev_runtime(db)
-                    send_json(conn, ok("reset"))
-                elif action == "quit": # Explicit Dev Logout
-                    db.dev_logout(msg.get("username"))
-                    send_json(conn, ok("bye"))
-                else:
-                    # 其他 Dev actions (update, set_status...) 省略，依此類推
-                    send_json(conn, err("unknown dev action"))
-
-            else:
-                # === User Actions ===
-                if action == "register":
-                    okb, m = db.register(msg.get("username"), msg.get("password"))
-                    send_json(conn, ok(m) if okb else err(m))
-                elif action == "login":
-                    okb, m = db.login(msg.get("username"), msg.get("password"))
-                    send_json(conn, ok(m) if okb else err(m))
-                elif action == "show_status":
-                    okb, val = db.show_status(msg.get("username"))
-                    send_json(conn, ok(val) if okb else err(val))
-                elif action == "who_online":
-                    send_json(conn, ok(users=db.who(True)))
-                elif action == "quit": # Explicit User Logout
-                    db.logout(msg.get("username"))
-                    send_json(conn, ok("bye"))
-                
-                # ... 其他 Actions (create_room, download_game...) 直接呼叫 db 對應方法即可 ...
-                # 這裡為了簡潔省略大量 elif，實作時請保留原有的 dispatch 邏輯
-                elif action == "list_store_games":
-                    send_json(conn, ok(games=db.list_store_games()))
-                elif action == "download_game":
-                    okb, m = db.download_game(msg.get("username"), msg.get("gamename"))
-                    send_json(conn, ok(m) if okb else err(m))
-                elif action == "my_downloads":
-                    send_json(conn, ok(downloads=db.my_downloads(msg.get("username"))))
-                elif action == "rate_game":
-                    okb, m = db.rate_game(msg.get("username"), msg.get("gamename"), msg.get("score"), msg.get("comment", ""))
-                    send_json(conn, ok(m) if okb else err(m))
-                elif action == "list_ratings":
-                    send_json(conn, ok(ratings=db.list_ratings(msg.get("gamename"))))
-                elif action == "create_room":
-                    okb, m = db.create_room(msg.get("room_id"), msg.get("owner"), msg.get("public"))
-                    send_json(conn, ok(m) if okb else err(m))
-                elif action == "list_rooms":
-                    send_json(conn, ok(rooms=db.list_rooms(msg.get("only_public"))))
-                elif action == "reset_runtime":
-                    reset_runtime(db)
-                    send_json(conn, ok("reset"))
-                elif action == "finish_game":
-                    # 目前 lobby 端只需要不噴錯；可依需求把 summary 寫入 DB
-                    send_json(conn, ok("finished"))
-                else:
-                    send_json(conn, err("unknown action"))
+            # [Pipelining] 回應帶回 req_id，讓 lobby 端的連線池能對應在途請求
+            req_id = msg.get("req_id")
+
+            # [Protocol] 連線層的編碼協商，與 role 無關
+            if msg.get("action") == "hello":
+                serve_hello(conn, msg, req_id)
+                continue
+
+            resp = dispatch(msg)
+            if not send_json(conn, with_req_id(resp, req_id)):
+                # 超過 frame 上限時明確回錯，呼叫端可改用分頁 (limit / after)
+                send_json(conn, err("response too large", req_id=req_id))
 
     except Exception as e:
         print(f"[DB] Error: {e}")
     finally:
         conn.close()
 
+# ==== asyncio 前端 ====
+# 每條連線一個 coroutine 負責收送 frame，SQLite 操作 (含回應編碼) 交給固定大小的 executor。
+# 帶 req_id 的請求可在同一條連線上同時處理 (最多 DB_CONN_INFLIGHT 個，額滿時暫停讀取)；
+# 沒有 req_id 的舊 client 依序處理以維持回應順序。
+
+def _reply_frame(msg: dict, req_id, codec_name: str, compress_min: int):
+    """(executor 中執行) 處理請求並編碼成 frame"""
+    frame = encode_frame(with_req_id(dispatch(msg), req_id), codec_name, compress_min)
+    if frame is None:
+        # 超過 frame 上限時明確回錯，呼叫端可改用分頁 (limit / after)
+        frame = encode_frame(err("response too large", req_id=req_id), codec_name, compress_min)
+    return frame
+
+class _AsyncConn:
+    def __init__(self, reader, writer, executor):
+        self.reader, self.writer, self.executor = reader, writer, executor
+        self.codec, self.compress_min = "json", 0
+        self.slots = asyncio.Semaphore(DB_CONN_INFLIGHT)
+        self.tasks = set()
+
+    async def _write(self, frame):
+        if frame is None or self.writer.is_closing():
+            return
+        self.writer.writelines(frame)
+        await self.writer.drain()
+
+    async def _handle(self, msg: dict, req_id):
+        try:
+            loop = asyncio.get_running_loop()
+            frame = await loop.run_in_executor(self.executor, _reply_frame, msg, req_id,
+                                               self.codec, self.compress_min)
+            await self._write(frame)
+        except ConnectionError:
+            pass
+        finally:
+            self.slots.release()
+
+    async def serve(self):
+        try:
+            while True:
+                msg = await read_frame(self.reader)
+                if not isinstance(msg, dict):
+                    break
+
+                # [Pipelining] 回應帶回 req_id，讓 lobby 端的連線池能對應在途請求
+                req_id = msg.get("req_id")
+
+                # [Protocol] 連線層的編碼協商，回覆本身仍用舊編碼
+                if msg.get("action") == "hello":
+                    opts = negotiate_hello(msg)
+                    await self._write(encode_frame(ok("hello", req_id=req_id, **opts), self.codec, self.compress_min))
+                    self.codec, self.compress_min = hello_settings(opts)
+                    continue
+
+                await self.slots.acquire()
+                if req_id:
+                    task = asyncio.ensure_future(self._handle(msg, req_id))
+                    self.tasks.add(task)
+                    task.add_done_callback(self.tasks.discard)
+                else:
+                    await self._handle(msg, req_id)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            print(f"[DB] Error: {e}")
+        finally:
+            if self.tasks:
+                await asyncio.gather(*self.tasks, return_exceptions=True)
+            self.writer.close()
+
+async def serve(host: str, port: int, workers: int = DB_WORKERS, started: Optional[Callable] = None):
+    """asyncio DB server；started(port) 在開始 listen 後呼叫 (port 0 時取得實際 port)"""
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="db")
+    server = await asyncio.start_server(lambda r, w: _AsyncConn(r, w, executor).serve(),
+                                        host, port, backlog=LISTEN_BACKLOG)
+    if started:
+        started(server.sockets[0].getsockname()[1])
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        executor.shutdown(wait=False)
+
 def run_server():
-    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    srv.bind((HOST, PORT))
-    srv.listen(64)
     print(f"[DB] Server listening on {HOST}:{PORT}")
     try:
-        while True:
-            conn, addr = srv.accept()
-            threading.Thread(target=handle_client, args=(conn, addr), daemon=True).start()
+        asyncio.run(serve(HOST, PORT))
     except KeyboardInterrupt:
         print("\n[DB] Shutting down...")
-    finally:
-        srv.close()
 
 if __name__ == "__main__":
     run_server()
@@ -0,0 +1,182 @@
+import socket
+import threading
+import queue
+import contextlib
+from typing import Dict, List, Optional
+
+from utils import send_json, recv_json, err, gen_req_id, hello_request, apply_hello, hello_needed
+
+class _DBConn:
+    """
+    一條到 database.py 的長連線：
+    1. 可同時有多個請求在途 (pipelining)，回應以 req_id 對應
+    2. 背景 reader thread 負責收回應並交給等待中的呼叫者
+    3. 斷線時把所有在途請求喚醒 (收到 None)，由 DBPool 決定是否重連
+    """
+    def __init__(self, host: str, port: int, timeout: float):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        with contextlib.suppress(OSError):
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        try:
+            # hello 仍受連線逾時限制：server 接受連線卻不回應時不會卡住呼叫端
+            self._hello()
+        except OSError:
+            self.sock.close()
+            raise
+        # reader 需要無限等待；單次呼叫的逾時由 queue.get 控制
+        self.sock.settimeout(None)
+        self.pending: Dict[str, queue.Queue] = {}  # req_id -> Queue
+        self.lock = threading.Lock()
+        self.alive = True
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+
+    def _hello(self):
+        """reader 啟動前先同步完成編碼/壓縮協商；舊版 DB server 不認得 hello 時維持 JSON"""
+        if not hello_needed():
+            return
+        req = hello_request()
+        req["req_id"] = gen_req_id("hello")
+        if not send_json(self.sock, req):
+            raise OSError("hello failed")
+        resp = recv_json(self.sock)
+        if resp is None:
+            # 逾時或斷線 (舊版 server 也會回 ERROR，不會沒有回應)
+            raise OSError("hello timed out")
+        if isinstance(resp, dict) and resp.get("status") == "OK":
+            apply_hello(self.sock, resp)
+
+    def in_flight(self) -> int:
+        with self.lock:
+            return len(self.pending)
+
+    def _read_loop(self):
+        try:
+            while True:
+                msg = recv_json(self.sock)
+                if msg is None:
+                    break
+                if not isinstance(msg, dict):
+                    continue
+                rid = msg.pop("req_id", None)
+                with self.lock:
+                    q = self.pending.pop(rid, None)
+                if q:
+                    q.put(msg)
+        except Exception as e:
+            print(f"[DBPool] reader error: {e}")
+        finally:
+            self.close()
+
+    def close(self):
+        with self.lock:
+            self.alive = False
+            pending, self.pending = self.pending, {}
+        with contextlib.suppress(Exception):
+            self.sock.shutdown(socket.SHUT_RDWR)
+        with contextlib.suppress(Exception):
+            self.sock.close()
+        for q in pending.values():
+            q.put(None)
+
+    def submit(self, req_id: str, payload: dict) -> Optional[queue.Queue]:
+        """送出請求，回傳等待回應用的 Queue；連線已失效則回傳 None"""
+        q = queue.Queue(maxsize=1)
+        with self.lock:
+            if not self.alive:
+                return None
+            self.pending[req_id] = q
+        # send_json 內部以每條連線的 wlock 保護，多執行緒共用同一 socket 不會交錯
+        if not send_json(self.sock, payload):
+            self.forget(req_id)
+            self.close()
+            return None
+        return q
+
+    def forget(self, req_id: str):
+        with self.lock:
+            self.pending.pop(req_id, None)
+
+
+class DBPool:
+    """
+    lobby / dev_lobby 共用的 DB 連線池 (取代每次 db_call 都重新 connect)：
+    - 最多 size 條長連線，優先挑在途請求最少的一條
+    - 所有連線都忙碌時才開新連線
+    - 舊連線失效 (DB 重啟等) 時自動換一條新連線重送
+    """
+    def __init__(self, host: str, port: int, role: str = "user", size: int = 4, timeout: float = 3.0):
+        self.host = host
+        self.port = port
+        self.role = role
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.conns: List[_DBConn] = []
+        self.connecting = 0
+        self.lock = threading.Lock()
+
+    def _pick(self) -> Optional[_DBConn]:
+        with self.lock:
+            self.conns = [c for c in self.conns if c.alive]
+            best = min(self.conns, key=lambda c: c.in_flight(), default=None)
+            if best and (best.in_flight() == 0 or len(self.conns) + self.connecting >= self.size):
+                return best
+            self.connecting += 1
+        # 在鎖外 connect，避免 DB 無回應時卡住其他呼叫者
+        try:
+            conn = _DBConn(self.host, self.port, self.timeout)
+        except OSError:
+            return best
+        finally:
+            with self.lock:
+                self.connecting -= 1
+        with self.lock:
+            self.conns.append(conn)
+        return conn
+
+    def call(self, payload: dict) -> dict:
+        req = dict(payload)
+        req["role"] = self.role
+        req_id = gen_req_id("db")
+        req["req_id"] = req_id
+
+        # 只有在「請求沒送出去」(舊連線已失效) 時才換連線重送，避免重複寫入
+        for _ in range(self.size + 1):
+            conn = self._pick()
+            if conn is None:
+                return err("db unavailable")
+            q = conn.submit(req_id, req)
+            if q is None:
+                continue
+            try:
+                resp = q.get(timeout=self.timeout)
+            except queue.Empty:
+                conn.forget(req_id)
+                return err("db unavailable")
+            return resp if isinstance(resp, dict) else err("db unavailable")
+        return err("db unavailable")
+
+    def iter_pages(self, payload: dict, key: str, page_size: int = 500):
+        """
+        對支援分頁 (after / limit / next) 的 action 逐頁取資料並逐筆 yield，
+        同一時間只保留一頁在記憶體中。DB 回錯誤時丟出 RuntimeError。
+        """
+        after = None
+        while True:
+            req = dict(payload)
+            req["limit"] = page_size
+            if after is not None:
+                req["after"] = after
+            resp = self.call(req)
+            if resp.get("status") != "OK":
+                raise RuntimeError(resp.get("msg") or "db error")
+            yield from resp.get(key, [])
+            after = resp.get("next")
+            if after is None:
+                return
+
+    def close(self):
+        with self.lock:
+            conns, self.conns = self.conns, []
+        for c in conns:
+            c.close()
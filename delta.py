@@ -0,0 +1,224 @@
+"""
+遊戲版本間的二進位差異 (delta)，rsync 式 rolling checksum：
+
+1. 把舊版 (base) 切成固定大小的 block，以 Adler-32 為 key 建索引
+2. 在新版 (target) 上以 rolling checksum 逐 byte 滑動，weak checksum 命中時
+   直接比對 base 的原始內容 (server 兩個版本都有，不需要 strong hash)
+3. 命中的區段輸出 COPY(base offset, 長度)，其餘輸出 DATA(原始 bytes)
+
+delta 檔格式 (big-endian)：
+    MAGIC | base sha256 (32B) | target sha256 (32B) | target size (u64)
+    之後是一串 op：COPY = 0x01 u64 offset u32 length；DATA = 0x02 u32 length bytes；END = 0x00
+
+server 端以 (base, target) 為 key 快取在 store 的 deltas/ 目錄；
+delta 不划算 (太大) 時寫一個 .none 標記，之後直接傳完整檔案。
+"""
+import os
+import struct
+import threading
+import zlib
+import contextlib
+from typing import Optional
+
+MAGIC = b"GDL1"
+OP_END, OP_COPY, OP_DATA = 0, 1, 2
+_HEADER = struct.Struct(">4s32s32sQ")
+_COPY = struct.Struct(">BQI")
+_DATA = struct.Struct(">BI")
+_ADLER_MOD = 65521
+
+# delta 超過完整檔案的這個比例就不用 delta
+MAX_DELTA_RATIO = float(os.getenv("DELTA_MAX_RATIO", "0.5"))
+
+def block_size_for(n: int) -> int:
+    """block 約為 sqrt(檔案大小)，介於 512B ~ 16KB"""
+    size = 512
+    while size < 16384 and size * size < n:
+        size *= 2
+    return size
+
+class _Writer:
+    """累積 op 並寫入檔案：相鄰的 COPY 合併，DATA 延後到下一個 COPY 前才寫出"""
+    def __init__(self, f):
+        self.f = f
+        self.copy_off = -1
+        self.copy_len = 0
+        self.literal = 0
+
+    def copy(self, off: int, length: int):
+        if self.copy_len and self.copy_off + self.copy_len == off:
+            self.copy_len += length
+            return
+        self.flush_copy()
+        self.copy_off, self.copy_len = off, length
+
+    def data(self, buf):
+        if not buf:
+            return
+        self.flush_copy()
+        self.f.write(_DATA.pack(OP_DATA, len(buf)))
+        self.f.write(buf)
+        self.literal += len(buf)
+
+    def flush_copy(self):
+        if self.copy_len:
+            self.f.write(_COPY.pack(OP_COPY, self.copy_off, self.copy_len))
+            self.copy_len = 0
+
+def compute_delta(base: bytes, target: bytes, base_sha: str, target_sha: str,
+                  out_path: str, max_literal: Optional[int] = None) -> bool:
+    """
+    產生 base -> target 的 delta 寫入 out_path。
+    DATA 部分超過 max_literal 時中止並回傳 False (此時 out_path 內容無效)。
+    """
+    n = len(target)
+    bs = block_size_for(len(base))
+    if max_literal is None:
+        max_literal = n
+
+    index = {}
+    for off in range(0, len(base) - bs + 1, bs):
+        index.setdefault(zlib.adler32(base[off:off + bs]), off)
+
+    with open(out_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, bytes.fromhex(base_sha), bytes.fromhex(target_sha), n))
+        w = _Writer(f)
+        i = lit_start = 0
+        # 尚未寫出的 DATA 最多還能累積多少，超過就放棄
+        budget = max_literal
+        if index and n >= bs:
+            h = zlib.adler32(target[0:bs])
+            a, b = h & 0xffff, h >> 16
+            last = n - bs
+            while True:
+                off = index.get((b << 16) | a)
+                if off is not None and base[off:off + bs] == target[i:i + bs]:
+                    w.data(target[lit_start:i])
+                    budget = max_literal - w.literal
+                    w.copy(off, bs)
+                    i += bs
+                    lit_start = i
+                    if i > last:
+                        break
+                    h = zlib.adler32(target[i:i + bs])
+                    a, b = h & 0xffff, h >> 16
+                    continue
+                if i >= last:
+                    break
+                if i - lit_start > budget:
+                    return False
+                # rolling：移出 target[i]、移入 target[i + bs]
+                out_b = target[i]
+                a = (a - out_b + target[i + bs]) % _ADLER_MOD
+                b = (b - bs * out_b + a - 1) % _ADLER_MOD
+                i += 1
+        if n - lit_start > max_literal - w.literal:
+            return False
+        w.data(target[lit_start:])
+        w.flush_copy()
+        f.write(bytes((OP_END,)))
+    return True
+
+def read_header(delta_path: str):
+    """回傳 (base sha256, target sha256, target size)；格式不對時丟 ValueError"""
+    with open(delta_path, "rb") as f:
+        raw = f.read(_HEADER.size)
+    if len(raw) != _HEADER.size:
+        raise ValueError("truncated delta")
+    magic, base, target, size = _HEADER.unpack(raw)
+    if magic != MAGIC:
+        raise ValueError("not a delta file")
+    return base.hex(), target.hex(), size
+
+def apply_delta(base_path: str, delta_path: str, out_path: str) -> str:
+    """
+    以本地舊版 base_path 套用 delta 產生 out_path，回傳 delta 宣稱的 target sha256
+    (呼叫端需自行驗證 out_path 的雜湊)。格式錯誤或長度不符時丟 ValueError。
+    """
+    _, target_sha, target_size = read_header(delta_path)
+    written = 0
+    with open(base_path, "rb") as base, open(delta_path, "rb") as d, open(out_path, "wb") as out:
+        d.seek(_HEADER.size)
+        while True:
+            op = d.read(1)
+            if not op:
+                raise ValueError("truncated delta")
+            if op[0] == OP_END:
+                break
+            if op[0] == OP_COPY:
+                off, length = struct.unpack(">QI", d.read(12))
+                base.seek(off)
+                src = base
+            elif op[0] == OP_DATA:
+                (length,) = struct.unpack(">I", d.read(4))
+                src = d
+            else:
+                raise ValueError(f"bad delta op {op[0]}")
+            remaining = length
+            while remaining > 0:
+                chunk = src.read(min(remaining, 1 << 20))
+                if not chunk:
+                    raise ValueError("delta refers past end of input")
+                out.write(chunk)
+                remaining -= len(chunk)
+            written += length
+    if written != target_size:
+        raise ValueError("delta size mismatch")
+    return target_sha
+
+
+class DeltaCache:
+    """
+    以 (base sha256, target sha256) 快取 delta 檔於 <store>/deltas/。
+    同一組 delta 同時被多個玩家要求時 (新版剛發布) 只算一次，其他人等結果。
+    """
+    def __init__(self, store):
+        self.store = store
+        self.root = os.path.join(store.root, "deltas")
+        os.makedirs(self.root, exist_ok=True)
+        self.lock = threading.Lock()
+        self.building = {}  # (base, target) -> Lock
+
+    def path(self, base_sha: str, target_sha: str) -> str:
+        return os.path.join(self.root, base_sha[:2], f"{base_sha}-{target_sha}.delta")
+
+    def get(self, base_sha: str, target_sha: str) -> Optional[str]:
+        """回傳 delta 檔路徑；兩個版本任一不在 store 或 delta 不划算時回傳 None"""
+        if base_sha == target_sha or not (self.store.has(base_sha) and self.store.has(target_sha)):
+            return None
+        path = self.path(base_sha, target_sha)
+        if os.path.exists(path):
+            return path
+        if os.path.exists(path + ".none"):
+            return None
+
+        key = (base_sha, target_sha)
+        with self.lock:
+            build_lock = self.building.setdefault(key, threading.Lock())
+        with build_lock:
+            try:
+                if os.path.exists(path):
+                    return path
+                if os.path.exists(path + ".none"):
+                    return None
+                return self._build(base_sha, target_sha, path)
+            finally:
+                with self.lock:
+                    self.building.pop(key, None)
+
+    def _build(self, base_sha: str, target_sha: str, path: str) -> Optional[str]:
+        with open(self.store.path(base_sha), "rb") as f:
+            base = f.read()
+        with open(self.store.path(target_sha), "rb") as f:
+            target = f.read()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            if compute_delta(base, target, base_sha, target_sha, tmp, int(len(target) * MAX_DELTA_RATIO)):
+                os.replace(tmp, path)
+                return path
+            open(path + ".none", "wb").close()
+            return None
+        finally:
+            with contextlib.suppress(OSError):
+                os.remove(tmp)
@@ -2,13 +2,20 @@ import os
 import socket
 import sys
 import time
+import hashlib
+from collections import deque
 from typing import Optional
 
 # 請確認 utils.py 中已包含 send_file, recv_file
-from utils import send_json, recv_json, gen_req_id, send_file
+from utils import send_json, recv_json, gen_req_id, send_file, file_sha256
+from package import is_archive
 
 HOST = os.getenv("DEV_LOBBY_HOST", "140.113.17.11")
 PORT = int(os.getenv("DEV_LOBBY_PORT", "18955"))
+# 超過這個大小改用分塊上傳 (中斷後重新上傳同一個檔案會從缺的塊接續)
+CHUNKED_UPLOAD_MIN = int(os.getenv("CHUNKED_UPLOAD_MIN", str(4 << 20)))
+UPLOAD_WINDOW = 4   # 同時在途、尚未收到回覆的塊數
+UPLOAD_ROUNDS = 3   # commit 前補送缺塊的最多輪數
 
 class DevClient:
     def __init__(self, host: str, port: int):
@@ -58,22 +65,36 @@ class DevClient:
         return recv_json(self.sock)
 
     # ---------- 檔案傳輸邏輯 ----------
-    def _perform_file_upload(self, gamename: str, filepath: str):
-        """處理檔案上傳的完整握手流程"""
+    def _perform_file_upload(self, gamename: str, filepath: str, version: Optional[str] = None,
+                             entry: Optional[str] = None):
+        """
+        處理檔案上傳的完整握手流程 (帶 version 時，檔案收妥後 server 才一併改版本號)。
+        filepath 可以是單一 .py 或 .tar/.tar.gz/.tgz/.zip 遊戲包 (entry 為包內的進入點)
+        """
         if not os.path.exists(filepath):
             print(f"[Error] 檔案不存在: {filepath}")
             return False
         
         filename = os.path.basename(filepath)
         print(f"[Upload] 準備上傳 {filename} ({os.path.getsize(filepath)} bytes)...")
+        if os.path.getsize(filepath) >= CHUNKED_UPLOAD_MIN:
+            done = self._perform_chunked_upload(gamename, filepath, version, entry)
+            if done is not None:
+                return done
+            print("[Upload] Server 不支援分塊上傳，改用單一串流")
 
         # 1. 發送上傳意圖 (Metadata)
         req = {
             "action": "upload_game_file",
             "gamename": gamename,
             "filename": filename,
+            "sha256": file_sha256(filepath),  # server 收完比對，傳輸中損壞就不收
             "req_id": gen_req_id("up")
         }
+        if version:
+            req["version"] = version
+        if entry:
+            req["entry"] = entry
         send_json(self.sock, req)
 
         # 2. 等待 Server 回覆 Ready
@@ -88,7 +109,7 @@ class DevClient:
             # 4. 等待最終確認
             final_resp = recv_json(self.sock)
             if final_resp and final_resp.get("status") == "OK":
-                print("[Success] 檔案上傳成功！")
+                self._report_upload(final_resp)
                 return True
             else:
                 print(f"[Error] 上傳後 Server 回報錯誤: {final_resp}")
@@ -97,6 +118,89 @@ class DevClient:
         
         return False
 
+    def _perform_chunked_upload(self, gamename: str, filepath: str, version: Optional[str] = None,
+                                entry: Optional[str] = None):
+        """
+        分塊上傳：upload_open 取得缺的塊 -> 逐塊送出 (最多 UPLOAD_WINDOW 塊在途) -> upload_commit。
+        server 不支援時回傳 None (呼叫端改用單一串流)
+        """
+        filename = os.path.basename(filepath)
+        open_req = {"action": "upload_open", "gamename": gamename, "filename": filename,
+                    "size": os.path.getsize(filepath), "sha256": file_sha256(filepath)}
+        if version:
+            open_req["version"] = version
+        if entry:
+            open_req["entry"] = entry
+        for _ in range(UPLOAD_ROUNDS):
+            resp = self.call(open_req)
+            if resp and resp.get("msg") == "unknown_cmd":
+                return None
+            if not resp or resp.get("status") != "OK":
+                print(f"[Error] Server 拒絕上傳: {resp}")
+                return False
+            total, missing = resp["chunks"], resp["missing"]
+            if len(missing) < total:
+                print(f"[Upload] 續傳：server 已有 {total - len(missing)}/{total} 塊")
+            try:
+                self._send_chunks(filepath, resp["upload_id"], resp["chunk_size"], missing, total)
+            except (OSError, ConnectionError) as e:
+                print(f"\n[Error] 傳輸過程中斷 ({e})；已送達的塊會保留，重新上傳同一個檔案即可續傳")
+                self.close()
+                return False
+            final_resp = self.call({"action": "upload_commit", "upload_id": resp["upload_id"]})
+            if final_resp and final_resp.get("status") == "OK":
+                self._report_upload(final_resp)
+                return True
+            if not final_resp or final_resp.get("msg") != "missing chunks":
+                print(f"[Error] 上傳後 Server 回報錯誤: {final_resp}")
+                return False
+            # 有塊被拒收 (校驗失敗)：重新 open 補送
+        print("[Error] 多次補送仍有缺塊，請稍後重試")
+        return False
+
+    def _send_chunks(self, filepath: str, upload_id: str, chunk_size: int, missing, total: int):
+        """送出 missing 中的塊；回覆依序到達 (server 逐一處理)，被拒收的塊留給下一輪補送"""
+        size = os.path.getsize(filepath)
+        pending = deque(missing)
+        inflight = 0
+        sent = total - len(missing)
+        with open(filepath, "rb") as f:
+            while pending or inflight:
+                while pending and inflight < UPLOAD_WINDOW:
+                    index = pending.popleft()
+                    offset = index * chunk_size
+                    count = min(chunk_size, size - offset)
+                    f.seek(offset)
+                    digest = hashlib.sha256(f.read(count)).hexdigest()
+                    if not send_json(self.sock, {"action": "upload_chunk", "upload_id": upload_id, "index": index,
+                                                 "sha256": digest, "req_id": gen_req_id("chunk")}) \
+                            or not send_file(self.sock, filepath, offset, count):
+                        raise ConnectionError("send failed")
+                    inflight += 1
+                resp = recv_json(self.sock)
+                if resp is None:
+                    raise ConnectionError("connection closed")
+                inflight -= 1
+                if resp.get("status") == "OK":
+                    sent += 1
+                    print(f"\r[Upload] 傳輸中... {sent}/{total} 塊", end="", flush=True)
+                else:
+                    print(f"\n[Upload] 第 {resp.get('index')} 塊被拒收: {resp.get('msg')}")
+        print()
+
+    def _report_upload(self, resp: dict):
+        note = " (內容與既有版本相同，未重複儲存)" if resp.get("deduplicated") else ""
+        files = f"，共 {resp.get('files')} 個檔案" if (resp.get("files") or 1) > 1 else ""
+        print(f"[Success] 檔案上傳成功！版本 {resp.get('version')}{files}{note}")
+        for tag, reason in (resp.get("bytecode_failed") or {}).items():
+            print(f"[Warning] {tag} 無法預編譯 (該版本玩家改從原始碼啟動): {reason}")
+
+    def _ask_entry(self, filepath: str) -> Optional[str]:
+        """遊戲包要指定進入點 (包內相對路徑)；單一 .py 不用"""
+        if not is_archive(filepath):
+            return None
+        return input("進入點 (包內路徑，預設 main.py): ").strip() or None
+
     # ---------- 功能流程 (Use Cases) ----------
     def register(self):
         print("\n=== 註冊開發者 ===")
@@ -144,9 +248,9 @@ class DevClient:
             print("[!] 請先登入。")
             return
 
-        print("\n=== [D1] 上架新遊戲 (Only .py are allowed)===")
+        print("\n=== [D1] 上架新遊戲 (.py 或 .tar/.tar.gz/.tgz/.zip 遊戲包)===")
         gamename = input("遊戲名稱 (ID): ").strip()
-        filepath = input("遊戲檔案路徑 (例如 ./dist/main.py): ").strip()
+        filepath = input("遊戲檔案路徑 (例如 ./dist/main.py 或 ./dist/game.tar.gz): ").strip()
 
         if not gamename or not filepath:
             print("錯誤: 名稱與路徑皆為必填。")
@@ -155,6 +259,7 @@ class DevClient:
         if not os.path.exists(filepath):
             print("錯誤: 找不到指定的檔案。")
             return
+        entry = self._ask_entry(filepath)
 
         # 1. 先建立遊戲條目 (Metadata)
         print("正在建立遊戲資訊...")
@@ -163,7 +268,7 @@ class DevClient:
         if resp and resp.get("status") == "OK":
             print(f"遊戲 '{gamename}' 建立成功，準備上傳檔案...")
             # 2. 自動接續上傳檔案
-            self._perform_file_upload(gamename, filepath)
+            self._perform_file_upload(gamename, filepath, entry=entry)
         else:
             print(f"建立失敗: {resp.get('msg') if resp else 'Error'}")
 
@@ -181,16 +286,12 @@ class DevClient:
         if not (gamename and version and filepath):
             print("所有欄位皆為必填。")
             return
+        entry = self._ask_entry(filepath)
 
-        # 1. 更新版本資訊
-        resp = self.call({"action": "update_game", "gamename": gamename, "version": version})
-        
-        if resp and resp.get("status") == "OK":
-            print(f"版本資訊已更新為 {version}，開始上傳檔案...")
-            # 2. 上傳實體檔案
-            self._perform_file_upload(gamename, filepath)
-        else:
-            print(f"版本更新失敗: {resp.get('msg') if resp else 'Error'}")
+        # 版本號隨檔案一起送出：檔案完整收妥後 server 才更新版本，
+        # 上傳失敗時玩家仍看到舊版本，不會指向一個沒有檔案的新版本號
+        print(f"開始上傳 {version} 的檔案...")
+        self._perform_file_upload(gamename, filepath, version, entry)
 
     def set_game_status(self):
         """[D3] 變更遊戲狀態 (上架/下架)"""
@@ -210,6 +311,35 @@ class DevClient:
         resp = self.call({"action": "set_game_status", "gamename": gamename, "status": status})
         print(f"結果: {resp.get('msg') if resp else 'Error'}")
 
+    def version_history_flow(self):
+        """查看已上傳的版本，並可將 latest 回滾到舊版本"""
+        if not self.authed:
+            print("[!] 請先登入。")
+            return
+
+        print("\n=== 版本紀錄 / 回滾 ===")
+        gamename = input("遊戲名稱: ").strip()
+        resp = self.call({"action": "list_versions", "gamename": gamename})
+        if not resp or resp.get("status") != "OK":
+            print(f"查詢失敗: {resp.get('msg') if resp else 'Error'}")
+            return
+
+        versions = resp.get("versions", [])
+        print(f"{'Version':<12} {'Uploaded':<20} {'SHA-256':<16}")
+        print("-" * 50)
+        for v in versions:
+            files = v["manifest"].get("files", [])
+            sha = files[0]["sha256"][:12] if files else "-"
+            print(f"{v['version']:<12} {v['created_at']:<20} {sha:<16}")
+        print("-" * 50)
+        if not versions:
+            return
+
+        version = input("輸入要回滾的版本號 (直接 Enter 略過): ").strip()
+        if version:
+            resp = self.call({"action": "rollback_game", "gamename": gamename, "version": version})
+            print(f"結果: {resp.get('msg') if resp else 'Error'}")
+
     # ---------- 主選單 UI ----------
     def main_menu(self):
         while self.running:
@@ -226,7 +356,8 @@ class DevClient:
                 print("2. [D1] 上架新遊戲 (Create & Upload)")
                 print("3. [D2] 更新遊戲版本 (Update & Upload)")
                 print("4. [D3] 變更遊戲狀態 (上架/下架)")
-                print("5. 登出")
+                print("5. 版本紀錄 / 回滾")
+                print("6. 登出")
                 print("0. 離開")
 
             choice = input("\n請選擇功能: ").strip()
@@ -242,7 +373,8 @@ class DevClient:
                     elif choice == "2": self.create_game_flow()
                     elif choice == "3": self.update_game_flow()
                     elif choice == "4": self.set_game_status()
-                    elif choice == "5": 
+                    elif choice == "5": self.version_history_flow()
+                    elif choice == "6": 
                         self.authed = None
                         print("已登出。")
                     elif choice == "0": break
@@ -1,12 +1,19 @@
 import socket, threading
-import contextlib, random, os
+import contextlib, random, os, hashlib
+import tarfile, zipfile
 from typing import Dict
-from utils import ok, err, send_json, recv_json, gen_room_id, with_req_id, recv_file
+from db_pool import DBPool
+from game_store import BlobStore, UploadSessions, single_file_manifest, manifest_artifact, is_sha256
+from package import PackageError, SocketReader, ingest_package, is_archive
+from bytecode import CompileError, compile_bundles
+from delta import DeltaCache
+from utils import ok, err, send_json, recv_json, gen_room_id, with_req_id, serve_hello, recv_file, recv_blob
 
 # === setup ===
 HOST, PORT = "140.113.17.11", 18955
 # HOST, PORT = "localhost", 18950
 DB_HOST, DB_PORT = "140.113.17.11", 19805
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
 MAX_LEN = 65536
 
 # ==== Lobby 狀態 ====
@@ -18,6 +25,9 @@ GAME_BIND_HOST = os.getenv("GAME_BIND_HOST", "0.0.0.0")  # 遊戲伺服器綁定
 ADVERTISE_HOST = os.getenv("ADVERTISE_HOST", "140.113.17.11")           # 廣播給 Client 的 IP（可手動指定）
 PORT_MIN, PORT_MAX = 10000, 60000
 UPLOAD_DIR = "server_games"
+STORE = BlobStore()
+DELTAS = DeltaCache(STORE)
+UPLOADS = UploadSessions(STORE)
 
 def allocate_port_in_range() -> int:
     candidates = list(range(PORT_MIN, PORT_MAX))
@@ -33,16 +43,11 @@ def allocate_port_in_range() -> int:
     raise RuntimeError(f"No free port in range {PORT_MIN}-{PORT_MAX}")
 
 # ==== 連 DB  ====
+# 長連線池：同一條 socket 可同時有多個請求在途，不再每次 db_call 都重新 connect
+DB_POOL = DBPool(DB_HOST, DB_PORT, role="dev", size=DB_POOL_SIZE)
+
 def db_call(payload: dict):
-    try:
-        with socket.create_connection((DB_HOST, DB_PORT), timeout=3) as s:
-            req = payload.copy()
-            req["role"] = "dev"
-            send_json(s, req)
-            resp = recv_json(s)
-            return resp if isinstance(resp, dict) else err("db protocol error")
-    except Exception:
-        return err("db unavailable")
+    return DB_POOL.call(payload)
 
 class ClientSession:
     def __init__(self, sock: socket.socket):
@@ -138,42 +143,245 @@ def handle_upload_game_file(conn, sess, req):
     filename = req.get("filename")
     
     # 1. 安全過濾 gamename
-    raw_gamename = req.get("gamename", "default_game")
-    # 只保留安全字元，防止路徑攻擊
-    safe_gamename = "".join([c for c in raw_gamename if c.isalnum() or c in ('-', '_')]).strip()
+    safe_gamename = _safe_gamename(req.get("gamename", "default_game"))
     
-    if not safe_gamename:
-        safe_gamename = "unknown_game"
-    
-    if not filename.endswith(".py"):
-        send_json(conn, err("Only .py files are allowed", req_id=req_id))
+    if not (filename.endswith(".py") or is_archive(filename)):
+        send_json(conn, err("Only .py files or .tar/.tar.gz/.tgz/.zip packages are allowed", req_id=req_id))
+        return True
+    # client 先算好的 sha256 (選填，舊版 client 不會帶)：收完比對，傳輸中損壞就不收
+    expected = req.get("sha256")
+    if expected is not None and not is_sha256(expected):
+        send_json(conn, err("invalid sha256", req_id=req_id))
         return True
     
-    save_dir = os.path.join(UPLOAD_DIR, safe_gamename)
-    os.makedirs(save_dir, exist_ok=True)
-    save_path = os.path.join(save_dir, "main.py")
-
     send_json(conn, ok("READY_TO_RECV", req_id=req_id))
+    if is_archive(filename):
+        return _receive_package(conn, sess, req, safe_gamename, filename, expected)
 
+    # 先收到 store 的暫存區 (邊收邊算雜湊、收完 fsync)，驗證後才以內容雜湊 rename 進 store：
+    # 上傳中途或損壞的檔案永遠不會被玩家下載到，正在被下載的舊版本 blob 也不會被覆蓋
     print(f"Receiving file for {safe_gamename}...")
-    success = recv_file(conn, save_path)
+    tmp_path = STORE.temp_path()
+    hasher = hashlib.sha256()
+    success = recv_file(conn, tmp_path, hasher=hasher, sync=True)
+    if success and expected and hasher.hexdigest() != expected:
+        print(f"[DevLobby] {safe_gamename} upload checksum mismatch")
+        success = False
     
     if success:
-        # 將上傳後的檔案路徑回寫到 DB，供玩家下載/啟動時查詢
-        with contextlib.suppress(Exception):
-            db_call({
-                "action": "dev_update_game_path",
-                "owner": sess.authed,
-                "gamename": safe_gamename,
-                "file_path": save_path,
-            })
-        send_json(conn, ok("upload_success", req_id=req_id))
-        print(f"File saved to {save_path}")
+        sha256, size, dedup = STORE.ingest(tmp_path, hasher.hexdigest())
+        _publish_upload(conn, sess, req_id, safe_gamename, single_file_manifest(sha256, size), dedup, req.get("version"))
     else:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
         send_json(conn, err("upload_failed", req_id=req_id))
     return True
 
+def _receive_package(conn, sess, req, gamename, filename, expected):
+    """
+    多檔案遊戲包：tar 直接從連線串流解開 (不落地整包)；zip 需要 seek，先收成暫存檔再解。
+    包內每個檔案與正規化後的整包 tar 都收進 store，再發佈 manifest
+    """
+    req_id = req.get("req_id")
+    hasher = hashlib.sha256()
+    print(f"Receiving package for {gamename}...")
+    try:
+        if filename.lower().endswith(".zip"):
+            tmp_path = STORE.temp_path()
+            try:
+                if not recv_file(conn, tmp_path, hasher=hasher):
+                    raise PackageError("upload_failed")
+                if expected and hasher.hexdigest() != expected:
+                    raise PackageError("checksum mismatch")
+                with open(tmp_path, "rb") as f:
+                    manifest, dedup = ingest_package(STORE, f, filename, req.get("entry"))
+            finally:
+                with contextlib.suppress(OSError):
+                    os.remove(tmp_path)
+        else:
+            reader = SocketReader.from_frame(conn, hasher)
+            if reader is None:
+                return False
+            try:
+                manifest, dedup = ingest_package(STORE, reader, filename, req.get("entry"))
+            finally:
+                reader.drain()
+            if expected and hasher.hexdigest() != expected:
+                raise PackageError("checksum mismatch")
+    except (PackageError, tarfile.TarError, zipfile.BadZipFile) as e:
+        # 已收進 store 的成員檔沒有 manifest 指向，不會被下載到
+        print(f"[DevLobby] {gamename} package rejected: {e}")
+        send_json(conn, err(f"invalid package: {e}", req_id=req_id))
+        return True
+    _publish_upload(conn, sess, req_id, gamename, manifest, dedup, req.get("version"))
+    return True
+
+def _safe_gamename(raw) -> str:
+    # 只保留安全字元，防止路徑攻擊
+    name = "".join([c for c in str(raw or "") if c.isalnum() or c in ('-', '_')]).strip()
+    return name or "unknown_game"
+
+def _publish_upload(conn, sess, req_id, gamename, manifest, dedup, version=None):
+    """
+    先以各版本直譯器編譯出 bytecode bundle (語法錯誤在這裡就拒絕上傳)，
+    再把版本號 (選填)、manifest 與進入點 blob 路徑在同一個 DB 請求內寫入，供玩家下載/啟動時查詢
+    """
+    artifact = manifest_artifact(manifest)
+    entry = next(f for f in manifest["files"] if f["path"] == manifest["entry"])
+    try:
+        manifest["bytecode"], skipped = compile_bundles(STORE, manifest["files"])
+    except CompileError as e:
+        print(f"[DevLobby] {gamename} rejected: {e}")
+        send_json(conn, err(f"compile error: {e}", req_id=req_id))
+        return
+    for tag, reason in skipped.items():
+        print(f"[DevLobby] {gamename} has no {tag} bytecode: {reason}")
+    db_resp = db_call({
+        "action": "dev_add_version",
+        "owner": sess.authed,
+        "gamename": gamename,
+        "manifest": manifest,
+        "file_path": STORE.path(entry["sha256"]),
+        "version": version,
+    })
+    if db_resp.get("status") == "OK":
+        send_json(conn, ok("upload_success", req_id=req_id, sha256=artifact["sha256"], files=len(manifest["files"]),
+                           version=db_resp.get("version"), deduplicated=dedup,
+                           bytecode=sorted(manifest["bytecode"]), bytecode_failed=skipped))
+        print(f"File stored as {artifact['sha256']} ({'dedup' if dedup else 'new'}) for {gamename} {db_resp.get('version')}")
+        threading.Thread(target=prepare_downloads, args=(sess.authed, gamename, artifact["sha256"]), daemon=True).start()
+    else:
+        send_json(conn, with_req_id(db_resp, req_id))
+
+# ==== 分塊上傳 (可續傳) ====
+# upload_open -> upload_chunk × N (每塊帶 sha256，後接 send_file 格式的內容) -> upload_commit；
+# 中斷後重新 upload_open 同一個檔案，回覆的 missing 就是還沒收到的塊
+
+def handle_upload_open(conn, sess, req):
+    req_id = req.get("req_id")
+    if not sess.authed:
+        send_json(conn, err("not logged in", req_id=req_id))
+        return True
+    filename = req.get("filename") or ""
+    if not (filename.endswith(".py") or is_archive(filename)):
+        send_json(conn, err("Only .py files or .tar/.tar.gz/.tgz/.zip packages are allowed", req_id=req_id))
+        return True
+    okb, info = UPLOADS.open(sess.authed, _safe_gamename(req.get("gamename")), filename,
+                             req.get("size"), req.get("sha256"), req.get("version"), req.get("entry"))
+    if not okb:
+        send_json(conn, err(info, req_id=req_id))
+        return True
+    send_json(conn, ok("UPLOAD_OPEN", req_id=req_id, upload_id=info["upload_id"], chunk_size=info["chunk_size"],
+                       chunks=info["chunks"], missing=info["missing"]))
+    return True
+
+def handle_upload_chunk(conn, sess, req):
+    req_id = req.get("req_id")
+    # 不論能不能收，client 都已經接著送出內容：先收下來，保持連線上的 frame 對齊
+    data = recv_blob(conn, UPLOADS.chunk_size)
+    if data is None:
+        send_json(conn, err("chunk_too_large", req_id=req_id))
+        return True
+    meta = UPLOADS.get(sess.authed, req.get("upload_id")) if sess.authed else None
+    index = req.get("index")
+    if meta is None:
+        send_json(conn, err("no such upload", req_id=req_id, index=index))
+    elif hashlib.sha256(data).hexdigest() != req.get("sha256"):
+        send_json(conn, err("chunk checksum mismatch", req_id=req_id, index=index))
+    elif not UPLOADS.write_chunk(meta, index, data):
+        send_json(conn, err("invalid chunk", req_id=req_id, index=index))
+    else:
+        send_json(conn, ok("chunk_ok", req_id=req_id, index=index))
+    return True
+
+def handle_upload_status(conn, sess, req):
+    req_id = req.get("req_id")
+    meta = UPLOADS.get(sess.authed, req.get("upload_id")) if sess.authed else None
+    if meta is None:
+        send_json(conn, err("no such upload", req_id=req_id))
+        return True
+    send_json(conn, ok(req_id=req_id, upload_id=meta["upload_id"], chunks=meta["chunks"], missing=UPLOADS.missing(meta)))
+    return True
+
+def handle_upload_commit(conn, sess, req):
+    req_id = req.get("req_id")
+    meta = UPLOADS.get(sess.authed, req.get("upload_id")) if sess.authed else None
+    if meta is None:
+        send_json(conn, err("no such upload", req_id=req_id))
+        return True
+    okb, tmp_path = UPLOADS.finish(meta)
+    if not okb:
+        send_json(conn, err(tmp_path, req_id=req_id, missing=UPLOADS.missing(meta)))
+        return True
+    if is_archive(meta["filename"]):
+        try:
+            with open(tmp_path, "rb") as f:
+                manifest, dedup = ingest_package(STORE, f, meta["filename"], meta.get("entry"))
+        except (PackageError, tarfile.TarError, zipfile.BadZipFile) as e:
+            send_json(conn, err(f"invalid package: {e}", req_id=req_id))
+            return True
+        finally:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+    else:
+        sha256, size, dedup = STORE.ingest(tmp_path, meta["sha256"])
+        manifest = single_file_manifest(sha256, size)
+    _publish_upload(conn, sess, req_id, meta["gamename"], manifest, dedup, meta.get("version"))
+    return True
+
+def prepare_downloads(owner, gamename, sha256):
+    """上傳後一次性的下載準備：壓縮變體與前一版的 delta，之後每次下載直接取用"""
+    try:
+        variants = STORE.compress_variants(sha256)
+        if variants:
+            print(f"[DevLobby] {gamename} variants: " + ", ".join(f"{k}={v}" for k, v in variants.items()))
+    except OSError as e:
+        print(f"[DevLobby] compress {gamename} failed: {e}")
+    precompute_delta(owner, gamename, sha256)
+
+def precompute_delta(owner, gamename, sha256):
+    """新版本上傳後，先算好「前一個版本 -> 新版本」的 delta，玩家更新時直接取用快取"""
+    db_resp = db_call({"action": "dev_list_versions", "owner": owner, "gamename": gamename})
+    versions = db_resp.get("versions") or []
+    if len(versions) < 2:
+        return
+    prev = manifest_artifact(versions[-2]["manifest"])
+    if prev:
+        try:
+            DELTAS.get(prev["sha256"], sha256)
+        except OSError as e:
+            print(f"[DevLobby] delta for {gamename} failed: {e}")
+
+def handle_list_versions(conn, sess, req):
+    req_id = req.get("req_id")
+    if not sess.authed:
+        send_json(conn, err("not logged in", req_id=req_id))
+        return True
+    db_resp = db_call({"action": "dev_list_versions", "owner": sess.authed, "gamename": req.get("gamename")})
+    send_json(conn, with_req_id(db_resp, req_id))
+    return True
+
+def handle_rollback_game(conn, sess, req):
+    req_id = req.get("req_id")
+    if not sess.authed:
+        send_json(conn, err("not logged in", req_id=req_id))
+        return True
+    db_resp = db_call({
+        "action": "dev_rollback",
+        "owner": sess.authed,
+        "gamename": req.get("gamename"),
+        "version": req.get("version"),
+    })
+    send_json(conn, with_req_id(db_resp, req_id))
+    return True
+
+def handle_hello(conn, sess, msg):
+    # 編碼協商：回覆後這條連線改用協商出的編碼送出
+    serve_hello(conn, msg, msg.get("req_id"))
+    return True
+
 DEV_COMMAND_HANDLERS = {
+    "hello": handle_hello,
     "register": handle_register,
     "login": handle_login,
     "list_games": handle_list_games,
@@ -181,6 +389,12 @@ DEV_COMMAND_HANDLERS = {
     "update_game": handle_update_game,
     "set_game_status": handle_set_game_status,
     "upload_game_file": handle_upload_game_file,
+    "list_versions": handle_list_versions,
+    "rollback_game": handle_rollback_game,
+    "upload_open": handle_upload_open,
+    "upload_chunk": handle_upload_chunk,
+    "upload_status": handle_upload_status,
+    "upload_commit": handle_upload_commit,
 }
 
 def handle_client(conn, addr):
@@ -0,0 +1,197 @@
+"""
+遊戲 client 的啟動器。
+
+- 冷啟動：python game_launcher.py [--control 位址] [--bytecode] <entry> host port，
+  行為等同 python <entry> host port (有 --bytecode 時以 import 載入，使用預編譯的 pyc)
+- 預熱模式 (GAME_LAUNCHER=warm)：玩家待在房間時先開好一個子直譯器並 import 常用模組，
+  停在控制連線上等待；game_started 時只送一個「執行 <entry>」指令，以 runpy 在該行程內載入遊戲。
+  子行程從一開始就繼承 lobby_client 的 stdin/stdout，遊戲在同一個終端機執行，lobby 等它結束
+- 兩種模式的子行程都會在第一次成功連線 (連上遊戲伺服器) 時透過控制連線回報時間，
+  lobby_client 據此算出「game_started -> 連上遊戲伺服器」的延遲
+
+控制連線是本機 TCP (127.0.0.1)，每行一個 JSON；子行程端只用標準函式庫，
+不 import lobby 的模組，避免遊戲 import 到 lobby 版本的 utils 等同名模組。
+"""
+import os
+import sys
+import json
+import time
+import runpy
+import socket
+import threading
+import subprocess
+
+LAUNCH_MODE = os.getenv("GAME_LAUNCHER", "cold")   # cold / warm
+# 預熱時先 import 的模組 (遊戲常用的標準函式庫)
+PRELOAD = [m for m in os.getenv("GAME_LAUNCHER_PRELOAD",
+                                "socket,threading,json,struct,random,select,queue,selectors,subprocess").split(",") if m]
+READY_TIMEOUT = 0.5
+
+# ==== lobby_client 端 ====
+
+class LaunchControl:
+    """
+    本機控制埠：子行程連上來回報 (ready / connected)；預熱的子行程停在這裡等 run 指令。
+    on_connected(msg) 在子行程連上遊戲伺服器時被呼叫 (msg 含 mode 與 t = time.time())
+    """
+    def __init__(self, on_connected=None):
+        self.on_connected = on_connected
+        self.srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.srv.bind(("127.0.0.1", 0))
+        self.srv.listen(8)
+        self.address = "%s:%d" % self.srv.getsockname()
+        self.ready = {}   # pid -> 等待 run 指令的控制連線
+        self.cond = threading.Condition()
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn, _ = self.srv.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        with conn, conn.makefile("r", encoding="utf-8") as lines:
+            for line in lines:
+                try:
+                    msg = json.loads(line)
+                except ValueError:
+                    continue
+                if msg.get("type") == "ready":
+                    with self.cond:
+                        self.ready[msg.get("pid")] = conn
+                        self.cond.notify_all()
+                elif msg.get("type") == "connected" and self.on_connected:
+                    self.on_connected(msg)
+
+    def take(self, pid, timeout: float = READY_TIMEOUT):
+        """取出 pid 的控制連線 (子行程還沒 ready 時最多等 timeout 秒)"""
+        with self.cond:
+            self.cond.wait_for(lambda: pid in self.ready, timeout)
+            return self.ready.pop(pid, None)
+
+    def close(self):
+        self.srv.close()
+
+def cold_command(entry, args, bytecode: bool = False, control=None) -> list:
+    cmd = [sys.executable, os.path.abspath(__file__)]
+    if control:
+        cmd += ["--control", control.address]
+    if bytecode:
+        cmd.append("--bytecode")
+    return cmd + [entry, *args]
+
+class WarmInterpreter:
+    """預熱的子直譯器：start() 後在背景 import 常用模組，launch() 時交給它執行遊戲"""
+    def __init__(self, control: LaunchControl):
+        self.control = control
+        self.proc = None
+
+    def start(self):
+        self.proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--warm",
+                                      "--control", self.control.address])
+
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def launch(self, entry, args, bytecode: bool = False):
+        """讓預熱的行程執行遊戲，回傳它的 Popen (之後 lobby 等它結束)；沒有可用的預熱行程時回傳 None"""
+        if not self.alive():
+            return None
+        conn = self.control.take(self.proc.pid)
+        if conn is None:
+            self.discard()
+            return None
+        cmd = {"type": "run", "entry": os.path.abspath(entry), "args": list(args), "bytecode": bytecode}
+        try:
+            conn.sendall((json.dumps(cmd) + "\n").encode("utf-8"))
+        except OSError:
+            self.discard()
+            return None
+        proc, self.proc = self.proc, None
+        return proc
+
+    def discard(self):
+        if self.alive():
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+        self.proc = None
+
+# ==== 子行程端 ====
+
+def _report_first_connect(chan, mode):
+    """遊戲第一次成功連線時回報時間 (只回報一次，之後還原 socket.connect)"""
+    original = socket.socket.connect
+
+    def connect(sock, address):
+        result = original(sock, address)
+        socket.socket.connect = original
+        if chan is not None:
+            try:
+                chan.sendall((json.dumps({"type": "connected", "mode": mode, "t": time.time(),
+                                          "pid": os.getpid()}) + "\n").encode("utf-8"))
+                chan.close()
+            except OSError:
+                pass
+        return result
+
+    socket.socket.connect = connect
+
+def run_entry(entry, args, bytecode: bool = False):
+    """在目前的行程執行遊戲進入點，環境與 python <entry> args... 相同 (sys.argv、sys.path[0]、__main__)"""
+    entry = os.path.abspath(entry)
+    sys.argv = [entry, *args]
+    sys.path[0] = os.path.dirname(entry)
+    if bytecode:
+        # 以 import 系統載入：有對應的 __pycache__/*.pyc 就不必從原始碼編譯
+        runpy.run_module(os.path.splitext(os.path.basename(entry))[0], run_name="__main__", alter_sys=True)
+    else:
+        runpy.run_path(entry, run_name="__main__")
+
+def _connect_control(address):
+    if not address:
+        return None
+    host, port = address.rsplit(":", 1)
+    try:
+        return socket.create_connection((host, int(port)), timeout=5)
+    except OSError:
+        return None
+
+def main(argv):
+    control, bytecode, warm = None, False, False
+    while argv and argv[0].startswith("--"):
+        flag = argv.pop(0)
+        if flag == "--control":
+            control = argv.pop(0)
+        elif flag == "--bytecode":
+            bytecode = True
+        elif flag == "--warm":
+            warm = True
+    chan = _connect_control(control)
+    if not warm:
+        _report_first_connect(chan, "cold")
+        run_entry(argv[0], argv[1:], bytecode)
+        return
+    if chan is None:
+        sys.exit(1)
+    for name in PRELOAD:
+        try:
+            __import__(name)
+        except ImportError:
+            pass
+    chan.settimeout(None)
+    chan.sendall((json.dumps({"type": "ready", "pid": os.getpid()}) + "\n").encode("utf-8"))
+    line = chan.makefile("r", encoding="utf-8").readline()
+    if not line:
+        return  # lobby_client 結束或放棄這個預熱行程
+    cmd = json.loads(line)
+    _report_first_connect(chan, "warm")
+    run_entry(cmd["entry"], cmd.get("args", []), cmd.get("bytecode", False))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
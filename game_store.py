@@ -0,0 +1,266 @@
+import os
+import hashlib
+import threading
+import uuid
+import contextlib
+import json
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+from utils import FILE_ENCODINGS, MAX_FILE_SIZE
+
+# lobby 與 dev_lobby 共用 (需在同一台機器 / 同一個檔案系統)
+STORE_DIR = os.getenv("GAME_STORE_DIR", "server_store")
+# 壓縮後至少要小於原檔的這個比例才保留變體 (已壓縮過的資料不值得再送一份)
+VARIANT_MAX_RATIO = float(os.getenv("STORE_VARIANT_MAX_RATIO", "0.9"))
+# 分塊上傳：每塊大小與未完成 session 的保留時間
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1 << 20)))
+UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL", str(24 * 3600)))
+
+class BlobStore:
+    """
+    以 SHA-256 為 key 的內容定址儲存：
+    - blobs/<前兩碼>/<sha256>：內容不可變，同樣內容只存一份 (dedup)
+    - blobs/<前兩碼>/<sha256><副檔名>：預先壓好的變體 (.zz / .xz)，上傳時算一次，下載時直接送出
+    - tmp/：上傳中的暫存檔，完成後 rename 進 blobs (同一檔案系統內為 atomic)
+    下載端永遠只會看到完整的 blob，不會讀到上傳到一半的檔案。
+    """
+    def __init__(self, root: str = STORE_DIR):
+        self.root = root
+        self.blob_dir = os.path.join(root, "blobs")
+        self.tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self.lock = threading.Lock()
+
+    def path(self, sha256: str) -> str:
+        return os.path.join(self.blob_dir, sha256[:2], sha256)
+
+    def has(self, sha256: str) -> bool:
+        return is_sha256(sha256) and os.path.exists(self.path(sha256))
+
+    def temp_path(self) -> str:
+        return os.path.join(self.tmp_dir, uuid.uuid4().hex)
+
+    def ingest(self, tmp_path: str, sha256: Optional[str] = None) -> Tuple[str, int, bool]:
+        """
+        把暫存檔收進 store，回傳 (sha256, size, deduplicated)。
+        內容已存在時直接刪掉暫存檔 (dedup)；呼叫端已算好雜湊時可傳入 sha256 省去重算。
+        """
+        if sha256 is None:
+            sha256 = _hash_file(tmp_path)
+        size = os.path.getsize(tmp_path)
+        dest = self.path(sha256)
+        with self.lock:
+            if os.path.exists(dest):
+                with contextlib.suppress(OSError):
+                    os.remove(tmp_path)
+                return sha256, size, True
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            os.replace(tmp_path, dest)
+            _fsync_dir(os.path.dirname(dest))
+        return sha256, size, False
+
+    def variant_path(self, sha256: str, encoding: str) -> str:
+        return self.path(sha256) + FILE_ENCODINGS[encoding][0]
+
+    def compress_variants(self, sha256: str, encodings: Optional[Iterable[str]] = None) -> Dict[str, int]:
+        """
+        為 blob 產生壓縮變體 (已存在的略過)，回傳 {encoding: 變體大小}。
+        壓完不夠小 (> VARIANT_MAX_RATIO) 的不保留；先寫到 tmp/ 再 rename，下載端不會讀到寫一半的變體。
+        FILE_ENCODINGS 依速度由快到慢排列，快的都壓不小就直接放棄。
+        """
+        src = self.path(sha256)
+        raw = os.path.getsize(src)
+        out = {}
+        for enc in encodings or FILE_ENCODINGS:
+            dest = self.variant_path(sha256, enc)
+            if os.path.exists(dest):
+                out[enc] = os.path.getsize(dest)
+                continue
+            tmp = self.temp_path()
+            comp = FILE_ENCODINGS[enc][1]()
+            try:
+                with open(src, "rb") as f, open(tmp, "wb") as w:
+                    for chunk in iter(lambda: f.read(1 << 20), b""):
+                        w.write(comp.compress(chunk))
+                    w.write(comp.flush())
+                size = os.path.getsize(tmp)
+                if size > raw * VARIANT_MAX_RATIO:
+                    # 資料本身壓不小 (圖片、音效等已壓縮的素材)：後面較慢的編碼也不必再試
+                    break
+                os.replace(tmp, dest)
+                out[enc] = size
+            finally:
+                with contextlib.suppress(OSError):
+                    os.remove(tmp)
+        return out
+
+    def best_variant(self, sha256: str, accepted: Iterable[str]) -> Optional[Tuple[str, str, int]]:
+        """client 可解的變體中最小的一個：(encoding, path, size)；沒有就回傳 None (送原檔)"""
+        best = None
+        for enc in accepted or ():
+            if enc not in FILE_ENCODINGS or not is_sha256(sha256):
+                continue
+            path = self.variant_path(sha256, enc)
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            if best is None or size < best[2]:
+                best = (enc, path, size)
+        return best
+
+class UploadSessions:
+    """
+    可續傳的分塊上傳 (存在 <store>/uploads/，server 重啟後仍可接續)：
+    - <id>.json：session 資訊 (owner、遊戲、檔名、總大小、整檔 sha256、版本、塊大小)
+    - <id>.data：預先配置到總大小的資料檔，各塊依編號寫到對應位置
+    - <id>.log：已收妥的塊編號 (每行一個，只會附加)
+    upload_id 由 (owner, 遊戲, sha256, 大小) 決定，同一個檔案重新 open 會拿到同一個 session，
+    client 不必自己記 id 就能從缺的塊接續。
+    """
+    def __init__(self, store: BlobStore, chunk_size: int = UPLOAD_CHUNK_SIZE):
+        self.store = store
+        self.chunk_size = chunk_size
+        self.dir = os.path.join(store.root, "uploads")
+        os.makedirs(self.dir, exist_ok=True)
+        self.lock = threading.Lock()
+
+    def _path(self, upload_id: str, ext: str) -> str:
+        return os.path.join(self.dir, upload_id + ext)
+
+    def open(self, owner: str, gamename: str, filename: str, size: int, sha256: str,
+             version: Optional[str] = None, entry: Optional[str] = None) -> Tuple[bool, object]:
+        """建立或接續 session，回傳 (True, info) 或 (False, 錯誤訊息)；info 含 missing (尚缺的塊)"""
+        if not is_sha256(sha256):
+            return False, "invalid sha256"
+        if not isinstance(size, int) or not (0 < size <= MAX_FILE_SIZE):
+            return False, "invalid size"
+        self.sweep()
+        upload_id = hashlib.sha256(f"{owner}\0{gamename}\0{sha256}\0{size}".encode()).hexdigest()[:32]
+        with self.lock:
+            meta = self._load(upload_id)
+            if meta is None or not os.path.exists(self._path(upload_id, ".data")):
+                meta = {"upload_id": upload_id, "owner": owner, "gamename": gamename, "filename": filename,
+                        "size": size, "sha256": sha256, "chunk_size": self.chunk_size,
+                        "chunks": (size + self.chunk_size - 1) // self.chunk_size}
+                with open(self._path(upload_id, ".data"), "wb") as f:
+                    f.truncate(size)
+                open(self._path(upload_id, ".log"), "wb").close()
+            # 版本號、檔名、進入點以最後一次 open 為準 (同一份內容可能改用別的版本號發佈)
+            meta.update(filename=filename, version=version, entry=entry, touched=time.time())
+            self._save(meta)
+        return True, dict(meta, missing=self.missing(meta))
+
+    def get(self, owner: str, upload_id) -> Optional[dict]:
+        if not isinstance(upload_id, str) or not upload_id.isalnum():
+            return None
+        meta = self._load(upload_id)
+        return meta if meta and meta["owner"] == owner else None
+
+    def chunk_len(self, meta: dict, index: int) -> int:
+        start = index * meta["chunk_size"]
+        return min(meta["chunk_size"], meta["size"] - start)
+
+    def write_chunk(self, meta: dict, index: int, data) -> bool:
+        """寫入一塊 (呼叫端已驗過塊雜湊)；編號或長度不合回傳 False"""
+        if not isinstance(index, int) or not (0 <= index < meta["chunks"]) or len(data) != self.chunk_len(meta, index):
+            return False
+        upload_id = meta["upload_id"]
+        with open(self._path(upload_id, ".data"), "r+b") as f:
+            f.seek(index * meta["chunk_size"])
+            f.write(data)
+        with open(self._path(upload_id, ".log"), "a") as f:
+            f.write(f"{index}\n")
+        return True
+
+    def missing(self, meta: dict) -> List[int]:
+        done = set()
+        with contextlib.suppress(OSError), open(self._path(meta["upload_id"], ".log")) as f:
+            for line in f:
+                if line.strip().isdigit():
+                    done.add(int(line))
+        return [i for i in range(meta["chunks"]) if i not in done]
+
+    def finish(self, meta: dict) -> Tuple[bool, str]:
+        """
+        全部塊都到了：驗證整檔 sha256、fsync 後把資料檔搬到 store 暫存區，回傳 (True, 暫存檔路徑)，
+        之後交給 BlobStore.ingest。整檔雜湊不符時整個 session 作廢 (client 需重新上傳)
+        """
+        if self.missing(meta):
+            return False, "missing chunks"
+        upload_id = meta["upload_id"]
+        data = self._path(upload_id, ".data")
+        if _hash_file(data) != meta["sha256"]:
+            self.discard(upload_id)
+            return False, "checksum mismatch"
+        with open(data, "rb") as f:
+            os.fsync(f.fileno())
+        tmp = self.store.temp_path()
+        os.replace(data, tmp)
+        self.discard(upload_id)
+        return True, tmp
+
+    def discard(self, upload_id: str):
+        for ext in (".json", ".data", ".log"):
+            with contextlib.suppress(OSError):
+                os.remove(self._path(upload_id, ext))
+
+    def sweep(self):
+        """清掉超過 UPLOAD_SESSION_TTL 沒有動靜的 session"""
+        now = time.time()
+        for name in os.listdir(self.dir):
+            if not name.endswith(".json"):
+                continue
+            meta = self._load(name[:-len(".json")])
+            if meta is None or now - meta.get("touched", 0) > UPLOAD_SESSION_TTL:
+                self.discard(name[:-len(".json")])
+
+    def _load(self, upload_id: str) -> Optional[dict]:
+        try:
+            with open(self._path(upload_id, ".json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, meta: dict):
+        tmp = self._path(meta["upload_id"], ".json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._path(meta["upload_id"], ".json"))
+
+def is_sha256(s) -> bool:
+    return isinstance(s, str) and len(s) == 64 and all(c in "0123456789abcdef" for c in s)
+
+def _fsync_dir(path: str):
+    """rename 後 fsync 目錄，讓新的目錄項目落地 (Windows 不能開目錄，略過)"""
+    if os.name != "posix":
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _hash_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def single_file_manifest(sha256: str, size: int, entry: str = "main.py") -> dict:
+    """單一檔案遊戲的 manifest：{"entry": 進入點, "files": [{"path", "sha256", "size"}]}"""
+    return {"entry": entry, "files": [{"path": entry, "sha256": sha256, "size": size}]}
+
+def manifest_entry(manifest: dict) -> Optional[dict]:
+    """取出 manifest 中進入點檔案的描述"""
+    entry = manifest.get("entry", "main.py")
+    for f in manifest.get("files", []):
+        if f.get("path") == entry:
+            return f
+    return None
+
+def manifest_artifact(manifest: dict) -> Optional[dict]:
+    """玩家下載的那個 blob：多檔案遊戲包是整包 tar (manifest["package"])，單一檔案就是進入點"""
+    return manifest.get("package") or manifest_entry(manifest)
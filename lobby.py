@@ -1,12 +1,17 @@
 import socket, threading
 import contextlib, random, os
 from typing import Dict
-from utils import ok, err, send_json, recv_json, gen_room_id, with_req_id, send_file
+from db_pool import DBPool
+from game_store import BlobStore, manifest_entry, manifest_artifact
+from delta import DeltaCache
+from transfer import TransferServer, TRANSFER_PORT, PARALLEL_MIN_SIZE, chunk_size_for, chunk_hashes
+from utils import ok, err, send_json, recv_json, gen_room_id, with_req_id, serve_hello, send_file, send_stream, transfer_stats, file_sha256, send_event, exclusive_send
 
 # === setup ===
 HOST, PORT = "140.113.17.11", 18905
 # HOST, PORT = "localhost", 18900
 DB_HOST, DB_PORT = "140.113.17.11", 19805
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
 MAX_LEN = 65536
 
 # ==== Lobby 狀態 ====
@@ -19,6 +24,9 @@ GAME_BIND_HOST = os.getenv("GAME_BIND_HOST", "0.0.0.0")  # 遊戲伺服器綁定
 ADVERTISE_HOST = os.getenv("ADVERTISE_HOST", "140.113.17.11")           # 廣播給 Client 的 IP（可手動指定）
 PORT_MIN, PORT_MAX = 10000, 60000
 UPLOAD_DIR = "server_games"
+STORE = BlobStore()
+DELTAS = DeltaCache(STORE)
+TRANSFER = TransferServer(HOST, TRANSFER_PORT)  # 大檔平行分塊下載的 side channel，main() 中啟動
 
 def allocate_port_in_range() -> int:
     candidates = list(range(PORT_MIN, PORT_MAX))
@@ -127,16 +135,11 @@ def start_game_server(room_id: str, host: str, port: int, on_finish):
     return server
 
 # ==== 連 DB  ====
+# 長連線池：同一條 socket 可同時有多個請求在途，不再每次 db_call 都重新 connect
+DB_POOL = DBPool(DB_HOST, DB_PORT, role="user", size=DB_POOL_SIZE)
+
 def db_call(payload: dict):
-    try:
-        with socket.create_connection((DB_HOST, DB_PORT), timeout=3) as s:
-            req = payload.copy()
-            req["role"] = "user"
-            send_json(s, req)
-            resp = recv_json(s)
-            return resp if isinstance(resp, dict) else err("db protocol error")
-    except Exception:
-        return err("db unavailable")
+    return DB_POOL.call(payload)
 
 def _room_status_payload(room):
     # room.players 為成員列表（字串 username）
@@ -160,7 +163,7 @@ def _broadcast_room_status(room, exclude_user=None):
         peer = USERS.get(u)
         if peer:
             with contextlib.suppress(Exception):
-                send_json(peer.sock, payload)
+                send_event(peer.sock, payload)
 
 
 class Room:
@@ -207,7 +210,7 @@ def room_start(room: Room, user: str):
             peer = USERS.get(p)
             if peer:
                 with contextlib.suppress(Exception):
-                    send_json(peer.sock, {"event":"game_finished", "finish": info})
+                    send_event(peer.sock, {"event":"game_finished", "finish": info})
         _broadcast_room_status(room)  # ← 顯示 open=True、成員仍在
 
     port = allocate_port_in_range()
@@ -217,6 +220,11 @@ def room_start(room: Room, user: str):
         port = allocate_port_in_range()
         start_game_server(room.id, host=GAME_BIND_HOST, port=port, on_finish=_on_finish)
     room.game = {"host": ADVERTISE_HOST, "port": port}  # 記錄給顯示用
+    # 附上遊戲檔的雜湊與版本：client 本地已有相同內容就直接啟動，不必再問 server
+    artifact = _resolve_artifact(room.gamename)
+    if artifact.get("sha256"):
+        room.game.update(sha256=artifact["sha256"], version=artifact["version"])
+        room.game.update({k: artifact[k] for k in ("package", "entry") if k in artifact})
     room.open = False
     # 更新 DB：關閉配對中之公開房（可選）
     try:
@@ -231,7 +239,7 @@ def room_start(room: Room, user: str):
         # if p == user:
         #     continue
         if peer:
-            send_json(peer.sock, {"event":"game_started", "game":info})
+            send_event(peer.sock, {"event":"game_started", "game":info})
 
 
     print(f"[Lobby] Started game for room {room.id} at {GAME_BIND_HOST}:{port}, advertised as {ADVERTISE_HOST}:{port}")
@@ -329,12 +337,23 @@ def handle_list_rooms(conn, sess, msg):
         send_json(conn, with_req_id(db_resp, req_id))
     return True
 
-def handle_list_store_games(conn, sess, msg):
+def _reply_list(conn, msg, payload: dict, key: str):
+    """
+    列表型回應：client 帶 stream=True 時，逐頁向 DB 取資料並以 continuation frame 轉送，
+    lobby 同一時間只持有一頁；否則維持單一 frame (超過 frame 上限時回明確錯誤，而不是讓 client 等到逾時)
+    """
     req_id = msg.get("req_id")
-    db_resp = db_call({"action": "list_store_games"})
-    send_json(conn, with_req_id(db_resp, req_id))
+    if msg.get("stream"):
+        send_stream(conn, DB_POOL.iter_pages(payload, key), key, req_id=req_id)
+        return True
+    db_resp = db_call(payload)
+    if not send_json(conn, with_req_id(db_resp, req_id)):
+        send_json(conn, err("response too large, retry with stream", req_id=req_id))
     return True
 
+def handle_list_store_games(conn, sess, msg):
+    return _reply_list(conn, msg, {"action": "list_store_games"}, "games")
+
 def handle_download_game(conn, sess, msg):
     req_id = msg.get("req_id")
     if not sess.authed:
@@ -373,10 +392,12 @@ def handle_rate_game(conn, sess, msg):
     return True
 
 def handle_list_ratings(conn, sess, msg):
-    req_id = msg.get("req_id")
     gamename = msg.get("gamename")
-    db_resp = db_call({"action": "list_ratings", "gamename": gamename})
-    send_json(conn, with_req_id(db_resp, req_id))
+    return _reply_list(conn, msg, {"action": "list_ratings", "gamename": gamename}, "ratings")
+
+def handle_game_summary(conn, sess, msg):
+    db_resp = db_call({"action": "game_summary", "gamename": msg.get("gamename")})
+    send_json(conn, with_req_id(db_resp, msg.get("req_id")))
     return True
 
 def handle_join_room(conn, sess, msg):
@@ -447,7 +468,7 @@ def handle_leave_room(conn, sess, msg):
             if peer:
                 info = {"room": rid, "winner": survivor, "reason": "opponent_left_room"}
                 with contextlib.suppress(Exception):
-                    send_json(peer.sock, {"event":"game_finished", "finish": info})
+                    send_event(peer.sock, {"event":"game_finished", "finish": info})
 
         if needs_reset:
             _reset_room(room, announce=True)
@@ -593,6 +614,52 @@ def handle_quit(conn, sess, msg):
     send_json(conn, ok("bye", req_id=req_id))
     return False
 
+def _resolve_artifact(gamename, package: bool = True, bytecode=None) -> dict:
+    """
+    找出遊戲目前版本要下載的檔案：{"path", "filename", "size", "sha256", "version"}；失敗時 {"msg": 原因}。
+    有 manifest 的遊戲從 store 取 blob (內容不可變，不會讀到上傳中的檔案)；
+    多檔案遊戲包回傳整包 tar 並多帶 package / entry (package=False 時只給進入點，給看不懂 tar 的舊版 client)；
+    bytecode 為 cache_tag 時改回傳該版本的 bytecode bundle，source_sha256 是它對應的原始碼 (整包或進入點)；
+    store 上線前上傳的舊遊戲則退回 server_games/<game>/main.py
+    """
+    if not gamename:
+        return {"msg": "missing gamename"}
+    db_resp = db_call({"action": "game_manifest", "gamename": gamename})
+    if db_resp.get("status") == "OK":
+        if db_resp.get("game_status") != "PUBLISHED":
+            return {"msg": "game not published"}
+        manifest = db_resp.get("manifest") or {}
+        entry = manifest_entry(manifest)
+        if bytecode:
+            bundle = (manifest.get("bytecode") or {}).get(bytecode)
+            source = manifest_artifact(manifest) if package else entry
+            if not bundle or not source or not STORE.has(bundle.get("sha256")):
+                return {"msg": "no bytecode"}
+            return {"path": STORE.path(bundle["sha256"]), "filename": f"{gamename}.{bytecode}.zip",
+                    "size": bundle["size"], "sha256": bundle["sha256"], "version": db_resp.get("version"),
+                    "bytecode": bytecode, "source_sha256": source["sha256"]}
+        if package and manifest.get("package"):
+            pkg = manifest_artifact(manifest)
+            if not entry or not STORE.has(pkg.get("sha256")):
+                return {"msg": "game_file_not_found"}
+            return {"path": STORE.path(pkg["sha256"]), "filename": f"{gamename}.tar", "size": pkg["size"],
+                    "sha256": pkg["sha256"], "version": db_resp.get("version"),
+                    "package": pkg.get("format", "tar"), "entry": entry["path"]}
+        if not entry or not STORE.has(entry.get("sha256")):
+            return {"msg": "game_file_not_found"}
+        return {"path": STORE.path(entry["sha256"]), "filename": entry["path"], "size": entry["size"],
+                "sha256": entry["sha256"], "version": db_resp.get("version")}
+    if db_resp.get("msg") != "no manifest":
+        return {"msg": db_resp.get("msg")}
+    if bytecode:
+        return {"msg": "no bytecode"}
+
+    legacy = os.path.join(UPLOAD_DIR, os.path.basename(gamename), "main.py")
+    if not os.path.isfile(legacy):
+        return {"msg": "game_file_not_found"}
+    return {"path": legacy, "filename": "main.py", "size": os.path.getsize(legacy),
+            "sha256": file_sha256(legacy), "version": None}
+
 def handle_download_game_file(conn, sess, msg):
     req_id = msg.get("req_id")
     # 為了避免混淆，將原本單純改 DB 的 download_game 保留，
@@ -603,33 +670,99 @@ def handle_download_game_file(conn, sess, msg):
     
     gamename = msg.get("gamename")
     
-    # 1. 尋找檔案
-    # 這裡簡化邏輯：假設每個遊戲資料夾下只有一個檔案，或者你需要 DB 紀錄檔名
-    game_dir = os.path.join(UPLOAD_DIR, gamename)
-    target_file = None
-    
-    if os.path.exists(game_dir):
-        files = os.listdir(game_dir)
-        if files:
-            # 簡單起見，拿第一個檔案
-            target_file = os.path.join(game_dir, files[0])
-    
-    if not target_file:
-        send_json(conn, err("game_file_not_found", req_id=req_id))
+    # 1. 尋找檔案：依 DB 中 latest 版本的 manifest，以雜湊從內容定址 store 取檔
+    #    (client 帶 accept_package 才送多檔案遊戲包的整包 tar，否則只送進入點；
+    #     帶 bytecode=<cache_tag> 時送該版本的預編譯 bundle)
+    artifact = _resolve_artifact(gamename, bool(msg.get("accept_package")), msg.get("bytecode"))
+    if not artifact.get("path"):
+        send_json(conn, err(artifact.get("msg") or "game_file_not_found", req_id=req_id))
+        return True
+    target_file = artifact["path"]
+    pkg = {k: artifact[k] for k in ("package", "entry", "bytecode", "source_sha256") if k in artifact}
+
+    # 2. if_none_match：client 本地 (已安裝或共用快取) 已有這個雜湊的檔案就不必再傳
+    filename = artifact["filename"]
+    size = artifact["size"]
+    sha256 = artifact["sha256"]
+    known = msg.get("if_none_match") or []
+    if isinstance(known, str):
+        known = [known]
+    if sha256 in known:
+        send_json(conn, ok("NOT_MODIFIED", req_id=req_id, gamename=gamename, filename=filename,
+                           size=size, sha256=sha256, version=artifact["version"], **pkg))
         return True
 
-    # 2. 告訴 Client 準備接收 (包含檔名)
-    filename = os.path.basename(target_file)
-    send_json(conn, ok("READY_TO_SEND", req_id=req_id, filename=filename))
+    #    續傳：client 帶上部分檔的長度 (offset) 與它所屬版本的 sha256，
+    #    版本不同或 offset 不合理就從頭傳
+    offset = msg.get("offset") or 0
+    if not isinstance(offset, int) or not (0 <= offset <= size) or msg.get("sha256") != sha256:
+        offset = 0
+
+    # 3. 差異更新：client 已安裝舊版 (have_sha256) 且不是在續傳時，改送 base -> latest 的 delta
+    #    (第一次有人要時計算並快取，之後直接送快取檔)；delta 不划算時照常送完整檔案
+    extra = {}
+    have = msg.get("have_sha256")
+    if have and not offset and have != sha256:
+        delta_path = DELTAS.get(have, sha256)
+        if delta_path:
+            extra = {"encoding": "delta", "base_sha256": have, "delta_size": os.path.getsize(delta_path)}
+            target_file = delta_path
+            print(f"[Lobby] {sess.authed} {gamename} delta {msg.get('have_version')} -> {artifact['version']}: "
+                  f"{extra['delta_size']} / {size} bytes")
+
+    #    壓縮變體：client 宣告可解的編碼 (accept_encoding) 且上傳時已壓好變體，就送變體，
+    #    client 邊收邊解壓；續傳與分塊下載需要原檔的位移，只送原檔
+    if not extra and not offset:
+        variant = STORE.best_variant(sha256, msg.get("accept_encoding") or [])
+        if variant:
+            extra = {"content_encoding": variant[0], "transfer_size": variant[2]}
+            target_file = variant[1]
+
+    # 4. 支援傳輸通道的 client：只在控制連線上發一張短期 ticket (TRANSFER_READY)，
+    #    檔案由 client 另開連線向 TRANSFER_PORT 取，handler 與 client 的 listener 都不會被占住；
+    #    大檔且 client 要求平行下載時附上 chunk 清單，讓它開多條連線分塊抓
+    if msg.get("transfer") and TRANSFER.running:
+        info = {}
+        chunk = None
+        if not extra and not offset and msg.get("parallel") and size >= PARALLEL_MIN_SIZE:
+            chunk = chunk_size_for(size)
+            info = {"chunk_size": chunk, "chunks": chunk_hashes(target_file, sha256, chunk)}
+        ticket = TRANSFER.tickets.issue(sess.authed, target_file, os.path.getsize(target_file),
+                                        sha256 if chunk else None, chunk)
+        send_json(conn, ok("TRANSFER_READY", req_id=req_id, gamename=gamename, filename=filename,
+                           size=size, sha256=sha256, offset=offset, version=artifact["version"],
+                           ticket=ticket, port=TRANSFER.port, **pkg, **extra, **info))
+        return True
 
-    # 3. 發送檔案
-    send_file(conn, target_file)
+    # 5. 舊版 client (或傳輸通道未啟動)：直接在控制連線上傳檔。
+    #    告訴 Client 準備接收 (包含檔名、完整大小與雜湊)，接著發送 [offset, 檔尾)
+    #    exclusive_send 期間其他執行緒的推播先排隊 (送完再補送)，不會插進檔案內容，
+    #    持有全域鎖廣播房況的 handler 也不必等這段 (可能被限速的) 檔案送完
+    #    同樣受傳輸排程限制 (舊版 client 看不懂排隊通知，只能等)
+    with TRANSFER.scheduler.slot(sess.authed), exclusive_send(conn):
+        send_json(conn, ok("READY_TO_SEND", req_id=req_id, gamename=gamename, filename=filename,
+                           size=size, sha256=sha256, offset=offset, version=artifact["version"], **pkg, **extra))
+        send_file(conn, target_file, offset, throttle=TRANSFER.scheduler.throttle)
     
-    # 4. (選用) 在此處呼叫 DB 記錄下載次數
-    db_call({"action": "download_game", "gamename": gamename, "username": sess.authed})
+    # 6. (選用) 在此處呼叫 DB 記錄下載次數 (bytecode bundle 是附屬檔案，不另計)
+    if not artifact.get("bytecode"):
+        db_call({"action": "download_game", "gamename": gamename, "username": sess.authed})
+    return True
+
+def handle_hello(conn, sess, msg):
+    # 編碼協商：回覆後這條連線改用協商出的編碼送出
+    serve_hello(conn, msg, msg.get("req_id"))
+    return True
+
+def handle_stats(conn, sess, msg):
+    # 營運用：檔案傳輸吞吐量、傳輸排程的佇列深度、DB 各 action 的呼叫次數與耗時等統計
+    db_resp = db_call({"action": "db_stats"})
+    send_json(conn, ok(req_id=msg.get("req_id"), transfer=transfer_stats(), scheduler=TRANSFER.scheduler.stats(),
+                       db={k: db_resp.get(k) for k in ("actions", "group_commit")}))
     return True
 
 COMMAND_HANDLERS = {
+    "hello": handle_hello,
     "register": handle_register,
     "login": handle_login,
     "who_online": handle_who_online,
@@ -640,6 +773,7 @@ COMMAND_HANDLERS = {
     "my_downloads": handle_my_downloads,
     "rate_game": handle_rate_game,
     "list_ratings": handle_list_ratings,
+    "game_summary": handle_game_summary,
     "join_room": handle_join_room,
     "leave_room": handle_leave_room,
     "start_game": handle_start_game,
@@ -648,6 +782,7 @@ COMMAND_HANDLERS = {
     "accept_invite": handle_accept_invite,
     "QUIT": handle_quit,
     "download_game_file": handle_download_game_file,
+    "stats": handle_stats,
 }
 
 def handle_client(conn, addr):
@@ -704,6 +839,10 @@ def main():
     srv.bind((HOST, PORT))
     srv.listen(128)
     print(f"[Lobby] listening on {HOST}:{PORT}")
+    try:
+        TRANSFER.start()
+    except OSError as e:
+        print(f"[Lobby] transfer channel disabled ({e}); downloads stay on the control connection")
     try:
         resp = db_call({"action": "reset_runtime"})
         if resp and resp.get("status") == "OK":
@@ -4,133 +4,127 @@ import sys
 import os
 import time
 import queue
+import asyncio
 import subprocess
 import shlex
 import select
-
-# 引入 utils 中的函式 (請確保 utils.py 已包含 recv_file)
-from utils import send_json, recv_json, gen_req_id, recv_file
+import contextlib
+import json
+import shutil
+import stat
+import tarfile
+
+from utils import file_sha256, FILE_ENCODINGS
+from lobby_core import LobbyCore
+from delta import apply_delta
+from transfer import fetch_file, fetch_parallel, DEFAULT_STREAMS
+from package import PackageError, extract_package
+from bytecode import extract_bundle
+from game_launcher import LAUNCH_MODE, LaunchControl, WarmInterpreter, cold_command
 
 # 連線設定 (可透過環境變數覆寫)
 HOST = os.getenv("LOBBY_HOST", "140.113.17.11")
 PORT = int(os.getenv("LOBBY_PORT", "18905"))
+DOWNLOAD_TIMEOUT = 600  # 退回控制連線直接傳檔時 reader 被占用，回應要等傳完才會到
+# 本機共用的遊戲檔快取 (以 sha256 為檔名)，以及每個遊戲最後一次取得的版本
+CACHE_DIR = os.getenv("GAME_CACHE_DIR", os.path.join("download_cache", "objects"))
+REFS_DIR = os.path.join("download_cache", "refs")
+# 多檔案遊戲包解開後，遊戲目錄裡記錄「整包 sha256 與進入點」的檔案
+PACKAGE_MARKER = ".package.json"
+# 已解開的 bytecode bundle 對應哪個原始碼版本與 cache_tag
+BYTECODE_MARKER = ".bytecode.json"
+
+def _rating_text(info: dict) -> str:
+    # 舊版 server 沒有評分彙總欄位時顯示 "-"
+    if not info.get("rating_count"):
+        return "-"
+    return f"{info['rating_avg']:.1f} ({info['rating_count']})"
 
 class LobbyClient:
     def __init__(self):
-        self.sock = None
+        self.core = None
+        self.loop = None
         self.username = None
         self.running = True
         self.current_room_id = None
         self.pending_game_info = None
         
-        # 用於存放等待中的 Request 回應 (req_id -> payload)
-        self.response_queues = {}
-        self.lock = threading.Lock()
-        
         # 用於存放非同步通知 (如邀請、遊戲開始)，供 UI 顯示
         self.notification_queue = queue.Queue()
         self.game_process = None
+        # 事件到達時喚醒房間畫面的 select (取代輪詢 stdin)
+        self._wake_r, self._wake_w = socket.socketpair()
+
+        # 啟動器：本機控制埠 (子行程回報連上遊戲伺服器的時間)、預熱的直譯器 (GAME_LAUNCHER=warm)
+        self.launch_control = None
+        self.warm = None
+        self.game_started_at = None
+        self.launch_times = []  # [(mode, ms)]：game_started 到遊戲連上遊戲伺服器
 
     def connect(self):
         try:
-            self.sock = socket.create_connection((HOST, PORT), timeout=None)
+            # 連線核心 (lobby_core) 跑在背景執行緒的 event loop，選單 UI 以同步方式呼叫
+            self.loop = asyncio.new_event_loop()
+            threading.Thread(target=self.loop.run_forever, daemon=True).start()
+            self.core = LobbyCore()
+            self.core.on("*", self._handle_event)
+            self.core.file_sink = self._inline_download_path
+            self.core.on_close = self._on_disconnect
+            self._run(self.core.connect(HOST, PORT))
             print(f"[System] Connected to Lobby at {HOST}:{PORT}")
-            
-            # 啟動監聽執行緒
-            self.listen_thread = threading.Thread(target=self._listener, daemon=True)
-            self.listen_thread.start()
             return True
         except Exception as e:
             print(f"[Error] Connection failed: {e}")
             return False
 
+    def _run(self, coro):
+        """在連線核心的 event loop 上執行 coroutine，等它完成"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
     def close(self):
         self.running = False
-        if self.sock:
-            self.sock.close()
+        self._discard_warm()
+        if self.launch_control:
+            self.launch_control.close()
+        if self.core:
+            with contextlib.suppress(Exception):
+                self._run(self.core.close())
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def _wake(self):
+        with contextlib.suppress(OSError):
+            self._wake_w.send(b"\0")
+
+    def _on_disconnect(self):
+        if self.running:
+            print("\n[System] Disconnected from server.")
+        self.running = False
+        self._wake()
 
-    def _listener(self):
+    def _inline_download_path(self, msg):
         """
-        背景執行緒：負責接收所有來自 Server 的訊息。
-        包含：一般 JSON 回應、主動推播事件 (Events)、檔案傳輸串流。
+        server 沒開傳輸通道時在控制連線上直接送檔 (READY_TO_SEND)：
+        存到 download_cache/{username}/{gamename}/{sha256}.part，由 perform_download 驗證雜湊後再搬到
+        downloads/{Player}/{Game}/。中途斷線時部分檔會留著，下次從檔案大小處續傳
         """
-        while self.running and self.sock:
-            try:
-                # 1. 嘗試讀取標準 JSON 訊息
-                msg = recv_json(self.sock)
-                if msg is None:
-                    print("\n[System] Disconnected from server.")
-                    self.running = False
-                    break
-
-                # --- 特殊處理：檔案傳輸 ---
-                # 檢查是否為檔案傳輸前的預告信號 (由 lobby.py 修改版發送)
-                if msg.get("status") == "OK" and msg.get("msg") == "READY_TO_SEND":
-                    filename = msg.get("filename", "game.py")
-                    # 暫時通知 UI
-                    print(f"\n[Download] Server is sending file: {filename}...")
-                    
-                    # 決定存檔路徑: downloads/{username}/{gamename}/filename
-                    # 注意：這裡假設 Context 知道正在下載哪個遊戲，或者 Server 可以在 msg 帶入 gamename
-                    # 為了簡化，我們先存到 downloads/temp/，後續邏輯再移動，或是依賴 msg 帶路徑
-                    # 這裡示範簡單邏輯：從 response queue 找最近的一個 download request
-                    # 但更穩健的是 Server 回傳時帶上 gamename，這裡假設 Server 有回傳
-                    
-                    # 這裡直接接收到當前目錄的暫存區，由主執行緒處理搬移，或是直接寫死路徑
-                    # 為了配合作業目錄結構 downloads/{Player}/{Game}
-                    # 我們假設在發送 download 请求時已經建立了資料夾，這裡我們需要知道存哪
-                    # 這裡做一個簡單的全域變數或 Context 處理有點複雜，
-                    # 簡單作法：Server 傳來的 msg 包含 gamename (建議修改 Server 端)
-                    # 假設 Server 回傳: {"status":"OK", "msg":"READY_TO_SEND", "filename":"main.py", "req_id":...}
-                    
-                    # 透過 req_id 找到是誰發起的下載，雖然這裡是在 listener
-                    req_id = msg.get("req_id")
-                    
-                    # 觸發接收二進制檔案
-                    # 注意：這會阻塞 Listener，直到檔案收完，這正是我們要的
-                    # 我們需要一個地方存。暫時存到 "download_cache"
-                    os.makedirs("download_cache", exist_ok=True)
-                    temp_path = os.path.join("download_cache", filename)
-                    
-                    success = recv_file(self.sock, temp_path)
-                    
-                    if success:
-                        msg["download_path"] = temp_path # 將路徑注入回 msg
-                        msg["status"] = "OK" # 確保狀態
-                    else:
-                        msg["status"] = "ERROR"
-                        msg["msg"] = "File transfer failed"
-
-                # 2. 分類訊息
-                req_id = msg.get("req_id")
-                event = msg.get("event")
-
-                if req_id and req_id in self.response_queues:
-                    # 這是對應某個 Request 的回應
-                    self.response_queues[req_id].put(msg)
-                
-                elif event:
-                    # 這是 Server 主動推播的事件 (Invite, GameStart, RoomStatus)
-                    self._handle_event(msg)
-                
-                else:
-                    # 其他未分類訊息，顯示出來 debug
-                    # print(f"\n[Debug] Unknown msg: {msg}")
-                    pass
-
-            except Exception as e:
-                # print(f"[Error] Listener error: {e}")
-                pass
+        print(f"\n[Download] Server is sending file: {msg.get('filename', 'game.py')}...")
+        temp_path = self._partial_path(msg.get("gamename", "unknown"), msg.get("sha256", "unknown"))
+        if msg.get("encoding") == "delta":
+            # 差異更新：先收 delta，由 perform_download 套用到已安裝的舊版
+            temp_path = temp_path[:-len(".part")] + ".delta"
+        return temp_path
 
     def _handle_event(self, msg):
         event = msg.get("event")
         
         if event == "game_started":
+            self.game_started_at = time.time()
             # [P3] 自動啟動遊戲
             game_info = msg.get("game", {})
             self.notification_queue.put(f"!!! 遊戲開始 !!! Room: {game_info.get('room')}")
             # 由主執行緒在房間等待流程中啟動，避免與輸入搶 stdin
             self.pending_game_info = game_info
+            self._wake()
             
         elif event == "room_status":
             # 更新房間顯示 (如果正在房間畫面的話)
@@ -152,9 +146,27 @@ class LobbyClient:
             print("[Error] 無法啟動遊戲：未知遊戲名稱")
             return
 
-        game_path = os.path.join("downloads", self.username, gamename, "main.py")
+        # 本地沒有房間要的版本時才連線更新 (已有相同雜湊的檔案就直接啟動)
+        if not self._ensure_game(gamename, game_info.get("sha256"), game_info.get("package"), game_info.get("entry")):
+            print(f"[Error] 無法取得遊戲 {gamename}，取消啟動")
+            return
+
+        # 有對應這個直譯器的預編譯 bytecode 就從 bytecode 啟動，省去開局時編譯原始碼
+        self._ensure_bytecode(gamename)
         host = game_info.get("host", "localhost")
         port = str(game_info.get("port"))
+
+        # 預熱模式：交給房間裡已經開好的直譯器執行，遊戲在目前的終端機跑，等它結束
+        if self.warm:
+            proc = self.warm.launch(self._entry_path(gamename), [host, port], self._bytecode_ready(gamename))
+            self.warm = None
+            if proc:
+                print(f"[System] 以預熱的直譯器啟動遊戲: {gamename} ...")
+                proc.wait()
+                return
+            print("[System] 預熱的直譯器無法使用，改為一般啟動")
+
+        cmd = self._game_command(gamename, host, port)
         
         print(f"[System] 嘗試在新視窗啟動遊戲: {gamename} ...")
         
@@ -162,7 +174,7 @@ class LobbyClient:
             # === Windows 系統 ===
             if sys.platform == "win32":
                 self.game_process = subprocess.Popen(
-                    [sys.executable, game_path, host, port],
+                    cmd,
                     creationflags=subprocess.CREATE_NEW_CONSOLE
                 )
             
@@ -170,51 +182,42 @@ class LobbyClient:
             elif sys.platform.startswith("linux"):
                 # 嘗試使用常見的終端機模擬器
                 try:
-                    self.game_process = subprocess.Popen([
-                        "gnome-terminal", "--", 
-                        sys.executable, game_path, host, port
-                    ])
+                    self.game_process = subprocess.Popen(["gnome-terminal", "--", *cmd])
                 except FileNotFoundError:
                     # 如果沒有 gnome-terminal，嘗試 xterm
                     try:
-                        self.game_process = subprocess.Popen([
-                            "xterm", "-e", 
-                            sys.executable, game_path, host, port
-                        ])
+                        self.game_process = subprocess.Popen(["xterm", "-e", *cmd])
                     except FileNotFoundError:
                         print("[System] 找不到可用的終端機視窗，將在當前視窗執行...")
                         # Fallback: 如果真的開不了新視窗，只好回到原本的同一視窗模式
                         if block_on_fallback:
-                            subprocess.run([sys.executable, game_path, host, port])
+                            subprocess.run(cmd)
                             return
-                        self.game_process = subprocess.Popen([sys.executable, game_path, host, port])
+                        self.game_process = subprocess.Popen(cmd)
                         print("\n>>> 請按 [Enter] 鍵將控制權交給遊戲 (重要！) <<<\n")
 
         except Exception as e:
             print(f"[Error] Failed to launch game: {e}")
 
-    def call(self, action, **kwargs):
-        """ 發送請求並等待回應 (同步模式) """
-        req_id = gen_req_id()
-        payload = {"action": action, "req_id": req_id}
-        payload.update(kwargs)
-        
-        # 註冊 Queue
-        q = queue.Queue()
-        with self.lock:
-            self.response_queues[req_id] = q
-            
-        send_json(self.sock, payload)
-        
+    def call(self, action, timeout: float = 10, **kwargs):
+        """ 發送請求並等待回應 (同步模式)；串流回應由連線核心組回單一 dict """
+        return self._run(self.core.call(action, timeout=timeout, **kwargs))
+
+    def call_iter(self, action, **kwargs):
+        """
+        串流請求：邊收邊 yield 每一筆資料，不必等全部到齊。
+        連線核心的 Queue 有上限，消費端跟不上時會暫停讀 socket (TCP 自然回壓)，記憶體用量固定。
+        失敗時丟出 RuntimeError。
+        """
+        rows = self.core.call_iter(action, **kwargs)
         try:
-            # 等待回應 (Timeout 5秒)
-            resp = q.get(timeout=10) 
-            return resp
-        except queue.Empty:
-            return {"status": "ERROR", "msg": "Request timed out"}
+            while True:
+                try:
+                    yield self._run(rows.__anext__())
+                except StopAsyncIteration:
+                    return
         finally:
-            with self.lock:
-                self.response_queues.pop(req_id, None)
+            self._run(rows.aclose())
 
     # ================= UI / Menu Logic =================
 
@@ -301,7 +304,7 @@ class LobbyClient:
 
     def ui_store(self):
         """ [P1] 瀏覽商城與 [P2] 下載 """
-        resp = self.call("list_store_games")
+        resp = self.call("list_store_games", stream=True)
         games = resp.get("games", [])
         
         if not games:
@@ -312,9 +315,9 @@ class LobbyClient:
         while True:
             self.clear_screen()
             print("=== 遊戲商城 ===")
-            print(f"{'No.':<4} {'Game Name':<15} {'Version':<10} {'Status'}")
+            print(f"{'No.':<4} {'Game Name':<15} {'Version':<10} {'Rating':<12} {'Status'}")
             for i, g in enumerate(games):
-                print(f"{i+1:<4} {g['gamename']:<15} {g['latest']:<10} {g['status']}")
+                print(f"{i+1:<4} {g['gamename']:<15} {g['latest']:<10} {_rating_text(g):<12} {g['status']}")
             print("0. 返回")
             
             sel = input("輸入編號查看詳情/下載 (0 返回): ").strip()
@@ -335,7 +338,13 @@ class LobbyClient:
         print(f"\n--- {gn} ---")
         print(f"擁有者: {game_info['owner']}")
         print(f"最新版本: {game_info['latest']}")
-        # 這裡還可以呼叫 list_ratings 顯示評價 [P1]
+        # [P1] 評分彙總 (不必抓回全部評價)
+        summary = self.call("game_summary", gamename=gn)
+        if summary.get("status") == "OK":
+            print(f"評分: {_rating_text(summary)}")
+            hist = summary.get("histogram") or {}
+            for n in range(5, 0, -1):
+                print(f"  {n}分: {hist.get(str(n), 0)}")
         
         print("\n1. [P2] 下載/更新此遊戲")
         print("2. [P4] 查看評價")
@@ -347,44 +356,392 @@ class LobbyClient:
         elif op == "2":
             self.ui_ratings(gn)
 
-    def perform_download(self, gamename):
-        """ [P2] 執行下載流程 (整合檔案傳輸) """
-        print(f"正在請求下載 {gamename}...")
-        
-        # 1. 發送特殊的 download_game_file 請求 (根據上一輪對話的 Server 修改)
-        resp = self.call("download_game_file", gamename=gamename)
-        
-        if resp.get("status") == "OK" and "download_path" in resp:
-            temp_path = resp["download_path"]
-            filename = os.path.basename(temp_path)
-            
-            # 2. 移動檔案到正確位置 downloads/{Player}/{Game}/
-            target_dir = os.path.join("downloads", self.username, gamename)
-            os.makedirs(target_dir, exist_ok=True)
-            target_path = os.path.join(target_dir, filename)
-            
-            # 簡單的搬移 (如果跨 filesystem 需用 shutil)
+    def _partial_path(self, gamename, sha256):
+        return os.path.join("download_cache", self.username or "guest", gamename, f"{sha256}.part")
+
+    def _find_partial(self, gamename):
+        """找出這個遊戲上次中斷留下的部分檔，回傳 (sha256, 已收到的 bytes) 或 None"""
+        part_dir = os.path.dirname(self._partial_path(gamename, "x"))
+        if not os.path.isdir(part_dir):
+            return None
+        parts = [f for f in os.listdir(part_dir) if f.endswith(".part")]
+        if not parts:
+            return None
+        best = max(parts, key=lambda f: os.path.getsize(os.path.join(part_dir, f)))
+        return best[:-len(".part")], os.path.getsize(os.path.join(part_dir, best))
+
+    def _clear_partials(self, gamename, keep=None):
+        part_dir = os.path.dirname(self._partial_path(gamename, "x"))
+        if not os.path.isdir(part_dir):
+            return
+        for f in os.listdir(part_dir):
+            path = os.path.join(part_dir, f)
+            if f.endswith((".part", ".chunks")) and path != keep:
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+
+    # ---------- 本機共用快取：同一台機器的所有使用者共用，以內容雜湊為 key ----------
+    def _cache_path(self, sha256):
+        return os.path.join(CACHE_DIR, sha256[:2], sha256)
+
+    def _cache_has(self, sha256):
+        """快取中有這個雜湊且內容正確 (被改過的物件直接丟掉)"""
+        path = self._cache_path(sha256)
+        if not os.path.isfile(path):
+            return False
+        if file_sha256(path) == sha256:
+            return True
+        with contextlib.suppress(OSError):
+            os.remove(path)
+        return False
+
+    def _cache_put(self, src_path, sha256):
+        """把驗證過的檔案搬進快取 (rename，不複製)"""
+        if self._cache_has(sha256):
+            with contextlib.suppress(OSError):
+                os.remove(src_path)
+            return
+        dest = self._cache_path(sha256)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        shutil.move(src_path, dest)
+
+    def _ref_path(self, gamename):
+        return os.path.join(REFS_DIR, f"{gamename}.json")
+
+    def _read_ref(self, gamename):
+        """這台機器上最後一次取得的版本：{"sha256", "version", "filename"}"""
+        with contextlib.suppress(OSError, ValueError):
+            with open(self._ref_path(gamename), encoding="utf-8") as f:
+                return json.load(f)
+        return None
+
+    def _write_ref(self, gamename, resp):
+        ref = {"sha256": resp.get("sha256"), "version": resp.get("version"), "filename": resp.get("filename"),
+               "package": resp.get("package"), "entry": resp.get("entry")}
+        path = self._ref_path(gamename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(ref, f)
+        os.replace(tmp, path)
+
+    def _game_dir(self, gamename):
+        return os.path.join("downloads", self.username or "guest", gamename)
+
+    def _read_marker(self, gamename):
+        with contextlib.suppress(OSError, ValueError):
+            with open(os.path.join(self._game_dir(gamename), PACKAGE_MARKER), encoding="utf-8") as f:
+                return json.load(f)
+        return None
+
+    def _entry_path(self, gamename):
+        """要啟動的檔案：遊戲包記錄的進入點，單一檔案遊戲就是 main.py"""
+        marker = self._read_marker(gamename)
+        entry = marker.get("entry") if marker else None
+        return os.path.join(self._game_dir(gamename), *(entry or "main.py").split("/"))
+
+    def _game_command(self, gamename, host, port):
+        """啟動遊戲的指令：經 game_launcher 執行進入點 (bytecode 已就緒時以 import 載入，使用 pyc)"""
+        return cold_command(self._entry_path(gamename), [host, port], self._bytecode_ready(gamename),
+                            self._launch_control())
+
+    def _launch_control(self):
+        if self.launch_control is None:
+            with contextlib.suppress(OSError):
+                self.launch_control = LaunchControl(self._on_game_connected)
+        return self.launch_control
+
+    def _on_game_connected(self, msg):
+        """(控制埠執行緒) 遊戲子行程第一次連線成功：記錄 game_started 到連上的時間"""
+        if self.game_started_at is None:
+            return
+        ms = (msg.get("t", time.time()) - self.game_started_at) * 1e3
+        self.game_started_at = None
+        self.launch_times.append((msg.get("mode", "cold"), ms))
+
+    def _report_launch_time(self):
+        if not self.launch_times:
+            return
+        mode, ms = self.launch_times[-1]
+        same = [t for m, t in self.launch_times if m == mode]
+        print(f"[Launch] 遊戲開始 -> 連上遊戲伺服器: {ms:.0f} ms ({mode}，{len(same)} 次平均 {sum(same) / len(same):.0f} ms)")
+
+    def _prewarm(self):
+        """GAME_LAUNCHER=warm 時，待在房間期間保持一個預熱的直譯器"""
+        if LAUNCH_MODE != "warm" or (self.warm and self.warm.alive()) or not self._launch_control():
+            return
+        self.warm = WarmInterpreter(self.launch_control)
+        try:
+            self.warm.start()
+        except OSError:
+            self.warm = None
+
+    def _discard_warm(self):
+        if self.warm:
+            self.warm.discard()
+            self.warm = None
+
+    def _bytecode_ready(self, gamename, installed=None):
+        installed = installed or self._installed(gamename)
+        with contextlib.suppress(OSError, ValueError):
+            with open(os.path.join(self._game_dir(gamename), BYTECODE_MARKER), encoding="utf-8") as f:
+                marker = json.load(f)
+            return bool(installed) and marker.get("tag") == sys.implementation.cache_tag \
+                and marker.get("source_sha256") == installed["sha256"]
+        return False
+
+    def _ensure_bytecode(self, gamename, use_transfer: bool = True) -> bool:
+        """
+        取得並解開已安裝版本對應本機直譯器 (cache_tag) 的 bytecode bundle；
+        server 沒有這個版本的 bundle 或下載失敗時回傳 False (照常從原始碼啟動)。
+        傳輸通道連不上時同 _fetch_game，改用控制連線再試一次
+        """
+        installed = self._installed(gamename)
+        if not installed:
+            return False
+        if self._bytecode_ready(gamename, installed):
+            return True
+        tag = sys.implementation.cache_tag
+        resp = self.call("download_game_file", timeout=DOWNLOAD_TIMEOUT, gamename=gamename, transfer=use_transfer,
+                         accept_package=True, accept_encoding=list(FILE_ENCODINGS), bytecode=tag)
+        if resp.get("status") != "OK" or resp.get("source_sha256") != installed["sha256"]:
+            # 沒有 bundle，或 server 上已是別的版本 (bundle 對不上已安裝的原始碼)
+            return False
+        sha256 = resp["sha256"]
+        path = resp.get("download_path")
+        if not self._cache_has(sha256):
+            if resp.get("msg") == "TRANSFER_READY":
+                path = self._partial_path(gamename, sha256)[:-len(".part")] + ".bundle"
+                if not fetch_file(self.core.peer_host, resp, path):
+                    return use_transfer and self._ensure_bytecode(gamename, use_transfer=False)
+            if not path or file_sha256(path) != sha256:
+                return False
+            self._cache_put(path, sha256)
+        elif path:
+            with contextlib.suppress(OSError):
+                os.remove(path)
+        try:
+            game_dir = self._game_dir(gamename)
+            extract_bundle(self._cache_path(sha256), game_dir)
+            with open(os.path.join(game_dir, BYTECODE_MARKER), "w", encoding="utf-8") as f:
+                json.dump({"sha256": sha256, "tag": tag, "source_sha256": installed["sha256"]}, f)
+        except (OSError, ValueError) as e:
+            print(f"[System] 預編譯 bytecode 安裝失敗 ({e})，改從原始碼啟動")
+            return False
+        return True
+
+    def _installed(self, gamename):
+        """
+        本地已安裝的版本 (不需連線)，沒安裝時回傳 None。
+        遊戲包以目錄中的標記取得整包 sha256；path 是快取中的整包 tar (可當 delta 的 base，不在快取時為 None)
+        """
+        marker = self._read_marker(gamename)
+        if marker and marker.get("sha256"):
+            sha256 = marker["sha256"]
+            return {"path": self._cache_path(sha256) if self._cache_has(sha256) else None, "sha256": sha256}
+        path = os.path.join(self._game_dir(gamename), "main.py")
+        if not os.path.isfile(path):
+            return None
+        return {"path": path, "sha256": file_sha256(path)}
+
+    def _install(self, gamename, sha256, filename="main.py", package=None, entry=None):
+        """從快取 hard link (不支援時複製) 到 downloads/{Player}/{Game}/，回傳安裝路徑"""
+        if package:
+            return self._install_package(gamename, sha256, entry or "main.py")
+        target_dir = self._game_dir(gamename)
+        os.makedirs(target_dir, exist_ok=True)
+        target_path = os.path.join(target_dir, filename)
+        tmp = f"{target_path}.{os.getpid()}.tmp"
+        with contextlib.suppress(OSError):
+            os.remove(tmp)
+        try:
+            os.link(self._cache_path(sha256), tmp)
+        except OSError:
+            shutil.copyfile(self._cache_path(sha256), tmp)
+        # os.replace 直接覆蓋舊版 (atomic)；不會動到其他使用者連到同一物件的檔案
+        os.replace(tmp, target_path)
+        # 從遊戲包換回單一檔案的版本：標記拿掉，啟動時改用 main.py
+        with contextlib.suppress(OSError):
+            os.remove(os.path.join(target_dir, PACKAGE_MARKER))
+
+        # 賦予執行權限 (Linux)
+        st = os.stat(target_path)
+        os.chmod(target_path, st.st_mode | stat.S_IEXEC)
+        return target_path
+
+    def _install_package(self, gamename, sha256, entry):
+        """
+        把快取中的整包 tar 解到暫存目錄，寫好標記後整個目錄換上去：
+        舊版本的檔案不會殘留，解到一半失敗也不會破壞已安裝的版本
+        """
+        target_dir = self._game_dir(gamename)
+        staging = f"{target_dir}.{os.getpid()}.tmp"
+        old = f"{target_dir}.{os.getpid()}.old"
+        for d in (staging, old):
+            shutil.rmtree(d, ignore_errors=True)
+        os.makedirs(staging)
+        try:
+            extract_package(self._cache_path(sha256), staging)
+            with open(os.path.join(staging, PACKAGE_MARKER), "w", encoding="utf-8") as f:
+                json.dump({"sha256": sha256, "entry": entry}, f)
+            if os.path.isdir(target_dir):
+                os.rename(target_dir, old)
+            os.rename(staging, target_dir)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+            shutil.rmtree(old, ignore_errors=True)
+        return self._entry_path(gamename)
+
+    def _ensure_game(self, gamename, sha256=None, package=None, entry=None):
+        """
+        啟動前確認本地遊戲檔就是房間要的版本：已安裝或快取中有同雜湊的檔案就不連線，
+        否則才下載。server 沒附雜湊 (舊版) 時，有安裝就直接用。
+        """
+        installed = self._installed(gamename)
+        if sha256 is None:
+            return installed is not None or self._fetch_game(gamename)
+        if installed and installed["sha256"] == sha256:
+            return True
+        if self._cache_has(sha256):
             try:
-                if os.path.exists(target_path):
-                    os.remove(target_path) # 覆蓋舊版
-                os.replace(temp_path, target_path)
-                
-                # 賦予執行權限 (Linux)
-                import stat
-                st = os.stat(target_path)
-                os.chmod(target_path, st.st_mode | stat.S_IEXEC)
-                
-                print(f"[Success] 遊戲已下載至: {target_path}")
-                
-                # 更新 DB 紀錄 (因為 lobby.py 修改版可能在傳完檔後沒寫入 downloads 表)
-                # 這裡補發一個純紀錄用的 request 比較保險，或是依賴 server 邏輯
-                self.call("download_game", gamename=gamename) 
-                
-            except Exception as e:
-                print(f"[Error] 檔案搬移失敗: {e}")
+                self._install(gamename, sha256, package=package, entry=entry)
+                return True
+            except (OSError, PackageError, tarfile.TarError) as e:
+                print(f"[System] 從快取安裝失敗 ({e})，重新下載...")
+        print(f"[System] 本地的 {gamename} 與房間版本不同，更新中...")
+        return self._fetch_game(gamename)
+
+    def _apply_delta(self, gamename, resp, base):
+        """把收到的 delta 套用到本地舊版，回傳組好的新版 partial 路徑；失敗回傳 None"""
+        delta_path = resp["download_path"]
+        out_path = self._partial_path(gamename, resp.get("sha256"))
+        try:
+            if not base or resp.get("base_sha256") != base["sha256"]:
+                return None
+            apply_delta(base["path"], delta_path, out_path)
+            print(f"[Download] 差異更新：只下載了 {resp.get('delta_size')} / {resp.get('size')} bytes")
+            return out_path
+        except (OSError, ValueError) as e:
+            print(f"[Download] 套用差異更新失敗 ({e})，改為完整下載")
+            with contextlib.suppress(OSError):
+                os.remove(out_path)
+            return None
+        finally:
+            with contextlib.suppress(OSError):
+                os.remove(delta_path)
+
+    def _fetch_game(self, gamename, allow_delta: bool = True, use_transfer: bool = True) -> bool:
+        """
+        取得最新版並安裝到 downloads/{Player}/{Game}/，成功回傳 True：
+        - if_none_match：已安裝或本機快取已有最新版時 server 只回 NOT_MODIFIED，從快取連結即可
+        - 續傳：有上次中斷的部分檔就帶上 offset / sha256
+        - 差異更新：回報已安裝 (或快取中) 的舊版，server 可能只送 delta
+        - accept_encoding：宣告可解的壓縮格式，server 有預先壓好的變體就送變體
+        - 傳輸通道連不上 (防火牆、port 未開放等) 時改用控制連線 (use_transfer=False) 再試一次
+        """
+        installed = self._installed(gamename)
+        ref = self._read_ref(gamename)
+        cached = ref if ref and ref.get("sha256") and self._cache_has(ref["sha256"]) else None
+        known = [x["sha256"] for x in (installed, cached) if x]
+        # transfer：檔案改由專用傳輸通道取得，控制連線 (listener) 不會被下載占住
+        # accept_package：多檔案遊戲包以整包 tar 下載後解開
+        extra = {"transfer": use_transfer, "accept_encoding": list(FILE_ENCODINGS), "accept_package": True}
+        if known:
+            extra["if_none_match"] = known
+
+        partial = self._find_partial(gamename)
+        if partial:
+            extra.update(sha256=partial[0], offset=partial[1])
+            print(f"[Download] 從 {partial[1]} bytes 處續傳...")
+        elif use_transfer:
+            # 大檔時 server 可能改發 ticket，由我們開多條連線平行分塊下載
+            extra["parallel"] = DEFAULT_STREAMS
+        if installed and installed["path"]:
+            base = installed
         else:
-            print(f"[Error] 下載失敗: {resp.get('msg')}")
-        
+            base = cached and {"path": self._cache_path(cached["sha256"]), "sha256": cached["sha256"]}
+        if allow_delta and base and not partial:
+            if base is installed:
+                resp = self.call("my_downloads")
+                version = next((d["version"] for d in resp.get("downloads", []) if d["gamename"] == gamename), None)
+            else:
+                version = cached.get("version")
+            extra.update(have_version=version, have_sha256=base["sha256"])
+        resp = self.call("download_game_file", timeout=DOWNLOAD_TIMEOUT, gamename=gamename, **extra)
+
+        if resp.get("status") == "OK" and resp.get("msg") == "NOT_MODIFIED":
+            sha256 = resp["sha256"]
+            if installed and installed["sha256"] == sha256:
+                print(f"[Success] {gamename} 已是最新版本 ({resp.get('version')})")
+                return True
+            target_path = self._install(gamename, sha256, resp.get("filename") or "main.py",
+                                        resp.get("package"), resp.get("entry"))
+            print(f"[Success] 從本機快取安裝: {target_path}")
+            self.call("download_game", gamename=gamename)
+            return True
+
+        if resp.get("status") == "OK" and resp.get("msg") == "TRANSFER_READY":
+            host = self.core.peer_host
+            temp_path = self._partial_path(gamename, resp["sha256"])
+            if resp.get("chunks"):
+                # 分塊檔以 .chunks 結尾：中斷後重新要 ticket 時，雜湊正確的 chunk 會被略過
+                temp_path = temp_path[:-len(".part")] + ".chunks"
+                print(f"[Download] 以 {DEFAULT_STREAMS} 條連線平行下載 {resp['size']} bytes...")
+                done = fetch_parallel(host, resp, temp_path, DEFAULT_STREAMS)
+            else:
+                if resp.get("encoding") == "delta":
+                    temp_path = temp_path[:-len(".part")] + ".delta"
+                elif resp.get("content_encoding"):
+                    print(f"[Download] 壓縮傳輸 ({resp['content_encoding']}): "
+                          f"{resp.get('transfer_size')} / {resp['size']} bytes")
+                done = fetch_file(host, resp, temp_path, resp.get("offset") or 0)
+            if not done:
+                print("[Download] 傳輸通道下載失敗，改由控制連線重試...")
+                return self._fetch_game(gamename, allow_delta, use_transfer=False)
+            resp["download_path"] = temp_path
+
+        if resp.get("status") != "OK" or "download_path" not in resp:
+            print(f"[Error] 下載失敗: {resp.get('msg')} (已收到的部分會保留，下次可續傳)")
+            return False
+
+        temp_path = resp["download_path"]
+        if resp.get("encoding") == "delta":
+            temp_path = self._apply_delta(gamename, resp, base)
+            if temp_path is None:
+                return self._fetch_game(gamename, allow_delta=False, use_transfer=use_transfer)
+        # 換版本了：舊的部分檔沒用了
+        self._clear_partials(gamename, keep=temp_path)
+
+        # 驗證雜湊，不符就丟掉重來
+        if file_sha256(temp_path) != resp.get("sha256"):
+            with contextlib.suppress(OSError):
+                os.remove(temp_path)
+            if resp.get("encoding") == "delta":
+                return self._fetch_game(gamename, allow_delta=False, use_transfer=use_transfer)
+            print("[Error] 下載檔案校驗失敗，請重新下載")
+            return False
+
+        # 收進共用快取，再連結到 downloads/{Player}/{Game}/
+        try:
+            self._cache_put(temp_path, resp["sha256"])
+            self._write_ref(gamename, resp)
+            target_path = self._install(gamename, resp["sha256"], resp.get("filename") or "main.py",
+                                        resp.get("package"), resp.get("entry"))
+        except Exception as e:
+            print(f"[Error] 檔案搬移失敗: {e}")
+            return False
+        print(f"[Success] 遊戲已下載至: {target_path}")
+        self._ensure_bytecode(gamename)
+
+        # 更新 DB 紀錄 (因為 lobby.py 修改版可能在傳完檔後沒寫入 downloads 表)
+        # 這裡補發一個純紀錄用的 request 比較保險，或是依賴 server 邏輯
+        self.call("download_game", gamename=gamename)
+        return True
+
+    def perform_download(self, gamename):
+        """ [P2] 執行下載流程 (整合檔案傳輸，支援本機快取、續傳、差異更新與雜湊驗證) """
+        print(f"正在請求下載 {gamename}...")
+        self._fetch_game(gamename)
         input("按 Enter 繼續...")
 
     def ui_my_downloads(self):
@@ -396,11 +753,13 @@ class LobbyClient:
         input("按 Enter 繼續...")
 
     def ui_ratings(self, gamename):
-        resp = self.call("list_ratings", gamename=gamename)
-        ratings = resp.get("ratings", [])
         print(f"\n=== {gamename} 的評價 ===")
-        for r in ratings:
-            print(f"[{r['score']}分] {r['username']}: {r['comment']}")
+        try:
+            # 評價可能很多，邊收邊印
+            for r in self.call_iter("list_ratings", gamename=gamename):
+                print(f"[{r['score']}分] {r['username']}: {r['comment']}")
+        except RuntimeError as e:
+            print(f"[Error] 無法取得評價: {e}")
         
         # [P4] 撰寫評價
         do_rate = input("\n要撰寫評價嗎? (y/n): ").lower()
@@ -499,8 +858,15 @@ class LobbyClient:
         print("等待其他玩家中...")
         print("如果是房主，當人數足夠時可輸入 'start' 開始遊戲")
         print("輸入 'leave' 離開房間")
-        
-        while self.current_room_id:
+
+        try:
+            self._room_loop()
+        finally:
+            self._discard_warm()
+
+    def _room_loop(self):
+        while self.current_room_id and self.running:
+            self._prewarm()
             # 若收到 game_started，這裡負責啟動遊戲，避免 listener 搶 stdin
             if self.pending_game_info:
                 game_info = self.pending_game_info
@@ -508,6 +874,7 @@ class LobbyClient:
                 self._launch_game_client(game_info, block_on_fallback=True)
                 self.clear_screen()
                 print(f"=== 房間: {self.current_room_id} (遊戲結束) ===")
+                self._report_launch_time()
                 print("輸入 'start' 再次開始，或 'leave' 離開")
                 continue
 
@@ -518,13 +885,16 @@ class LobbyClient:
                 # 遊戲結束後，重繪介面
                 self.clear_screen()
                 print(f"=== 房間: {self.current_room_id} (遊戲結束) ===")
+                self._report_launch_time()
                 print("輸入 'start' 再次開始，或 'leave' 離開")
                 continue # 跳過這一次 input，重新開始迴圈
 
-            # 正常等待輸入 (非阻塞輪詢，避免卡住錯過 game_started)
+            # 等待輸入或事件 (game_started / 斷線時連線核心會喚醒 select，不必輪詢)
             if sys.platform.startswith("linux"):
-                ready, _, _ = select.select([sys.stdin], [], [], 0.2)
-                if not ready:
+                ready, _, _ = select.select([sys.stdin, self._wake_r], [], [])
+                if self._wake_r in ready:
+                    self._wake_r.recv(64)
+                if sys.stdin not in ready:
                     continue
                 cmd = sys.stdin.readline().strip().lower()
             else:
@@ -537,6 +907,7 @@ class LobbyClient:
                 self.game_process = None
                 self.clear_screen()
                 print(f"=== 房間: {self.current_room_id} (遊戲結束) ===")
+                self._report_launch_time()
                 continue
 
             # ... (原本的指令處理) ...
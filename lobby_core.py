@@ -0,0 +1,216 @@
+"""
+Player client 的 asyncio 連線核心。
+
+- 一個 reader task 收這條連線上的所有 frame：回應依 req_id 交給等待中的 future，
+  server 主動推播的事件 (event) 交給註冊的 callback
+- call() 可同時有任意多個在途請求 (同一條連線 pipelining)；串流回應在這裡組回單一 dict
+- call_iter() 邊收邊 yield；每個串流一個有上限的 Queue，消費端跟不上時 reader 暫停讀 socket (TCP 回壓)
+- server 沒開傳輸通道時在控制連線上直接送檔 (READY_TO_SEND)，reader 收完檔案再把回應交出去
+
+lobby_client 的選單 UI 在背景執行緒跑一個 event loop，透過 run_coroutine_threadsafe 使用這個核心；
+壓力測試則在同一個 event loop 裡開數百個 LobbyCore 模擬玩家 (bench/bench_players.py)，
+不需要每個玩家一條執行緒。
+"""
+import asyncio
+import contextlib
+import struct
+from typing import Callable, Dict, List, Optional
+
+from utils import (MAX_FILE_SIZE, FILE_CHUNK, FileReceiver, encode_frame, gen_req_id, hello_needed,
+                   hello_request, hello_settings, read_frame)
+
+STREAM_WINDOW = 32  # call_iter 最多暫存的 frame 數
+
+class LobbyCore:
+    def __init__(self):
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.peer_host = None
+        self.pending = {}   # req_id -> Future (call) / asyncio.Queue (call_iter)
+        self.partial = {}   # req_id -> call 已收到、尚未結束的串流 frame
+        self.handlers: Dict[str, List[Callable]] = {}  # event -> callbacks ("*" 收所有事件)
+        # READY_TO_SEND 時決定存檔路徑：file_sink(msg) -> path；未設定時內容丟棄
+        self.file_sink: Optional[Callable[[dict], str]] = None
+        self.on_close: Optional[Callable[[], None]] = None
+        self.codec, self.compress_min = "json", 0
+        self.task = None
+
+    async def connect(self, host, port):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.peer_host = self.writer.get_extra_info("peername")[0]
+        self.task = asyncio.ensure_future(self._read_loop())
+        # 編碼/壓縮協商 (選用)：server 不支援時維持 JSON
+        if hello_needed():
+            hello = hello_request()
+            resp = await self.call(hello.pop("action"), **hello)
+            if resp.get("status") == "OK":
+                self.codec, self.compress_min = hello_settings(resp)
+
+    @property
+    def connected(self) -> bool:
+        return self.writer is not None and not self.writer.is_closing()
+
+    def on(self, event: str, callback: Callable):
+        """註冊事件 callback (可為一般函式或 coroutine function)，在 event loop 中被呼叫"""
+        self.handlers.setdefault(event, []).append(callback)
+
+    async def send(self, payload: dict) -> bool:
+        if not self.connected:
+            return False
+        frame = encode_frame(payload, self.codec, self.compress_min)
+        if frame is None:
+            return False
+        self.writer.writelines(frame)
+        try:
+            await self.writer.drain()
+        except ConnectionError:
+            return False
+        return True
+
+    async def call(self, action, timeout: float = 10, **kwargs) -> dict:
+        """送出請求並等待回應；逾時或斷線時回傳 ERROR (不丟例外)，和同步版 call 相同"""
+        req_id = gen_req_id()
+        fut = asyncio.get_running_loop().create_future()
+        self.pending[req_id] = fut
+        try:
+            if not await self.send({"action": action, "req_id": req_id, **kwargs}):
+                return {"status": "ERROR", "msg": "Not connected"}
+            return await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            return {"status": "ERROR", "msg": "Request timed out"}
+        finally:
+            self.pending.pop(req_id, None)
+            self.partial.pop(req_id, None)
+
+    async def call_iter(self, action, timeout: float = 10, **kwargs):
+        """串流請求：邊收邊 yield 每一筆資料；失敗時丟出 RuntimeError"""
+        req_id = gen_req_id()
+        q = asyncio.Queue(maxsize=STREAM_WINDOW)
+        self.pending[req_id] = q
+        try:
+            if not await self.send({"action": action, "req_id": req_id, "stream": True, **kwargs}):
+                raise RuntimeError("Not connected")
+            while True:
+                try:
+                    msg = await asyncio.wait_for(q.get(), timeout)
+                except asyncio.TimeoutError:
+                    raise RuntimeError("Request timed out")
+                if msg.get("status") != "OK":
+                    raise RuntimeError(msg.get("msg") or "request failed")
+                # 舊版 server 不支援串流時，會直接回完整列表
+                key = msg.get("key") or next((k for k, v in msg.items() if isinstance(v, list)), None)
+                for row in msg.get(key, []) if key else []:
+                    yield row
+                if msg.get("stream", "end") == "end":
+                    return
+        finally:
+            self.pending.pop(req_id, None)
+            # 提早結束時清空 Queue，讓卡在 put 的 reader 繼續
+            while not q.empty():
+                q.get_nowait()
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            with contextlib.suppress(Exception):
+                await self.writer.wait_closed()
+        if self.task is not None:
+            with contextlib.suppress(Exception):
+                await self.task
+
+    # ---- reader task ----
+
+    async def _read_loop(self):
+        try:
+            while True:
+                msg = await read_frame(self.reader)
+                if msg is None:
+                    break
+                if msg.get("status") == "OK" and msg.get("msg") == "READY_TO_SEND":
+                    await self._recv_inline_file(msg)
+                waiter = self.pending.get(msg.get("req_id"))
+                if waiter is not None:
+                    await self._deliver(msg, waiter)
+                elif msg.get("event"):
+                    self._dispatch(msg)
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            pass
+        finally:
+            if self.writer is not None:
+                self.writer.close()
+            lost = {"status": "ERROR", "msg": "Disconnected", "stream": "end"}
+            for waiter in list(self.pending.values()):
+                if isinstance(waiter, asyncio.Queue):
+                    with contextlib.suppress(asyncio.QueueFull):
+                        waiter.put_nowait(lost)
+                elif not waiter.done():
+                    waiter.set_result(lost)
+            if self.on_close:
+                self.on_close()
+
+    async def _deliver(self, msg: dict, waiter):
+        if isinstance(waiter, asyncio.Queue):
+            await waiter.put(msg)
+            return
+        if waiter.done():
+            return
+        req_id = msg.get("req_id")
+        state = msg.get("stream")
+        if state and state != "end":
+            self.partial.setdefault(req_id, []).append(msg)
+            return
+        # [Streaming] continuation frame 收齊後組回單一 dict
+        frames = self.partial.pop(req_id, [])
+        if state and msg.get("status") == "OK":
+            key = (frames[0] if frames else msg).get("key")
+            rows = [row for frame in frames + [msg] for row in frame.get(key, [])]
+            msg = dict(msg)
+            msg[key] = rows
+        waiter.set_result(msg)
+
+    def _dispatch(self, msg: dict):
+        for callback in self.handlers.get(msg["event"], []) + self.handlers.get("*", []):
+            try:
+                result = callback(msg)
+                if asyncio.iscoroutine(result):
+                    asyncio.ensure_future(result)
+            except Exception:
+                pass  # 單一 callback 出錯不影響 reader
+
+    async def _recv_inline_file(self, msg: dict):
+        path = self.file_sink(msg) if self.file_sink else None
+        if await self.recv_file(path, msg.get("offset") or 0, msg.get("content_encoding")):
+            msg["download_path"] = path
+        else:
+            msg["status"] = "ERROR"
+            msg["msg"] = "File transfer failed"
+
+    async def recv_file(self, dest_path: Optional[str], offset: int = 0, encoding: Optional[str] = None) -> bool:
+        """utils.recv_file 的 asyncio 版：接收一段 send_file 格式的內容寫到 dest_path"""
+        (size,) = struct.unpack("!Q", await self.reader.readexactly(8))
+        if offset + size > MAX_FILE_SIZE:
+            raise ConnectionError("file too large")  # 無法保持 frame 對齊，只能斷線
+        remaining = size
+        try:
+            if dest_path is None:
+                raise ValueError("no destination")
+            with FileReceiver(dest_path, size, offset, encoding) as rx:
+                while remaining:
+                    chunk = await self.reader.read(min(FILE_CHUNK, remaining))
+                    if not chunk:
+                        raise ConnectionError("Connection lost during file transfer")
+                    remaining -= len(chunk)
+                    rx.feed(chunk)
+                rx.finish()
+            return True
+        except (ValueError, OSError) as e:
+            if isinstance(e, ConnectionError):
+                raise
+            print(f"[RecvFile] Error: {e}")
+            # 剩下的內容收掉，保持連線上的 frame 對齊
+            while remaining:
+                chunk = await self.reader.read(min(FILE_CHUNK, remaining))
+                if not chunk:
+                    raise ConnectionError("Connection lost during file transfer")
+                remaining -= len(chunk)
+            return False
@@ -0,0 +1,210 @@
+"""
+多檔案遊戲包 (.tar / .tar.gz / .tgz / .zip)。
+
+- 上傳端 (dev_lobby)：tar 直接從連線邊收邊解，不把整包放進記憶體或先存成檔案；
+  zip 的目錄在檔尾，必須先落地成暫存檔才能讀。包內每個檔案各自收進內容定址 store
+- 每個版本另存一份「正規化」的 tar (路徑排序、時間 / 擁有者歸零) 當作下載用的 blob：
+  下載、續傳、平行分塊、壓縮變體、delta 都沿用單一檔案的流程，只是內容是一整包
+- 玩家端 (lobby_client)：下載整包 tar，驗證雜湊後解到遊戲目錄
+
+manifest 多一個 "package" 欄位：{"format": "tar", "sha256", "size"}。
+"""
+import io
+import os
+import stat
+import struct
+import hashlib
+import tarfile
+import zipfile
+import contextlib
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+from utils import MAX_FILE_SIZE, recv_exact, recv_into_exact
+
+ARCHIVE_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".zip")
+PACKAGE_MAX_FILES = int(os.getenv("PACKAGE_MAX_FILES", "1000"))
+COPY_CHUNK = 1 << 20
+
+class PackageError(ValueError):
+    pass
+
+def is_archive(filename) -> bool:
+    return isinstance(filename, str) and filename.lower().endswith(ARCHIVE_SUFFIXES)
+
+def safe_member_path(name: str) -> Optional[str]:
+    """包內路徑正規化成 a/b/c；絕對路徑、..、磁碟代號等會逃出遊戲目錄的路徑回傳 None"""
+    name = name.replace("\\", "/")
+    if name.startswith("/"):
+        return None
+    parts = [p for p in name.split("/") if p not in ("", ".")]
+    if not parts or ".." in parts or ":" in parts[0]:
+        return None
+    return "/".join(parts)
+
+class SocketReader(io.RawIOBase):
+    """
+    連線上一段 send_file 格式的內容 (8 bytes 長度 + 內容) 包成唯讀檔案物件，給 tarfile 串流讀取。
+    hasher 會以讀到的原始 bytes 更新 (比對 client 算好的整包雜湊)
+    """
+    def __init__(self, sock, size: int, hasher=None):
+        self.sock = sock
+        self.remaining = size
+        self.hasher = hasher
+
+    @classmethod
+    def from_frame(cls, sock, hasher=None) -> Optional["SocketReader"]:
+        header = recv_exact(sock, 8)
+        if not header:
+            return None
+        (size,) = struct.unpack("!Q", header)
+        if size > MAX_FILE_SIZE:
+            raise PackageError("package too large")
+        return cls(sock, size, hasher)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b) -> int:
+        n = min(len(b), self.remaining)
+        if n == 0:
+            return 0
+        view = memoryview(b)[:n]
+        if not recv_into_exact(self.sock, view):
+            raise ConnectionError("Connection lost during package transfer")
+        self.remaining -= n
+        if self.hasher is not None:
+            self.hasher.update(view)
+        return n
+
+    def drain(self):
+        """tar 結尾的補零 (或解到一半出錯時剩下的內容) 收掉，保持連線上的 frame 對齊"""
+        buf = bytearray(COPY_CHUNK)
+        while self.remaining:
+            self.readinto(buf)
+
+def ingest_package(store, fileobj: BinaryIO, filename: str, entry: str = "main.py") -> Tuple[dict, bool]:
+    """
+    解開 fileobj (tar 可為不可 seek 的串流；zip 需可 seek) 並收進 store，回傳 (manifest, deduplicated)。
+    只接受一般檔案與目錄；包內只有一個頂層目錄且進入點不在根目錄時，自動去掉該層。
+    """
+    if filename.lower().endswith(".zip"):
+        files = _ingest_zip(store, fileobj)
+    else:
+        files = _ingest_tar(store, fileobj)
+    entry = safe_member_path(entry or "main.py")
+    if entry is None or not entry.endswith(".py"):
+        raise PackageError("invalid entry")
+    paths = {f["path"] for f in files}
+    if entry not in paths:
+        tops = {p.split("/", 1)[0] for p in paths}
+        if len(tops) == 1 and all("/" in p for p in paths) and f"{next(iter(tops))}/{entry}" in paths:
+            for f in files:
+                f["path"] = f["path"].split("/", 1)[1]
+        else:
+            raise PackageError(f"entry {entry} not found in package")
+    files.sort(key=lambda f: f["path"])
+
+    tmp = store.temp_path()
+    try:
+        build_tar(store, files, entry, tmp)
+        if os.path.getsize(tmp) > MAX_FILE_SIZE:
+            raise PackageError("package too large")
+        sha256, size, dedup = store.ingest(tmp)
+    finally:
+        with contextlib.suppress(OSError):
+            os.remove(tmp)
+    manifest = {"entry": entry, "files": files, "package": {"format": "tar", "sha256": sha256, "size": size}}
+    return manifest, dedup
+
+def _ingest_tar(store, fileobj) -> List[dict]:
+    files: Dict[str, dict] = {}
+    total = 0
+    # r|* ：串流模式 (不 seek)，自動判斷 gzip 等壓縮
+    with tarfile.open(fileobj=fileobj, mode="r|*") as tf:
+        for member in tf:
+            if member.isdir():
+                continue
+            if not member.isreg():
+                raise PackageError(f"unsupported member: {member.name}")
+            total += member.size
+            _check_member(files, member.name, total)
+            path = safe_member_path(member.name)
+            files[path] = _ingest_member(store, tf.extractfile(member), path, member.size)
+    return list(files.values())
+
+def _ingest_zip(store, fileobj) -> List[dict]:
+    files: Dict[str, dict] = {}
+    with zipfile.ZipFile(fileobj) as zf:
+        infos = [i for i in zf.infolist() if not i.is_dir()]
+        # 先以宣告的大小檢查總量，避免 zip bomb 解到一半才發現
+        if sum(i.file_size for i in infos) > MAX_FILE_SIZE:
+            raise PackageError("package too large")
+        total = 0
+        for info in infos:
+            if stat.S_ISLNK(info.external_attr >> 16):
+                raise PackageError(f"unsupported member: {info.filename}")
+            total += info.file_size
+            _check_member(files, info.filename, total)
+            path = safe_member_path(info.filename)
+            with zf.open(info) as src:
+                files[path] = _ingest_member(store, src, path, info.file_size)
+    return list(files.values())
+
+def _check_member(files: dict, name: str, total: int):
+    path = safe_member_path(name)
+    if path is None:
+        raise PackageError(f"unsafe path: {name}")
+    if path in files:
+        raise PackageError(f"duplicate path: {path}")
+    if len(files) >= PACKAGE_MAX_FILES:
+        raise PackageError("too many files")
+    if total > MAX_FILE_SIZE:
+        raise PackageError("package too large")
+
+def _ingest_member(store, src, path: str, size: int) -> dict:
+    h = hashlib.sha256()
+    tmp = store.temp_path()
+    got = 0
+    try:
+        with open(tmp, "wb") as out:
+            for chunk in iter(lambda: src.read(COPY_CHUNK), b""):
+                got += len(chunk)
+                if got > size:
+                    raise PackageError(f"size mismatch: {path}")
+                h.update(chunk)
+                out.write(chunk)
+        if got != size:
+            raise PackageError(f"size mismatch: {path}")
+        sha256, size, _ = store.ingest(tmp, h.hexdigest())
+    finally:
+        with contextlib.suppress(OSError):
+            os.remove(tmp)
+    return {"path": path, "sha256": sha256, "size": size}
+
+def build_tar(store, files: List[dict], entry: str, out_path: str):
+    """由 store 中的檔案組出正規化的 tar：同樣的內容永遠得到同樣的 bytes (同一個 sha256)"""
+    with tarfile.open(out_path, "w", format=tarfile.PAX_FORMAT) as tf:
+        for f in files:
+            info = tarfile.TarInfo(f["path"])
+            info.size = f["size"]
+            info.mtime = 0
+            info.mode = 0o755 if f["path"] == entry else 0o644
+            with open(store.path(f["sha256"]), "rb") as src:
+                tf.addfile(info, src)
+
+def extract_package(tar_path: str, dest_dir: str):
+    """(玩家端) 把下載的 tar 解到 dest_dir；只解一般檔案，路徑不安全就整包拒絕"""
+    with tarfile.open(tar_path, "r:") as tf:
+        for member in tf:
+            if member.isdir():
+                continue
+            path = safe_member_path(member.name)
+            if path is None or not member.isreg():
+                raise PackageError(f"unsafe member: {member.name}")
+            out = os.path.join(dest_dir, *path.split("/"))
+            os.makedirs(os.path.dirname(out), exist_ok=True)
+            with tf.extractfile(member) as src, open(out, "wb") as dst:
+                for chunk in iter(lambda: src.read(COPY_CHUNK), b""):
+                    dst.write(chunk)
+            if member.mode & stat.S_IXUSR:
+                os.chmod(out, os.stat(out).st_mode | stat.S_IEXEC)
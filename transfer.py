@@ -0,0 +1,485 @@
+"""
+遊戲檔下載的專用傳輸通道 (side channel)：
+
+1. client 在 lobby 控制連線上要求下載，lobby 發一張短期 ticket，回覆 TRANSFER_READY
+   (ticket、port；大檔另附 chunk 大小與每個 chunk 的 sha256)
+2. client 對 TRANSFER_PORT 開連線，以 ticket 取檔：
+   - 整檔 (可從 offset 續傳)：
+       -> {"action": "get_file", "ticket", "offset"}
+       <- ok("FILE", size, offset) + send_file 的 8 bytes 長度 + 內容
+   - 大檔開 N 條連線平行分塊，每條連線依序要 chunk：
+       -> {"action": "get_chunk", "ticket", "index"}
+       <- ok("CHUNK", index, offset, length, sha256) + send_file 的 8 bytes 長度 + 內容
+3. 分塊下載時 client 先把目標檔預先配置好大小，各 chunk 驗證雜湊後以 positional write 寫到對應位置
+
+檔案傳輸不會占住控制連線 (推播與其他請求的回應照常)，多個下載也可同時進行；
+高延遲連線上多條 TCP 串流還能疊加吞吐量。
+"""
+import os
+import socket
+import threading
+import hashlib
+import secrets
+import time
+import queue
+import struct
+import contextlib
+import collections
+from typing import Dict, List, Optional
+
+from utils import ok, err, send_json, recv_json, send_file, recv_file, recv_exact, recv_into_exact
+
+TRANSFER_PORT = int(os.getenv("TRANSFER_PORT", "18906"))
+CHUNK_SIZE = int(os.getenv("TRANSFER_CHUNK", str(1 << 20)))
+MAX_CHUNKS = 512                 # chunk 清單要放得進一個 frame
+PARALLEL_MIN_SIZE = int(os.getenv("PARALLEL_MIN_SIZE", str(4 << 20)))  # 小檔單一連線即可
+DEFAULT_STREAMS = int(os.getenv("TRANSFER_STREAMS", "4"))
+TICKET_TTL = 60                  # 秒；閒置超過這麼久才失效 (每次使用都會延長)，過期再向 lobby 要
+CHUNK_RETRIES = 3
+RETRY_BACKOFF = 0.2              # 秒；連不上 transfer port 時每次重試的等待 (逐次加倍)
+PIPELINE = 2                     # 每條連線同時在途的 chunk 請求數
+_HDR_Q = struct.Struct("!Q")  # send_file 的長度 header
+
+# 排程：同時傳輸的請求數上限、每位使用者上限與總頻寬 (bytes/s，0 表示不限)
+MAX_ACTIVE = int(os.getenv("TRANSFER_MAX_ACTIVE", "8"))
+MAX_PER_USER = int(os.getenv("TRANSFER_PER_USER", str(DEFAULT_STREAMS)))
+BANDWIDTH = float(os.getenv("TRANSFER_BANDWIDTH", "0"))
+QUEUE_NOTIFY_INTERVAL = 10.0     # 排隊位置沒變時也定期通知，避免 client 逾時
+THROUGHPUT_WINDOW = 10.0         # stats 中吞吐量的計算區間 (秒)
+
+def chunk_size_for(size: int) -> int:
+    chunk = CHUNK_SIZE
+    while (size + chunk - 1) // chunk > MAX_CHUNKS:
+        chunk *= 2
+    return chunk
+
+_CHUNK_HASHES: "collections.OrderedDict[tuple, List[str]]" = collections.OrderedDict()  # (檔案 sha256, chunk 大小) -> 各 chunk 雜湊
+_CHUNK_LOCK = threading.Lock()
+
+def chunk_hashes(path: str, sha256: str, chunk: int) -> List[str]:
+    """每個 chunk 的 sha256。以檔案雜湊為 key 快取 (store 中的 blob 內容不會變)"""
+    key = (sha256, chunk)
+    with _CHUNK_LOCK:
+        if key in _CHUNK_HASHES:
+            _CHUNK_HASHES.move_to_end(key)
+            return _CHUNK_HASHES[key]
+    hashes = []
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            hashes.append(hashlib.sha256(block).hexdigest())
+    with _CHUNK_LOCK:
+        _CHUNK_HASHES[key] = hashes
+        while len(_CHUNK_HASHES) > 64:
+            _CHUNK_HASHES.popitem(last=False)
+    return hashes
+
+class TokenBucket:
+    """
+    總頻寬預算：每次要送 n bytes 前先扣 token，不足時 sleep 到補滿為止。
+    允許欠額 (先扣後等)，多個傳輸同時要 token 時會依序排開，總速率維持在 rate。
+    """
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst or max(rate / 4, 256 * 1024)
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, n: int):
+        if self.rate <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate) - n
+            self.stamp = now
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+class TransferScheduler:
+    """
+    傳輸排程 (每個 get_file / get_chunk 請求佔一個名額，傳完即釋放)：
+    1. 全域同時傳輸數上限 max_active，避免熱門遊戲上架時磁碟與網卡被下載塞滿
+    2. 公平：有空位時，進行中傳輸最少的使用者優先，其次依到達順序；每位使用者最多 per_user 個
+    3. 總頻寬以 token bucket 限制
+    4. 等待中的請求可透過 notify(position) 取得排隊位置
+    """
+    def __init__(self, max_active: int = MAX_ACTIVE, per_user: int = MAX_PER_USER, bandwidth: float = BANDWIDTH):
+        self.max_active = max(1, max_active)
+        self.per_user = max(1, per_user)
+        self.bucket = TokenBucket(bandwidth)
+        self.cond = threading.Condition()
+        self.active: Dict[str, int] = {}
+        self.n_active = 0
+        self.waiting: List[list] = []  # [序號, user]，依到達順序
+        self.seq = 0
+        self.granted = 0
+        self.wait_seconds = 0.0
+        self.bytes = 0
+        self.recent = collections.deque()  # (時間, bytes)，計算最近 THROUGHPUT_WINDOW 秒的吞吐量
+
+    def _next(self):
+        if self.n_active >= self.max_active:
+            return None
+        best, best_n = None, self.per_user
+        for w in self.waiting:
+            n = self.active.get(w[1], 0)
+            if n < best_n:
+                best, best_n = w, n
+        return best
+
+    def acquire(self, user: str, notify=None) -> bool:
+        """等到輪到自己；notify(position) 回傳 False (client 已斷線) 時放棄並回傳 False"""
+        t0 = time.monotonic()
+        with self.cond:
+            self.seq += 1
+            w = [self.seq, user]
+            self.waiting.append(w)
+        last, last_sent = None, 0.0
+        try:
+            while True:
+                with self.cond:
+                    if self._next() is w:
+                        self.waiting.remove(w)
+                        self.active[user] = self.active.get(user, 0) + 1
+                        self.n_active += 1
+                        self.granted += 1
+                        self.wait_seconds += time.monotonic() - t0
+                        return True
+                    pos = self.waiting.index(w) + 1
+                    if notify is None or (pos == last and time.monotonic() - last_sent < QUEUE_NOTIFY_INTERVAL):
+                        self.cond.wait(1.0)
+                        continue
+                # 在鎖外通知 (送資料可能阻塞)
+                last, last_sent = pos, time.monotonic()
+                if not notify(pos):
+                    return False
+        finally:
+            with self.cond:
+                if w in self.waiting:
+                    self.waiting.remove(w)
+                    self.cond.notify_all()
+
+    def release(self, user: str):
+        with self.cond:
+            self.active[user] -= 1
+            if not self.active[user]:
+                del self.active[user]
+            self.n_active -= 1
+            self.cond.notify_all()
+
+    @contextlib.contextmanager
+    def slot(self, user: str, notify=None):
+        """with scheduler.slot(user) as granted: ...；granted 為 False 時不可傳輸"""
+        granted = self.acquire(user, notify)
+        try:
+            yield granted
+        finally:
+            if granted:
+                self.release(user)
+
+    def throttle(self, n: int):
+        """send_file 每送一段前呼叫：扣頻寬 token 並記錄吞吐量"""
+        self.bucket.consume(n)
+        now = time.monotonic()
+        with self.cond:
+            self.bytes += n
+            self.recent.append((now, n))
+            while self.recent and self.recent[0][0] < now - THROUGHPUT_WINDOW:
+                self.recent.popleft()
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self.cond:
+            recent = sum(n for t, n in self.recent if t >= now - THROUGHPUT_WINDOW)
+            return {
+                "max_active": self.max_active,
+                "per_user": self.per_user,
+                "bandwidth_limit": self.bucket.rate,
+                "active": self.n_active,
+                "queued": len(self.waiting),
+                "active_by_user": dict(self.active),
+                "granted": self.granted,
+                "avg_wait_ms": round(self.wait_seconds / self.granted * 1000, 1) if self.granted else 0.0,
+                "bytes": self.bytes,
+                "throughput_bps": round(recent / THROUGHPUT_WINDOW),
+            }
+
+class TicketTable:
+    """
+    ticket -> 可下載的檔案。TTL 只限制「多久沒用」：每次使用都把期限往後延，
+    下載進行中 (排隊、限速、大檔) 不會因為從發出算起超過 TTL 而中斷
+    """
+    def __init__(self, ttl: float = TICKET_TTL):
+        self.ttl = ttl
+        self.tickets: Dict[str, dict] = {}
+        self.lock = threading.Lock()
+
+    def issue(self, user: str, path: str, size: int, sha256: Optional[str] = None, chunk: Optional[int] = None) -> str:
+        """chunk 為 None 的 ticket 只能整檔下載 (get_file)"""
+        ticket = secrets.token_urlsafe(24)
+        now = time.monotonic()
+        with self.lock:
+            # 順便清掉過期的
+            for t in [t for t, e in self.tickets.items() if e["expires"] < now]:
+                del self.tickets[t]
+            self.tickets[ticket] = {"user": user, "path": path, "size": size, "sha256": sha256,
+                                    "chunk": chunk, "expires": now + self.ttl}
+        return ticket
+
+    def get(self, ticket) -> Optional[dict]:
+        """查 ticket 並延長期限；不存在或已過期時回傳 None"""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.tickets.get(ticket)
+            if entry and entry["expires"] < now:
+                del self.tickets[ticket]
+                return None
+            if entry:
+                entry["expires"] = now + self.ttl
+            return entry
+
+    def touch(self, ticket):
+        """下載仍在進行 (排到名額、送完一段) 時延長期限"""
+        with self.lock:
+            entry = self.tickets.get(ticket)
+            if entry:
+                entry["expires"] = time.monotonic() + self.ttl
+
+class TransferServer:
+    """TRANSFER_PORT 上的 chunk server，每條連線一個執行緒，可連續要多個 chunk"""
+    def __init__(self, host: str, port: int = TRANSFER_PORT):
+        self.host = host
+        self.port = port
+        self.tickets = TicketTable()
+        self.scheduler = TransferScheduler()
+        self.running = False
+        self._srv = None
+
+    def start(self):
+        self._srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._srv.bind((self.host, self.port))
+        self._srv.listen(128)
+        self.port = self._srv.getsockname()[1]
+        self.running = True
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        print(f"[Transfer] listening on {self.host}:{self.port}")
+
+    def stop(self):
+        self.running = False
+        with contextlib.suppress(Exception):
+            self._srv.close()
+
+    def _accept_loop(self):
+        while self.running:
+            try:
+                conn, _ = self._srv.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        # 這條連線上已驗證過的 ticket：TTL 只在開始下載時檢查，之後不會在半途變成 invalid
+        accepted: Dict[str, dict] = {}
+        try:
+            while True:
+                msg = recv_json(conn)
+                if not isinstance(msg, dict) or msg.get("action") not in ("get_chunk", "get_file"):
+                    break
+                ticket = msg.get("ticket")
+                entry = self.tickets.get(ticket)
+                if entry:
+                    accepted[ticket] = entry
+                else:
+                    entry = accepted.get(ticket)
+                if not entry:
+                    send_json(conn, err("invalid ticket"))
+                    break
+                if msg["action"] == "get_file":
+                    offset = msg.get("offset") or 0
+                    if not isinstance(offset, int) or not (0 <= offset <= entry["size"]):
+                        send_json(conn, err("bad offset"))
+                        break
+                    head = ok("FILE", size=entry["size"], offset=offset)
+                    length = None
+                else:
+                    index = msg.get("index")
+                    if not entry["chunk"] or not isinstance(index, int) or not (0 <= index * entry["chunk"] < max(entry["size"], 1)):
+                        send_json(conn, err("bad chunk index"))
+                        break
+                    offset = index * entry["chunk"]
+                    length = min(entry["chunk"], entry["size"] - offset)
+                    hashes = chunk_hashes(entry["path"], entry["sha256"], entry["chunk"])
+                    head = ok("CHUNK", index=index, offset=offset, length=length, sha256=hashes[index])
+
+                # 排到名額才開始送；等待期間送 QUEUED 告知排隊位置
+                def notify(pos):
+                    return send_json(conn, ok("QUEUED", position=pos))
+                with self.scheduler.slot(entry["user"], notify) as granted:
+                    # 排隊可能比 TTL 久，其他連線之後還要用同一張 ticket
+                    self.tickets.touch(ticket)
+                    if not granted or not send_json(conn, head):
+                        break
+                    if not send_file(conn, entry["path"], offset, length, throttle=self.scheduler.throttle):
+                        break
+                self.tickets.touch(ticket)
+        finally:
+            with contextlib.suppress(Exception):
+                conn.close()
+
+
+# ---------- client ----------
+def fetch_file(host: str, info: dict, dest_path: str, offset: int = 0, timeout: float = 30.0) -> bool:
+    """
+    依 TRANSFER_READY 回覆 (ticket、port) 以單一連線下載整檔到 dest_path；offset > 0 時續傳。
+    回覆帶 content_encoding 時收到的是壓縮變體，recv_file 邊收邊解壓
+    """
+    try:
+        with socket.create_connection((host, info["port"]), timeout=timeout) as sock:
+            if not send_json(sock, {"action": "get_file", "ticket": info["ticket"], "offset": offset}):
+                return False
+            head = recv_json(sock)
+            while isinstance(head, dict) and head.get("msg") == "QUEUED":
+                print(f"[Transfer] 下載排隊中，目前第 {head.get('position')} 位...")
+                head = recv_json(sock)
+            if not isinstance(head, dict) or head.get("msg") != "FILE":
+                print(f"[Transfer] 下載失敗: {(head or {}).get('msg')}")
+                return False
+            return recv_file(sock, dest_path, offset, info.get("content_encoding"))
+    except OSError as e:
+        print(f"[Transfer] 下載失敗: {e}")
+        return False
+
+def _pwrite(fd: int, data, offset: int, lock: threading.Lock):
+    if hasattr(os, "pwrite"):
+        view = memoryview(data)
+        while view:
+            n = os.pwrite(fd, view, offset)
+            view = view[n:]
+            offset += n
+        return
+    # Windows 沒有 pwrite：退回 seek + write (同一個 fd 需要鎖)
+    with lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        os.write(fd, data)
+
+def _good_chunks(path: str, info: dict) -> set:
+    """續傳：既有的預先配置檔中，雜湊正確的 chunk 可以略過"""
+    good = set()
+    if not os.path.exists(path) or os.path.getsize(path) != info["size"]:
+        return good
+    with open(path, "rb") as f:
+        for i, expected in enumerate(info["chunks"]):
+            if hashlib.sha256(f.read(info["chunk_size"])).hexdigest() == expected:
+                good.add(i)
+    return good
+
+def fetch_parallel(host: str, info: dict, dest_path: str, streams: int = DEFAULT_STREAMS,
+                   timeout: float = 30.0) -> bool:
+    """
+    依 TRANSFER_READY 回覆 (ticket、port、size、chunk_size、chunks) 以 streams 條連線平行下載到 dest_path。
+    每個 chunk 驗證雜湊，失敗的 chunk 換連線重試；全部成功回傳 True (整檔雜湊由呼叫端驗證)。
+    """
+    size, chunk = info["size"], info["chunk_size"]
+    hashes = info["chunks"]
+    os.makedirs(os.path.dirname(dest_path) or ".", exist_ok=True)
+    good = _good_chunks(dest_path, info)
+
+    fd = os.open(dest_path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+    try:
+        # 預先配置整個檔案，各 chunk 直接寫到自己的位置
+        os.ftruncate(fd, size)
+        with contextlib.suppress(AttributeError, OSError):
+            os.posix_fallocate(fd, 0, size)
+
+        todo = queue.Queue()
+        for i in range(len(hashes)):
+            if i not in good:
+                todo.put((i, 0))
+        pending = [todo.qsize()]
+        failed = []
+        state_lock = threading.Lock()
+        write_lock = threading.Lock()
+
+        def worker():
+            buf = bytearray(chunk)
+            sock = None
+            inflight = collections.deque()  # 已送出請求、尚未收完的 (index, attempt)
+            conn_failures = 0               # 手上沒有 chunk 時的連線失敗 (例如連不上)，也有重試上限
+            try:
+                while True:
+                    with state_lock:
+                        if failed or pending[0] == 0:
+                            return
+                    try:
+                        if sock is None:
+                            sock = socket.create_connection((host, info["port"]), timeout=timeout)
+                        # 每條連線保持 PIPELINE 個請求在途，收 chunk 時下一個請求已經在路上
+                        while len(inflight) < PIPELINE:
+                            try:
+                                item = todo.get(timeout=0.05) if not inflight else todo.get_nowait()
+                            except queue.Empty:
+                                break
+                            inflight.append(item)
+                            if not send_json(sock, {"action": "get_chunk", "ticket": info["ticket"], "index": item[0]}):
+                                raise ConnectionError("send failed")
+                        if not inflight:
+                            continue
+                        index = inflight[0][0]
+                        head = recv_json(sock)
+                        while isinstance(head, dict) and head.get("msg") == "QUEUED":
+                            head = recv_json(sock)
+                        if not isinstance(head, dict) or head.get("msg") != "CHUNK":
+                            raise ConnectionError((head or {}).get("msg") or "no chunk")
+                        (length,) = _HDR_Q.unpack(recv_exact(sock, 8) or b"\0" * 8)
+                        expected = min(chunk, size - index * chunk)
+                        if length != expected:
+                            raise ConnectionError(f"chunk {index} length {length} != {expected}")
+                        view = memoryview(buf)[:length]
+                        if not recv_into_exact(sock, view):
+                            raise ConnectionError("connection lost")
+                        if hashlib.sha256(view).hexdigest() != hashes[index]:
+                            raise ValueError(f"chunk {index} checksum mismatch")
+                        _pwrite(fd, view, index * chunk, write_lock)
+                        inflight.popleft()
+                        conn_failures = 0
+                        with state_lock:
+                            pending[0] -= 1
+                    except (OSError, ValueError) as e:
+                        # 連線已不同步：關掉重開，出錯的 chunk 計一次失敗，其餘在途的原樣放回
+                        with contextlib.suppress(Exception):
+                            sock.close()
+                        sock = None
+                        if not inflight:
+                            conn_failures += 1
+                            if conn_failures >= CHUNK_RETRIES:
+                                with state_lock:
+                                    failed.append(f"{e}")
+                            else:
+                                time.sleep(RETRY_BACKOFF * 2 ** (conn_failures - 1))
+                            continue
+                        index, attempt = inflight.popleft()
+                        for item in inflight:
+                            todo.put(item)
+                        inflight.clear()
+                        if attempt + 1 >= CHUNK_RETRIES or "invalid ticket" in str(e):
+                            with state_lock:
+                                failed.append(f"{e}")
+                        else:
+                            todo.put((index, attempt + 1))
+            finally:
+                with contextlib.suppress(Exception):
+                    sock.close()
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(max(1, min(streams, pending[0])))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if failed:
+            print(f"[Transfer] 分塊下載失敗: {failed[0]}")
+            return False
+        return True
+    finally:
+        os.close(fd)
@@ -1,12 +1,47 @@
 import json
+import contextlib
 import struct
+import threading
+import weakref
 import time, random, string
-from typing import Any, Optional
+from typing import Any, Callable, Optional
 import os
+import zlib
+import hashlib
+try:
+    import lzma
+except ImportError:  # 部分 Python 建置沒有 _lzma
+    lzma = None
+
+import codec
 
 MAX_LEN = 65536
 MAX_FILE_SIZE = 100 * 1024 * 1024  # 100MB safety cap
 
+# ==== 檔案傳輸編碼 ====
+# 上傳時預先壓好的檔案變體：名稱 -> (副檔名, 壓縮器, 解壓器)。
+# 下載端在 recv_file 邊收邊解壓，server 每個版本只壓縮一次
+FILE_ENCODINGS = {"zlib": (".zz", lambda: zlib.compressobj(9), zlib.decompressobj)}
+if lzma is not None:
+    FILE_ENCODINGS["lzma"] = (".xz", lambda: lzma.LZMACompressor(preset=6), lzma.LZMADecompressor)
+
+# ==== Frame 編碼 ====
+# 未協商的連線維持「4 bytes 長度 + JSON body」。
+# 協商過的連線可送帶旗標的 frame：body 第一個 byte 為 FRAME_TAG | flags，
+# JSON 文字不可能以 >= 0x80 的 byte 開頭，所以接收端不需要知道協商結果就能分辨。
+FRAME_TAG = 0x80
+FLAG_MPACK = 0x01
+FLAG_ZLIB = 0x02
+CODECS = ("mpack", "json")  # 支援的編碼 (偏好順序)
+# 純 Python 的 mpack 解碼比 C 實作的 json 慢，預設只在有 msgpack C 擴充時才提出
+DEFAULT_CODECS = tuple(os.getenv("FRAME_CODEC", "mpack,json" if codec.IMPLEMENTATION == "msgpack" else "json").split(","))
+# 壓縮：只壓超過門檻的 frame (小 frame 壓縮不划算)；壓縮後上限仍為 MAX_LEN，
+# 解壓後的大小上限為 MAX_DECODED_LEN (避免 zip bomb)
+DEFAULT_COMPRESS = tuple(c for c in os.getenv("FRAME_COMPRESS", "zlib").split(",") if c)
+COMPRESS_MIN = int(os.getenv("FRAME_COMPRESS_MIN", "2048"))
+COMPRESS_LEVEL = int(os.getenv("FRAME_COMPRESS_LEVEL", "1"))
+MAX_DECODED_LEN = 16 * 1024 * 1024
+
 def gen_room_id():
     return "r" + "".join(random.choices(string.digits, k=4))
 
@@ -15,55 +50,250 @@ def gen_req_id(prefix: str = "r") -> str:
     salt = "".join(random.choice(string.ascii_lowercase + string.digits) for _ in range(5))
     return f"{prefix}-{ts}-{salt}"
 
-def send_all(sock, data: bytes) -> bool:
-    total = 0
+_HDR = struct.Struct("!I")
+
+class _ConnState:
+    """
+    每條連線各自一份的 framing 狀態 (以 socket 為 key，socket 關閉後自動回收)：
+    - rbuf / rview：預先配置 MAX_LEN 的接收緩衝區，recv_into 直接寫入，不再每個 frame 重新配置
+    - rhdr / whdr：4 bytes 長度 header 的收/送緩衝區
+    - wlock：避免多個執行緒同時對同一 socket 送 frame 造成內容交錯 (可重入)
+    - codec / compress_min：協商後送出 frame 使用的編碼與壓縮門檻 (接收端一律自動辨識)
+    - elock / busy / deferred：exclusive_send 期間 (正在送檔)，其他執行緒的 send_event 先排進 deferred
+    """
+    __slots__ = ("rbuf", "rview", "rhdr", "rhdr_view", "whdr", "wlock", "codec", "compress_min",
+                 "elock", "busy", "deferred")
+
+    def __init__(self):
+        self.codec = "json"     # 送出時使用的編碼，由 hello 協商決定
+        self.compress_min = 0   # > 0 表示已協商壓縮，body 超過此大小才壓縮
+        self.rbuf = bytearray(MAX_LEN)
+        self.rview = memoryview(self.rbuf)
+        self.rhdr = bytearray(_HDR.size)
+        self.rhdr_view = memoryview(self.rhdr)
+        self.whdr = bytearray(_HDR.size)
+        self.wlock = threading.RLock()
+        self.elock = threading.Lock()
+        self.busy = False
+        self.deferred = []
+
+_STATES: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_STATES_LOCK = threading.Lock()
+
+def conn_state(sock) -> _ConnState:
+    st = _STATES.get(sock)
+    if st is None:
+        with _STATES_LOCK:
+            st = _STATES.get(sock)
+            if st is None:
+                st = _ConnState()
+                try:
+                    _STATES[sock] = st
+                except TypeError:
+                    pass  # 不支援 weakref 的物件：每次給一份新的狀態
+    return st
+
+def send_all(sock, data) -> bool:
+    # 以 memoryview 切片推進，partial send 時不複製剩餘資料
+    view = memoryview(data)
     try:
-        while total < len(data):
-            sent = sock.send(data[total:])
+        while len(view):
+            sent = sock.send(view)
             if sent == 0:
                 return False
-            total += sent
+            view = view[sent:]
         return True
     except Exception:
         return False
 
-def send_json(sock, obj: Any) -> bool:
+def send_vectored(sock, bufs) -> bool:
+    """
+    以 sendmsg (scatter-gather) 一次送出多段 buffer (例如 header + body)，
+    不需要先串接成新的 bytes；平台不支援 sendmsg 時退回 send_all。
+    """
     try:
+        total = 0
+        for b in bufs:
+            total += len(b)
+        sent = sock.sendmsg(bufs)
+        if sent == total:
+            return True
+        # partial send：丟掉已送完的 buffer，送到一半的那段用 memoryview 切片
+        views = [memoryview(b) for b in bufs if len(b)]
+        while views:
+            while views and sent >= len(views[0]):
+                sent -= len(views[0])
+                views.pop(0)
+            if sent:
+                views[0] = views[0][sent:]
+            if not views:
+                break
+            sent = sock.sendmsg(views)
+            if sent == 0:
+                return False
+        return True
+    except (AttributeError, NotImplementedError):
+        return send_all(sock, b"".join(bufs))
+    except Exception:
+        return False
+
+def encode_body(obj: Any, codec_name: str = "json", compress_min: int = 0):
+    """
+    回傳 (prefix, payload)；prefix 為帶旗標 frame 的第一個 byte，純 JSON frame 則為空。
+    compress_min > 0 時，payload 超過門檻且壓縮後確實變小才會壓縮。
+    """
+    flags = 0
+    if codec_name == "mpack":
+        flags = FLAG_MPACK
+        body = codec.packb(obj)
+    else:
         body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
-        if not (0 < len(body) <= MAX_LEN):
+    if len(body) > MAX_DECODED_LEN:
+        raise ValueError("frame too large")
+    if compress_min and len(body) >= compress_min:
+        z = zlib.compress(body, COMPRESS_LEVEL)
+        if len(z) < len(body):
+            flags |= FLAG_ZLIB
+            body = z
+    return (_TAGS[flags] if flags else b""), body
+
+def decode_body(view) -> Any:
+    """解析一個 frame body (bytes / memoryview)，自動辨識 JSON 或帶旗標的 frame"""
+    if view[0] >= FRAME_TAG:
+        flags = view[0] & ~FRAME_TAG
+        payload = view[1:]
+        if flags & FLAG_ZLIB:
+            d = zlib.decompressobj()
+            payload = d.decompress(payload, MAX_DECODED_LEN)
+            if d.unconsumed_tail or not d.eof:
+                raise ValueError("compressed frame too large or truncated")
+        if flags & FLAG_MPACK:
+            return codec.unpackb(payload)
+        return json.loads(str(payload, "utf-8"))
+    # 直接從共用緩衝區解碼，不另外複製成 bytes
+    return json.loads(str(view, "utf-8"))
+
+_TAGS = {f: bytes((FRAME_TAG | f,)) for f in range(0x80)}
+
+def send_json(sock, obj: Any) -> bool:
+    try:
+        st = conn_state(sock)
+        prefix, body = encode_body(obj, st.codec, st.compress_min)
+        length = len(prefix) + len(body)
+        if not (0 < length <= MAX_LEN):
             return False
-        header = struct.pack("!I", len(body))
-        return send_all(sock, header + body)
+        with st.wlock:
+            _HDR.pack_into(st.whdr, 0, length)
+            return send_vectored(sock, (st.whdr, prefix, body))
     except Exception:
         return False
 
-def recv_exact(sock, n: int) -> Optional[bytes]:
-    buf = bytearray()
+def recv_into_exact(sock, view) -> bool:
+    """把 len(view) bytes 直接收進呼叫端提供的 buffer (memoryview)"""
+    n = len(view)
+    if n == 0:
+        return True
     try:
-        while len(buf) < n:
-            chunk = sock.recv(n - len(buf))
-            if not chunk:
-                return None
-            buf.extend(chunk)
-        return bytes(buf)
+        # 常見情況一次就收滿，不必建立切片
+        got = sock.recv_into(view)
+        if not got:
+            return False
+        while got < n:
+            r = sock.recv_into(view[got:])
+            if not r:
+                return False
+            got += r
+        return True
     except Exception:
+        return False
+
+def recv_exact(sock, n: int) -> Optional[bytearray]:
+    buf = bytearray(n)
+    if not recv_into_exact(sock, memoryview(buf)):
         return None
+    return buf
 
 def recv_json(sock) -> Optional[Any]:
-    hdr = recv_exact(sock, 4)
-    if not hdr:
+    st = conn_state(sock)
+    if not recv_into_exact(sock, st.rhdr_view):
         return None
-    (length,) = struct.unpack("!I", hdr)    #回傳tuple ex.(128,)
+    (length,) = _HDR.unpack(st.rhdr)    #回傳tuple ex.(128,)
     if length <= 0 or length > MAX_LEN:
         return None
-    body = recv_exact(sock, length)
-    if not body:
+    body = st.rview[:length]
+    if not recv_into_exact(sock, body):
+        return None
+    try:
+        return decode_body(body)
+    except (ValueError, IndexError, struct.error, zlib.error):
+        # JSONDecodeError / UnicodeDecodeError 皆為 ValueError 子類別
+        return None
+
+# ==== asyncio 版 frame 讀寫 (lobby_core 與 DB server 共用) ====
+
+def encode_frame(obj: Any, codec_name: str = "json", compress_min: int = 0) -> Optional[tuple]:
+    """回傳可直接交給 StreamWriter.writelines 的 (header, prefix, body)；超過 frame 上限時回傳 None"""
+    try:
+        prefix, body = encode_body(obj, codec_name, compress_min)
+    except ValueError:
+        return None
+    length = len(prefix) + len(body)
+    if not (0 < length <= MAX_LEN):
+        return None
+    return _HDR.pack(length), prefix, body
+
+async def read_frame(reader) -> Optional[Any]:
+    """從 asyncio.StreamReader 讀一個 frame；內容不合法時回傳 None，斷線時丟出 IncompleteReadError"""
+    (length,) = _HDR.unpack(await reader.readexactly(_HDR.size))
+    if length <= 0 or length > MAX_LEN:
         return None
+    body = await reader.readexactly(length)
     try:
-        return json.loads(body.decode("utf-8"))
-    except json.JSONDecodeError:
+        return decode_body(memoryview(body))
+    except (ValueError, IndexError, struct.error, zlib.error):
         return None
 
+# ==== Hello 協商 ====
+def hello_needed() -> bool:
+    """只用預設 JSON 且不壓縮時，不必多一個 round trip"""
+    return tuple(DEFAULT_CODECS) != ("json",) or bool(DEFAULT_COMPRESS)
+
+def hello_request(codecs=None, compress=None) -> dict:
+    """Client 端：提出可接受的編碼/壓縮。送出後須等回應再呼叫 apply_hello"""
+    return {
+        "action": "hello",
+        "codecs": list(codecs or DEFAULT_CODECS),
+        "compress": list(DEFAULT_COMPRESS if compress is None else compress),
+    }
+
+def negotiate_hello(msg: dict) -> dict:
+    """Server 端：從對方提出的選項中挑出雙方都支援的設定"""
+    offered = msg.get("codecs") or []
+    chosen = next((c for c in CODECS if c in offered), "json")
+    compress = "zlib" if "zlib" in (msg.get("compress") or []) and "zlib" in DEFAULT_COMPRESS else None
+    return {"codec": chosen, "compress": compress}
+
+def apply_hello(sock, opts: dict):
+    """
+    切換這條連線「送出」時使用的設定。
+    Server 端須在回覆 hello 之後才呼叫 (回覆本身仍用舊編碼)；
+    Client 端則在收到回覆後呼叫。接收端一律自動辨識，不受影響。
+    """
+    st = conn_state(sock)
+    st.codec, st.compress_min = hello_settings(opts)
+
+def hello_settings(opts: dict):
+    """協商結果 -> (送出用的編碼, 壓縮門檻)"""
+    name = opts.get("codec", "json")
+    return (name if name in CODECS else "json"), (max(1, COMPRESS_MIN) if opts.get("compress") == "zlib" else 0)
+
+def serve_hello(sock, msg: dict, req_id: Optional[str] = None) -> bool:
+    """Server 端的 hello handler：回覆協商結果並切換設定"""
+    opts = negotiate_hello(msg)
+    sent = send_json(sock, ok("hello", req_id=req_id, **opts))
+    apply_hello(sock, opts)
+    return sent
+
 def with_req_id(payload: dict, req_id: str):
     if req_id:
         payload = dict(payload)
@@ -84,68 +314,329 @@ def err(msg: Optional[str] = None, req_id: Optional[str] = None, **kw):
         d.update(kw)
     return with_req_id(d, req_id)
 
+# ==== 串流回應 ====
+# 大型列表拆成多個 continuation frame，共用同一個 req_id：
+#   {"status":"OK", "stream":"more", "seq":0, "key":"games", "games":[...]} ...
+#   {"status":"OK", "stream":"end",  "seq":n, "key":"games", "games":[...], "count":總筆數}
+# 中途失敗時最後一個 frame 為 {"status":"ERROR", "stream":"end", "msg":...}
+STREAM_CHUNK_BYTES = MAX_LEN // 2
+
+def send_stream(sock, rows, key: str, req_id: Optional[str] = None, **extra) -> bool:
+    """
+    把 rows (任意 iterable，可為 generator) 以串流方式送出。
+    每個 frame 累積到約 STREAM_CHUNK_BYTES 就送出，雙方記憶體用量與總筆數無關。
+    """
+    seq = 0
+    count = 0
+    chunk, size = [], 0
+
+    def flush(state: str, **kw) -> bool:
+        nonlocal seq, chunk, size
+        payload = {"stream": state, "seq": seq, "key": key, key: chunk}
+        payload.update(kw)
+        sent = send_json(sock, ok(req_id=req_id, **payload))
+        seq += 1
+        chunk, size = [], 0
+        return sent
+
+    try:
+        for row in rows:
+            row_size = len(json.dumps(row, ensure_ascii=False).encode("utf-8"))
+            if row_size > STREAM_CHUNK_BYTES:
+                raise ValueError("row too large")
+            if chunk and size + row_size > STREAM_CHUNK_BYTES:
+                if not flush("more"):
+                    return False
+            chunk.append(row)
+            size += row_size + 1
+            count += 1
+    except Exception as e:
+        send_json(sock, err(str(e) or "stream failed", req_id=req_id, stream="end", seq=seq, key=key))
+        return False
+    return flush("end", count=count, **extra)
+
+def send_event(sock, obj: Any) -> bool:
+    """
+    其他執行緒對這條連線的推播：連線正在 exclusive_send (送檔) 時先排隊、送完再補送，
+    呼叫端 (常持有 lobby 的全域鎖) 不會被慢速或限速中的下載卡住
+    """
+    st = conn_state(sock)
+    with st.elock:
+        if st.busy:
+            st.deferred.append(obj)
+            return True
+        return send_json(sock, obj)
+
+@contextlib.contextmanager
+def exclusive_send(sock):
+    """
+    在連線上送「frame + 檔案內容」這類不能被插入的整段資料。
+    不持有 wlock：期間 send_event 改為排隊，結束後依序補送，其他執行緒不必等檔案送完
+    """
+    st = conn_state(sock)
+    with st.elock:
+        st.busy = True
+    try:
+        yield
+    finally:
+        while True:
+            with st.elock:
+                if not st.deferred:
+                    st.busy = False
+                    break
+                batch, st.deferred = st.deferred, []
+            for obj in batch:
+                send_json(sock, obj)
+
 def push_event(conn, event:str, **kw):
     payload = {"event":event}
     if kw:
         payload.update(kw)
-    send_json(conn, payload)
+    send_event(conn, payload)
+
+# ==== 檔案傳輸 ====
+# 優先使用 kernel sendfile (資料不經過 userspace)，平台或 socket 不支援時退回分塊 read + sendall
+USE_SENDFILE = os.getenv("USE_SENDFILE", "1") != "0"
+FILE_CHUNK = 65536
+
+_TRANSFER_STATS = {}  # mode -> {"files", "bytes", "seconds", "failures"}
+_TRANSFER_LOCK = threading.Lock()
+
+def _record_transfer(mode: str, nbytes: int, seconds: float, success: bool):
+    with _TRANSFER_LOCK:
+        st = _TRANSFER_STATS.setdefault(mode, {"files": 0, "bytes": 0, "seconds": 0.0, "failures": 0})
+        if success:
+            st["files"] += 1
+        else:
+            st["failures"] += 1
+        st["bytes"] += nbytes
+        st["seconds"] += seconds
+
+def transfer_stats() -> dict:
+    """各傳輸模式的累計檔案數、位元組、耗時與平均吞吐量 (MB/s)"""
+    with _TRANSFER_LOCK:
+        out = {mode: dict(st) for mode, st in _TRANSFER_STATS.items()}
+    for st in out.values():
+        st["mb_per_s"] = round(st["bytes"] / st["seconds"] / 1e6, 2) if st["seconds"] > 0 else 0.0
+    return out
 
-def send_file(sock, filepath: str) -> bool:
+def _copy_to_sock(sock, f, count: int) -> int:
+    sent = 0
+    while sent < count:
+        chunk = f.read(min(FILE_CHUNK, count - sent))
+        if not chunk:
+            break
+        sock.sendall(chunk)
+        sent += len(chunk)
+    return sent
+
+_HASH_CACHE = {}  # path -> (size, mtime_ns, sha256)
+_HASH_LOCK = threading.Lock()
+
+def file_sha256(filepath: str) -> str:
+    """檔案內容的 SHA-256 (hex)。以 (size, mtime) 快取，同一版本的檔案只需計算一次"""
+    st = os.stat(filepath)
+    key = (st.st_size, st.st_mtime_ns)
+    with _HASH_LOCK:
+        cached = _HASH_CACHE.get(filepath)
+    if cached and cached[:2] == key:
+        return cached[2]
+    h = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _HASH_LOCK:
+        _HASH_CACHE[filepath] = key + (digest,)
+    return digest
+
+THROTTLE_SLICE = 256 * 1024
+
+def send_file(sock, filepath: str, offset: int = 0, count: Optional[int] = None,
+              throttle: Optional[Callable[[int], None]] = None) -> bool:
     """
-    發送檔案：
-    1. 先發送 8 bytes 的檔案大小 (unsigned long long)
-    2. 發送檔案內容
+    發送檔案 (可從 offset 開始，用於續傳；指定 count 時只送這一段，用於分塊下載)：
+    1. 先發送 8 bytes 的「接下來要送的長度」(unsigned long long)
+    2. 發送檔案內容 [offset, offset + count) (sendfile 零複製；不支援時分塊讀取，避免記憶體爆掉)
+    有 throttle 時每送 THROTTLE_SLICE 前先呼叫 throttle(n) (頻寬限制，可阻塞)
     """
     if not os.path.exists(filepath):
         return False
 
     filesize = os.path.getsize(filepath)
-    if filesize < 0 or filesize > MAX_FILE_SIZE:
+    if filesize < 0 or filesize > MAX_FILE_SIZE or not (0 <= offset <= filesize):
+        return False
+    if count is None:
+        count = filesize - offset
+    elif not (0 <= count <= filesize - offset):
         return False
+    mode = "sendfile" if USE_SENDFILE and hasattr(os, "sendfile") and hasattr(sock, "sendfile") else "copy"
+    sent = 0
+    t0 = time.perf_counter()
     try:
-        # 1. 發送檔案大小 (Big-endian, 8 bytes)
-        sock.sendall(struct.pack("!Q", filesize))
+        # 1. 發送長度 (Big-endian, 8 bytes)
+        sock.sendall(struct.pack("!Q", count))
 
-        # 2. 發送檔案內容 (分塊讀取，避免記憶體爆掉)
+        # 2. 發送檔案內容
         with open(filepath, 'rb') as f:
-            while True:
-                chunk = f.read(65536)
-                if not chunk:
+            f.seek(offset)
+            step = THROTTLE_SLICE if throttle else count
+            while sent < count:
+                n = min(step, count - sent)
+                if throttle:
+                    throttle(n)
+                if mode == "sendfile":
+                    # socket.sendfile 內部處理 partial send 與 timeout，失敗時自行退回 send 迴圈
+                    done = sock.sendfile(f, offset + sent, n)
+                else:
+                    done = _copy_to_sock(sock, f, n)
+                sent += done
+                if done != n:
                     break
-                sock.sendall(chunk)
+        if sent != count:
+            raise ConnectionError(f"short send {sent}/{count}")
+        _record_transfer(mode, sent, time.perf_counter() - t0, True)
         return True
     except Exception as e:
+        _record_transfer(mode, sent, time.perf_counter() - t0, False)
         print(f"[SendFile] Error: {e}")
         return False
 
-def recv_file(sock, dest_path: str) -> bool:
+def _discard(sock, n: int):
+    view = conn_state(sock).rview
+    while n > 0:
+        chunk = view[:min(len(view), n)]
+        if not recv_into_exact(sock, chunk):
+            return
+        n -= len(chunk)
+
+def recv_blob(sock, max_size: int) -> Optional[bytearray]:
+    """接收一段 send_file 格式 (8 bytes 長度 + 內容) 的資料到記憶體；超過 max_size 時丟棄內容並回傳 None"""
+    header = recv_exact(sock, 8)
+    if not header:
+        return None
+    (size,) = struct.unpack("!Q", header)
+    if size > max_size:
+        _discard(sock, size)
+        return None
+    return recv_exact(sock, size)
+
+class FileReceiver:
+    """
+    recv_file 的寫檔端 (與連線無關，asyncio 的接收端也共用)：
+    續傳 offset、邊收邊解壓、hasher、解壓後大小上限、fsync。
+    建構時條件不符 (本地部分檔不足 offset / 不支援的編碼 / 超過上限) 丟出 ValueError，
+    呼叫端須把這段內容收掉丟棄，保持連線上的 frame 對齊
+    """
+    def __init__(self, dest_path: str, filesize: int, offset: int = 0, encoding: Optional[str] = None,
+                 hasher=None, sync: bool = False):
+        if filesize < 0 or offset + filesize > MAX_FILE_SIZE:
+            raise ValueError("file too large")
+        if (offset and (not os.path.exists(dest_path) or os.path.getsize(dest_path) < offset)) \
+                or (encoding and (offset or encoding not in FILE_ENCODINGS)):
+            raise ValueError("cannot resume / unsupported encoding")
+        self.decomp = FILE_ENCODINGS[encoding][2]() if encoding else None
+        self.hasher = hasher
+        self.sync = sync
+        self.written = 0
+        os.makedirs(os.path.dirname(dest_path) or ".", exist_ok=True)
+        self.f = open(dest_path, 'r+b' if offset else 'wb')
+        if offset:
+            self.f.truncate(offset)
+            self.f.seek(offset)
+
+    def feed(self, chunk):
+        if self.decomp is None:
+            self._write(chunk)
+            return
+        # 每次最多解出 FILE_CHUNK bytes，邊解邊檢查上限：高壓縮比的一小段 (zip bomb)
+        # 不會先在記憶體裡展開成幾百 MB 才被擋下
+        d = self.decomp
+        data = chunk
+        while not d.eof:
+            out = d.decompress(data, FILE_CHUNK)
+            self.written += len(out)
+            if self.written > MAX_FILE_SIZE:
+                raise ValueError("decompressed file too large")
+            self._write(out)
+            if hasattr(d, "unconsumed_tail"):
+                # zlib：沒解完的輸入留在 unconsumed_tail；輸出剛好填滿時內部可能還有待輸出的資料
+                data = d.unconsumed_tail
+                if not data and len(out) < FILE_CHUNK:
+                    break
+            else:
+                # lzma：輸入留在解壓器內部，needs_input 表示這段已經解完
+                data = b""
+                if d.needs_input:
+                    break
+
+    def _write(self, data):
+        self.f.write(data)
+        if self.hasher is not None:
+            self.hasher.update(data)
+
+    def finish(self):
+        if self.decomp is not None and not self.decomp.eof:
+            raise ValueError("truncated compressed stream")
+        if self.sync:
+            self.f.flush()
+            os.fsync(self.f.fileno())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.f.close()
+
+def recv_file(sock, dest_path: str, offset: int = 0, encoding: Optional[str] = None,
+              hasher=None, sync: bool = False) -> bool:
     """
     接收檔案：
-    1. 讀取 8 bytes 檔案大小
-    2. 接收指定長度的 bytes 並寫入檔案
+    1. 讀取 8 bytes 長度
+    2. 接收指定長度的 bytes 並寫入檔案；offset > 0 時保留檔案前 offset bytes，從該處接續寫入 (續傳)。
+       中途斷線時已收到的部分會留在檔案中，下次可從檔案大小處續傳
+    encoding 為 FILE_ENCODINGS 之一時，收到的是壓縮串流，邊收邊解壓後寫檔 (只用於 offset == 0)
+    hasher (hashlib 物件) 會以寫入檔案的內容邊收邊更新，省去收完再讀一次檔；
+    sync=True 時回傳前 fsync，之後 rename 的檔案在斷電後也是完整的。
+    宣告的大小超過 MAX_FILE_SIZE 時丟出 ConnectionError：內容大到無法收掉丟棄，
+    連線上的 frame 已無法對齊，呼叫端必須關閉連線 (同 lobby_core 的 recv_file)
     """
+    # 1. 接收長度
+    header = recv_exact(sock, 8)
+    if not header:
+        return False
+    (filesize,) = struct.unpack("!Q", header)
+    if offset + filesize > MAX_FILE_SIZE:
+        raise ConnectionError("file too large")
     try:
-        # 1. 接收檔案大小
-        header = recv_exact(sock, 8)
-        if not header:
+        try:
+            rx = FileReceiver(dest_path, filesize, offset, encoding, hasher, sync)
+        except (ValueError, OSError) as e:
+            # 丟棄這次的內容，避免後續 frame 錯位
+            print(f"[RecvFile] Error: {e}")
+            _discard(sock, filesize)
             return False
-        (filesize,) = struct.unpack("!Q", header)
-        if filesize < 0 or filesize > MAX_FILE_SIZE:
-            return False
-        
-        # 2. 接收內容
+
+        # 2. 接收內容 (重用連線的接收緩衝區，直接 recv_into 後寫檔)
         received = 0
-        os.makedirs(os.path.dirname(dest_path) or ".", exist_ok=True)
-        with open(dest_path, 'wb') as f:
+        t0 = time.perf_counter()
+        view = conn_state(sock).rview
+        with rx:
             while received < filesize:
                 # 計算這次要收多少 (剩餘量 vs 緩衝區大小)
                 remains = filesize - received
-                chunk_size = min(65536, remains)
-                chunk = recv_exact(sock, chunk_size)
-                if not chunk:
+                chunk = view[:min(len(view), remains)]
+                if not recv_into_exact(sock, chunk):
                     raise ConnectionError("Connection lost during file transfer")
-                f.write(chunk)
                 received += len(chunk)
+                try:
+                    rx.feed(chunk)
+                except ValueError:
+                    # 把剩下的收掉，保持連線上的 frame 對齊
+                    _discard(sock, filesize - received)
+                    raise
+            rx.finish()
+        _record_transfer("recv", received, time.perf_counter() - t0, True)
         return True
     except Exception as e:
         print(f"[RecvFile] Error: {e}")